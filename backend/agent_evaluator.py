@@ -1,16 +1,18 @@
-import os, asyncio, json, statistics
+import os, asyncio, inspect, json, statistics, argparse, time
 from datetime import datetime
 from dotenv import load_dotenv
 from langsmith import Client, aevaluate
+from langsmith.evaluation import EvaluationResult
 from langchain_openai import ChatOpenAI
 from langchain_anthropic import ChatAnthropic
-from typing import TypedDict, Annotated
+from typing import TypedDict, Annotated, Dict, List, Any, Optional
 
-from agents import Agent, Runner, AsyncOpenAI, OpenAIChatCompletionsModel
-from app.tools import tools
-from app.data.repositories import ChatRepository
-from app.services.agent_instructions import get_agent_instructions
+from agents import Runner, AsyncOpenAI, set_tracing_disabled
+from app.data.repositories import ChatRepository, AsyncRepository
+from app.services.agent_factory import CoachAgentFactory, today_str
+from app.services.conversation_cache import to_agent_message, CHAT_HISTORY_LIMIT
 from openai.types.responses import ResponseTextDeltaEvent
+from eval_cassette import Cassette, CASSETTE_MODES, EVAL_CASSETTE_MODE, EVAL_CASSETTE_DIR
 
 load_dotenv()
 
@@ -22,6 +24,42 @@ AGENT_SLO = {
     "framework":        0.70,   # 框架合規分數 ≥ 70%（0~1）
 }
 
+# 評測使用的固定 session (每筆案例都接在這段歷史對話後面)
+EVAL_SESSION_ID = "afc433a0-3898-4f1c-8423-934e553c716f"
+EVAL_DATASET = "GentleCoach_Eval_20260411-185326"
+# 同時執行幾筆案例 (aevaluate 預設是 0，也就是一筆一筆跑)，以及同時幾個 Judge 呼叫，依供應商的 rate limit 調整
+EVAL_MAX_CONCURRENCY = int(os.getenv("EVAL_MAX_CONCURRENCY", "8"))
+EVAL_JUDGE_CONCURRENCY = int(os.getenv("EVAL_JUDGE_CONCURRENCY", "4"))
+
+# 整個評測共用一個 OpenAI Client 與 Agent 模板 (評測時不需特別 wrap，evaluate 會自動追蹤此函式)
+async_client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+agent_factory = CoachAgentFactory(async_client)
+chat_repo = AsyncRepository(ChatRepository())  # 非同步版本，撈資料庫時不會卡住其他正在跑的案例
+# 錄製 / 重播用的 cassette (預設關閉，main 依參數設定)
+cassette = Cassette(mode="off")
+
+# 歷史對話只撈一次並轉好格式，所有案例共用
+_shared_history: Optional[List[Dict[str, Any]]] = None
+_history_lock = asyncio.Lock()
+
+async def get_shared_history() -> List[Dict[str, Any]]:
+    global _shared_history
+    if _shared_history is None:
+        async with _history_lock:
+            if _shared_history is None:  # 等鎖的期間可能已經有人撈好了
+                if cassette.mode == "replay":
+                    chat_history = cassette.load_history()  # 重播時不連資料庫
+                else:
+                    # 撈取歷史對話記錄，這裡會由最舊的對話開始往後走 (最多50筆)
+                    chat_history = await chat_repo.get_recent_messages(EVAL_SESSION_ID, limit=CHAT_HISTORY_LIMIT)
+                    if chat_history is None:
+                        # 不要用空的歷史繼續評測 (結果會跟平常不一樣)，也不要錄進 cassette
+                        raise RuntimeError("撈取歷史對話失敗，請確認資料庫連線後再執行評測")
+                    if cassette.mode == "record":
+                        cassette.save_history(chat_history or [])
+                _shared_history = [to_agent_message(msg["role"], msg["content"], msg.get("image_url")) for msg in chat_history or []]
+    return _shared_history
+
 # ──────────────────────────────────────────────
 # 定義執行函數 (Run Function)
 # ──────────────────────────────────────────────
@@ -31,59 +69,16 @@ async def run_agent(inputs: dict) -> dict:
     """
     直接在評測中建立 Agent 並執行
     """
-    # 取得系統時間
-    now_str = datetime.now().strftime("%Y-%m-%d (%A)")
-    
-    # 初始化 OpenAI Client (評測時不需特別 wrap，evaluate 會自動追蹤此函式)
-    async_client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-    
-    # 建立 Agent 實例，這些都與 agent_service 內建立 Agent 的模式一樣
-    agent_model = OpenAIChatCompletionsModel(
-        model="gpt-4o",
-        openai_client=async_client
-    )
-    coach_agent = Agent(
-        name="GentleCoach",
-        instructions=get_agent_instructions(now_str),
-        tools=tools.AGENT_TOOLS,
-        model=agent_model
-    )
+    # 取得當天的 Agent，與 agent_service 內使用 Agent 的模式一樣 (clone 共用的模板)
+    # 重播時使用錄製當天的日期，instructions 才會跟錄製時一樣
+    coach_agent = agent_factory.get_agent(cassette.meta.get("today") or today_str())
 
     query = inputs.get("user_query", "")
     image_url = inputs.get("image_url", None)   # 可能沒有圖片
-    session_id = "afc433a0-3898-4f1c-8423-934e553c716f"
-    # 撈取歷史對話記錄，這裡會由最舊的對話開始往後走 (最多50筆)
-    chat_history = ChatRepository().get_recent_messages(session_id, limit=50)
-
-    # 先把歷史對話組進去，再加當次 user message
-    processed_messages = []
-    for msg in chat_history:
-        role = msg["role"]
-        text = msg["content"]
-        history_image_url = msg.get("image_url")
-
-        # 若這則訊息帶有圖片，則要傳入文字與圖片
-        if history_image_url:
-            processed_messages.append({
-                "role": role,
-                "content": [
-                    {"type": "input_text", "text": text},
-                    {"type": "input_image", "image_url": history_image_url},  # LLM 透過此網址看到圖片
-                ]
-            })
-        else:
-            processed_messages.append({"role": role, "content": text})
-    
-    processed_messages.append({"role": "user", "content": query})
-
-    # 再把當下 user message 組進去
-    if image_url:
-        processed_messages.append({"role": "user", "content": [
-            {"type": "input_text", "text": query},
-            {"type": "input_image", "image_url": image_url}, 
-        ]})
-    else:
-        processed_messages.append({"role": "user", "content": query})
+
+    # 共用的歷史對話 (複製 list，不要動到共用的內容)，再把當下 user message 組進去
+    processed_messages = list(await get_shared_history())
+    processed_messages.append(to_agent_message("user", query, image_url))
 
     full_text = ""
     actual_tool_calls = []
@@ -91,21 +86,23 @@ async def run_agent(inputs: dict) -> dict:
 
     # 這裡也是一樣用 agent_service 內的呼叫方法
     try:
-        # 使用 Runner 執行對話
-        result = Runner.run_streamed(
-            coach_agent,
-            input=processed_messages
-        )
-        async for event in result.stream_events():
-            if event.type == "run_item_stream_event":
-                if event.item.type == "tool_call_item":
-                    actual_tool_calls.append({
-                        "tool": event.item.raw_item.name,
-                        "args": event.item.raw_item.arguments
-                    })
-            elif event.type == "raw_response_event":
-                if isinstance(event.data, ResponseTextDeltaEvent) and event.data.delta:
-                    full_text += event.data.delta
+        # 這筆案例的模型與工具呼叫都會錄到 (或取自) 同一個 Tape，要在 run_streamed 開背景 task 前設定
+        with cassette.use_tape(inputs):
+            # 使用 Runner 執行對話
+            result = Runner.run_streamed(
+                coach_agent,
+                input=processed_messages
+            )
+            async for event in result.stream_events():
+                if event.type == "run_item_stream_event":
+                    if event.item.type == "tool_call_item":
+                        actual_tool_calls.append({
+                            "tool": event.item.raw_item.name,
+                            "args": event.item.raw_item.arguments
+                        })
+                elif event.type == "raw_response_event":
+                    if isinstance(event.data, ResponseTextDeltaEvent) and event.data.delta:
+                        full_text += event.data.delta
     except Exception as e:
         print(f"[Evaluation error]: Error during agent run: {e}")
 
@@ -213,6 +210,8 @@ judge_llm = ChatAnthropic(
     model="claude-sonnet-4-6",
     api_key=os.environ.get("ANTHROPIC_API_KEY")
 ).with_structured_output(FrameworkGrade)
+# Judge 有自己的並行上限，不會跟 Agent 的呼叫搶同一個額度
+judge_semaphore = asyncio.Semaphore(EVAL_JUDGE_CONCURRENCY)
  
 async def framework_evaluator(run, example):
     run_out, ex_out = _get_outputs(run, example)
@@ -240,8 +239,12 @@ async def framework_evaluator(run, example):
             - framework_score：回覆涵蓋幾個框架段落？完整 4 段 = 5 分，缺 1 段 = 4 分，以此類推
             - quality_score：資訊的準確性、專業深度、與 reference_response 的品質差距"""
  
+    async def call_judge():
+        async with judge_semaphore:
+            return await judge_llm.ainvoke(prompt)
+
     try:
-        grade = await judge_llm.ainvoke(prompt)
+        grade = await cassette.judge(prompt, call_judge)  # 重播時直接用錄下來的評分
         # 兩個分數各佔 50% 合成最終分數，除以 10 是因為兩個分數加起來滿分為 10
         combined = round((grade["framework_score"] + grade["quality_score"]) / 10.0, 2)
         return {
@@ -256,11 +259,12 @@ async def framework_evaluator(run, example):
 # SLO 檢查器
 # 評測結束後計算各 evaluator 的指標平均分數，並透過 create_feedback 寫回 LangSmith
 # ──────────────────────────────────────────────
-def check_slo_and_upload(client: Client, experiment_name: str, result_list: list) -> dict:
+def check_slo_and_upload(client: Optional[Client], experiment_name: str, result_list: list) -> dict:
     """
     1. result_list 是所有測評案例的結果，這裡收集各案例的 evaluator 分數
     2. 用 create_feedback 把 SLO 結果寫回 LangSmith 實驗
     3. 額外建一個 run 存 summary
+    client 是 None (離線重播) 時只計算、印出報告，不寫回 LangSmith
     """
     # 初始化各指標的分數列表 (key 是 SLO key，value 是分數列表)
     scores: dict[str, list[float]] = {key: [] for key in AGENT_SLO}
@@ -294,7 +298,7 @@ def check_slo_and_upload(client: Client, experiment_name: str, result_list: list
  
         # 對每筆 run 打上 per-run SLO pass/fail tag
         # 只要這筆 run 有拿到分數、且 run_id 存在，就寫 feedback
-        if run_id and per_run_scores:
+        if client is not None and run_id and per_run_scores:
             try:
                 for slo_key, threshold in AGENT_SLO.items():
                     run_score = per_run_scores.get(slo_key)
@@ -339,6 +343,9 @@ def check_slo_and_upload(client: Client, experiment_name: str, result_list: list
     print(f"  整體判定：{'🎉 ' if all_passed else '⚠️  '}{overall_verdict}")
     print("=" * 52 + "\n")
  
+    if client is None:
+        return report
+
     # ── 把 SLO 結果寫回 LangSmith ──
     # 為這次實驗建立一個 run，SLO feedback 都掛在它底下
     try:
@@ -382,35 +389,105 @@ def check_slo_and_upload(client: Client, experiment_name: str, result_list: list
     return report
  
  
+# ──────────────────────────────────────────────
+# 離線執行評測 (重播用)
+# aevaluate 一定會把每筆 run 送到 LangSmith 追蹤，重播時改用這個，回傳的結構與 aevaluate 相同
+# ──────────────────────────────────────────────
+async def evaluate_offline(target, examples: List[dict], evaluators: list, max_concurrency: int) -> list:
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def run_one(example: dict) -> dict:
+        async with semaphore:
+            run = {"id": "", "outputs": await target(example["inputs"])}
+            results = []
+            for evaluator in evaluators:
+                result = evaluator(run, example)
+                if inspect.isawaitable(result):
+                    result = await result
+                results.append(EvaluationResult(key=evaluator.__name__, score=result.get("score"), comment=result.get("comment")))
+            return {"run": run, "example": example, "evaluation_results": {"results": results}}
+
+    return await asyncio.gather(*(run_one(example) for example in examples))
+
+
+def use_cassette(mode: str, directory: str):
+    """切換錄製 / 重播模式：模型呼叫改走 cassette 的 transport，工具換成包裝過的版本"""
+    global cassette, async_client, agent_factory
+    cassette = Cassette(directory, mode)
+    if not cassette.active:
+        return
+    async_client = AsyncOpenAI(
+        api_key=os.environ.get("OPENAI_API_KEY") or "cassette-replay",  # 重播不會真的送出，沒有 key 也可以
+        http_client=cassette.http_client(),
+        max_retries=0 if mode == "replay" else 2,  # 重播時找不到回應就直接失敗，不要重試
+    )
+    agent_factory = CoachAgentFactory(async_client, agent_tools=cassette.wrap_tools(agent_factory.tools))
+    if mode == "replay":
+        set_tracing_disabled(True)  # 不上傳 Agents SDK 的 trace
+
+
 # 主程式
-async def main():
-    client = Client() # langsmith client
-    dataset_name = "GentleCoach_Eval_20260411-185326"
+async def main(dataset_name: str = EVAL_DATASET, max_concurrency: int = EVAL_MAX_CONCURRENCY,
+               judge_concurrency: int = EVAL_JUDGE_CONCURRENCY, cassette_mode: str = EVAL_CASSETTE_MODE,
+               cassette_dir: str = EVAL_CASSETTE_DIR):
+    global judge_semaphore
+    judge_semaphore = asyncio.Semaphore(judge_concurrency)
+    use_cassette(cassette_mode, cassette_dir)
+    replay = cassette.mode == "replay"
+    client = None if replay else Client()  # langsmith client，重播時完全不連線
     today_time = datetime.now().strftime("%Y%m%d-%H%M%S")
- 
-    print(f"🚀 開始完整評測（dataset: {dataset_name}）...")
- 
-    results = await aevaluate(
-        run_agent,
-        data=dataset_name,
-        evaluators=[
-            tool_selection_evaluator,   # A: 工具選擇
-            tool_args_evaluator,        # B: 工具參數
-            framework_evaluator,        # C: 框架合規（LLM-as-Judge）
-        ],
-        experiment_prefix=f"gentlecoach-test-{today_time}",
-    )
- 
-    print("✅ 評測完成！正在計算 SLO...")
- 
-    # aevaluate 回傳的是可迭代物件，轉成 list 才能多次使用
-    result_list = [r async for r in results] if hasattr(results, "__aiter__") else list(results)
+    evaluators = [
+        tool_selection_evaluator,   # A: 工具選擇
+        tool_args_evaluator,        # B: 工具參數
+        framework_evaluator,        # C: 框架合規（LLM-as-Judge）
+    ]
+
+    if replay:
+        dataset_name = cassette.meta.get("dataset", dataset_name)
+    print(f"🚀 開始完整評測（dataset: {dataset_name}，同時 {max_concurrency} 筆案例、{judge_concurrency} 個 Judge"
+          f"{f'，cassette: {cassette.mode} {cassette.directory}' if cassette.active else ''}）...")
+    start = time.perf_counter()
+    if cassette.mode == "record":
+        cassette.save_meta(dataset=dataset_name, today=today_str(), recorded_at=datetime.now().isoformat())
+    history = await get_shared_history()  # 先撈好共用的歷史對話，所有案例直接使用
+    print(f"📚 已載入共用歷史對話 {len(history)} 則")
+
+    if replay:
+        result_list = await evaluate_offline(run_agent, cassette.load_dataset(), evaluators, max_concurrency)
+    else:
+        data = dataset_name
+        if cassette.mode == "record":
+            # 先把 dataset 存下來，重播時不用再向 LangSmith 讀取
+            data = list(client.list_examples(dataset_name=dataset_name))
+            cassette.save_dataset(data)
+
+        results = await aevaluate(
+            run_agent,
+            data=data,
+            evaluators=evaluators,
+            experiment_prefix=f"gentlecoach-test-{today_time}",
+            max_concurrency=max_concurrency,
+        )
+
+        # aevaluate 回傳的是可迭代物件，轉成 list 才能多次使用
+        result_list = [r async for r in results] if hasattr(results, "__aiter__") else list(results)
+        cassette.save()
+    print(f"✅ 評測完成！共 {len(result_list)} 筆，耗時 {time.perf_counter() - start:.1f} 秒，正在計算 SLO...")
 
     # 計算 SLO 並寫回 LangSmith（在實驗頁可直接看到達標狀況）
     experiment_name = f"gentlecoach-test-{today_time}"
     check_slo_and_upload(client, experiment_name, result_list)
- 
-    print("🔗 詳細結果請至 LangSmith 查看")
+
+    if not replay:
+        print("🔗 詳細結果請至 LangSmith 查看")
  
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset", default=EVAL_DATASET)
+    parser.add_argument("--max-concurrency", type=int, default=EVAL_MAX_CONCURRENCY, help="同時執行幾筆案例 (1 = 依序執行)")
+    parser.add_argument("--judge-concurrency", type=int, default=EVAL_JUDGE_CONCURRENCY, help="同時幾個 LLM-as-Judge 呼叫")
+    parser.add_argument("--cassette-mode", choices=CASSETTE_MODES, default=EVAL_CASSETTE_MODE,
+                        help="record: 執行時錄製到 cassette；replay: 用 cassette 離線重跑")
+    parser.add_argument("--cassette-dir", default=EVAL_CASSETTE_DIR)
+    args = parser.parse_args()
+    asyncio.run(main(args.dataset, args.max_concurrency, args.judge_concurrency, args.cassette_mode, args.cassette_dir))
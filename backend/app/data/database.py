@@ -0,0 +1,64 @@
+import os, threading
+import httpx
+from supabase import create_client, Client
+from supabase.lib.client_options import SyncClientOptions
+from dotenv import load_dotenv
+
+load_dotenv()
+
+"""
+整個程序共用一個 Supabase client，底層是一個開啟 keep-alive 的 httpx 連線池
+Repository、tools、router 都透過 get_supabase() 取得，不要再自己呼叫 create_client
+建立與關閉由 main.py 的 FastAPI lifespan 管理
+"""
+
+# 連線池大小，至少要跟資料庫 thread pool (DB_MAX_WORKERS) 一樣大，才不會有 thread 在等連線
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "32"))
+SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", "60"))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "30"))
+
+_client: Client | None = None
+_http_client: httpx.Client | None = None
+_lock = threading.Lock()  # 避免多個 thread 同時第一次呼叫時建立出兩個 client
+
+
+def get_supabase() -> Client:
+    """取得共用的 Supabase client，第一次呼叫時才建立"""
+    global _client, _http_client
+    if _client is not None:
+        return _client
+
+    with _lock:
+        if _client is None:
+            url = os.getenv("SUPABASE_URL")
+            key = os.getenv("SUPABASE_KEY")
+            if not url or not key:
+                raise ValueError("Supabase URL or Key not found in env")
+
+            # 同一個 httpx.Client 會重複使用 TCP/TLS 連線，PostgREST、Storage 都共用這個連線池
+            _http_client = httpx.Client(
+                timeout=SUPABASE_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=SUPABASE_MAX_CONNECTIONS,
+                    max_keepalive_connections=SUPABASE_MAX_CONNECTIONS,
+                    keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY,
+                ),
+            )
+            _client = create_client(url, key, options=SyncClientOptions(httpx_client=_http_client))
+    return _client
+
+
+def get_supabase_http() -> httpx.Client:
+    """取得共用 client 底層的 httpx 連線池 (給需要直接呼叫 Supabase REST API 的地方使用)"""
+    get_supabase()
+    return _http_client
+
+
+def close_supabase():
+    """關閉共用的連線池 (應用程式結束時呼叫)"""
+    global _client, _http_client
+    with _lock:
+        if _http_client is not None:
+            _http_client.close()
+        _client = None
+        _http_client = None
@@ -1,38 +1,118 @@
-import os
-from supabase import create_client, Client
-from app.data.schema import FoodAnalysisResult, WorkoutLogRequest
+import os, asyncio, contextvars, functools
+from concurrent.futures import ThreadPoolExecutor
+from supabase import Client
+from postgrest.types import ReturnMethod
+from app.data.database import get_supabase
+from app.data.schema import FoodAnalysisResult, FoodAnalyzeRequest, WorkoutLogRequest
 from dotenv import load_dotenv
 from datetime import datetime, timezone, timedelta
-from typing import Optional, List
+from typing import Optional, List, Any, Callable, Tuple
 
 load_dotenv()
 
-# 負責查詢資料庫的一切對話記錄操作
-class ChatRepository:
-    def __init__(self):
-        url = os.getenv("SUPABASE_URL")
-        key = os.getenv("SUPABASE_KEY")
-        if not url or not key:
-            raise ValueError("Supabase URL or Key not found in env")
-        self.supabase: Client = create_client(url, key)  # 建立 Supabase 連線
+# supabase-py 的 .execute() 是同步阻塞的網路呼叫，若直接在 async 函式內呼叫會卡住整個 event loop
+# 所以非同步的呼叫端一律丟到這個有上限的 thread pool 執行，上限可用環境變數調整
+DB_MAX_WORKERS = int(os.getenv("DB_MAX_WORKERS", "16"))
+_db_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="supabase-db")
+
+async def run_in_db_executor(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    在資料庫專用的 thread pool 執行同步函式，並等待結果
+    會複製目前的 context，讓 ContextVar (例如 LangSmith 追蹤、圖片網址) 在 thread 內也拿得到
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(_db_executor, functools.partial(ctx.run, func, *args, **kwargs))
+
+class AsyncRepository:
+    """
+    將同步的 Repository 包裝成非同步版本，方法名稱與參數完全相同，只是要用 await 呼叫
+    例如: await AsyncRepository(FoodRepository()).get_today_summary()
+    """
+    def __init__(self, repo):
+        self._repo = repo
+
+    @property
+    def sync(self):
+        """原本的同步 Repository (已經在 thread pool 內執行的程式使用，例如大量匯入)"""
+        return self._repo
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._repo, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def wrapper(*args, **kwargs):
+            return await run_in_db_executor(attr, *args, **kwargs)
+        return wrapper
+
+TW_TZ = timezone(timedelta(hours=8))  # 台北時間是 UTC+8
+BODY_PARTS = ["胸部", "背部", "腿部", "肩膀", "手臂", "核心"]
+
+def start_of_month_utc() -> datetime:
+    """台灣時間當年當月 1 號 00:00:00，轉成 UTC"""
+    now_tw = datetime.now(TW_TZ)
+    return datetime(now_tw.year, now_tw.month, 1, tzinfo=TW_TZ).astimezone(timezone.utc)
 
-    def get_recent_messages(self, session_id: str, limit: int):
+# 所有 Repository 的共同父類別，負責取得 Supabase 連線
+class BaseRepository:
+    def __init__(self, supabase: Client | None = None):
+        self._supabase = supabase  # 可以指定 client (例如測試用)，沒指定就用全域共用的連線池
+
+    @property
+    def supabase(self) -> Client:
+        return self._supabase or get_supabase()
+
+    def _insert_rows(self, table: str, rows: List[dict]) -> bool:
+        """
+        大量匯入用：一個 INSERT 寫入多筆，不要求回傳寫入的資料 (returning=minimal)，省下回傳整批資料的時間
+        成功回傳 True，失敗回傳 False
+        """
+        try:
+            self.supabase.table(table).insert(rows, returning=ReturnMethod.minimal).execute()
+            return True
+        except Exception as e:
+            print(f"Supabase Error ({table} 批次匯入): {e}")
+            return False
+
+    def _keyset_page(self, table: str, columns: str, limit: int, cursor: Optional[Tuple[str, Any]] = None) -> Optional[List[dict]]:
+        """
+        大量匯出用：依 (created_at, id) 由舊到新取一頁，cursor 是上一頁最後一筆的 (created_at, id)
+        查詢失敗時回傳 None
+        """
+        try:
+            query = self.supabase.table(table).select(columns)
+            if cursor:
+                created_at, row_id = cursor
+                # 時間字串含有 + 和 :，要用雙引號包起來
+                query = query.or_(f'created_at.gt."{created_at}",and(created_at.eq."{created_at}",id.gt.{row_id})')
+            response = query.order("created_at").order("id").limit(limit).execute()
+            return response.data
+        except Exception as e:
+            print(f"Error fetching {table} page: {e}")
+            return None
+
+# 負責查詢資料庫的一切對話記錄操作
+class ChatRepository(BaseRepository):
+    def get_recent_messages(self, session_id: str, limit: int) -> Optional[List[dict]]:
         """
         取得最近的 N 筆對話記錄，並按時間新舊排序 (給 LLM 讀的順序)
+        查詢失敗時回傳 None (與「沒有記錄」的空陣列區分，呼叫端才不會把暫時的錯誤當成沒有歷史)
         """
         try:
             # 要取出全部的對話
             if(limit == 0):
                 # 這裡存的是圖片公開網址，內部 supabase 還要用網址去 bucket 存圖片
                 response = self.supabase.table("chat_messages")\
-                    .select("role, content, image_url")\
+                    .select("role, content, image_url, created_at")\
                     .eq("session_id", session_id)\
                     .order("created_at", desc=True)\
                     .execute()
             else:
                 # 根據 session_id 查詢最新到最舊的記錄，並只取前 limit 筆
                 response = self.supabase.table("chat_messages")\
-                    .select("role, content, image_url")\
+                    .select("role, content, image_url, created_at")\
                     .eq("session_id", session_id)\
                     .order("created_at", desc=True)\
                     .limit(limit)\
@@ -45,7 +125,39 @@ class ChatRepository:
 
         except Exception as e:
             print(f"Error fetching chat history: {e}")
-            return []
+            return None
+
+    def get_messages_page(self, session_id: str, limit: int, cursor: Optional[Tuple[str, Any]] = None,
+                          newest_first: bool = True) -> Optional[List[dict]]:
+        """
+        以 keyset 分頁取得一頁對話記錄 (依 (created_at, id) 排序，不管翻到第幾頁都只掃一頁的資料)
+        Args:
+            limit: 這一頁最多幾筆
+            cursor: 上一頁最後一筆的 (created_at, id)，不給代表從頭開始
+            newest_first: True 由新到舊 (往前翻舊訊息)，False 由舊到新 (完整匯出)
+        Returns:
+            依查詢順序排列的記錄，查詢失敗時回傳 None
+        """
+        try:
+            query = self.supabase.table("chat_messages")\
+                .select("id, role, content, image_url, created_at")\
+                .eq("session_id", session_id)
+
+            if cursor:
+                created_at, message_id = cursor
+                op = "lt" if newest_first else "gt"
+                # (created_at, id) < (cursor) 或 > (cursor)，時間字串含有 + 和 :，要用雙引號包起來
+                query = query.or_(f'created_at.{op}."{created_at}",and(created_at.eq."{created_at}",id.{op}.{message_id})')
+
+            response = query.order("created_at", desc=newest_first)\
+                .order("id", desc=newest_first)\
+                .limit(limit)\
+                .execute()
+            return response.data
+
+        except Exception as e:
+            print(f"Error fetching chat history page: {e}")
+            return None
 
     def create_message(self, session_id: str, role: str, content: str, image_url: str | None = None):
         """
@@ -59,31 +171,75 @@ class ChatRepository:
                 "content": content,
                 "image_url": image_url 
             }
-            self.supabase.table("chat_messages").insert(data).execute()
-            return True
+            response = self.supabase.table("chat_messages").insert(data).execute()
+            # 回傳剛寫入的那筆資料 (包含資料庫產生的 created_at)
+            return response.data[0] if response.data else True
         except Exception as e:
             print(f"Error creating chat message: {e}")
             return False
 
-# 負責存取 workout_logs database
-class WorkOutRepository:
-    def __init__(self):
-        url = os.getenv("SUPABASE_URL")
-        key = os.getenv("SUPABASE_KEY")
-        if not url or not key:
-            raise ValueError("Supabase URL or Key not found in env")
-        self.supabase: Client = create_client(url, key)  # 建立 Supabase 連線
+    def create_messages_batch(self, rows: List[dict]) -> Optional[List[dict]]:
+        """
+        一次寫入多則對話訊息 (背景寫入佇列使用)，只會送出一個 INSERT
+        Args:
+            rows: 每則包含 session_id, role, content, image_url, created_at，依順序寫入
+        Returns:
+            寫入成功的資料，失敗時回傳 None (讓呼叫端決定要不要重試)
+        """
+        try:
+            response = self.supabase.table("chat_messages").insert(rows).execute()
+            return response.data or []
+        except Exception as e:
+            print(f"Error creating chat messages batch: {e}")
+            return None
 
+    def get_summary(self, session_id: str) -> Optional[dict]:
+        """
+        取得 session 較早對話的滾動摘要: {"summary": ..., "folded_until": 摘要涵蓋到的最後一則訊息時間}
+        還沒有摘要時回傳空的 dict，查詢失敗時回傳 None (不可以當成沒有摘要，否則下次更新會覆蓋掉原本的摘要)
+        """
+        try:
+            response = self.supabase.table("chat_summaries")\
+                .select("summary, folded_until")\
+                .eq("session_id", session_id)\
+                .limit(1)\
+                .execute()
+            return response.data[0] if response.data else {}
+        except Exception as e:
+            print(f"Error fetching chat summary: {e}")
+            return None
+
+    def save_summary(self, session_id: str, summary: str, folded_until: str | None):
+        """新增或更新 session 的滾動摘要"""
+        try:
+            data = {
+                "session_id": session_id,
+                "summary": summary,
+                "folded_until": folded_until,
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+            }
+            self.supabase.table("chat_summaries").upsert(data).execute()
+            return True
+        except Exception as e:
+            print(f"Error saving chat summary: {e}")
+            return False
+
+# 負責存取 workout_logs database
+class WorkOutRepository(BaseRepository):
 
     # 接收到前端請求，將健身記錄寫入資料庫
-    def save_workout_logs(self, workout_data: WorkoutLogRequest):
-        data_to_insert = {
+    @staticmethod
+    def _workout_row(workout_data: WorkoutLogRequest) -> dict:
+        return {
             "exercise_name": workout_data.exercise_name,
             "body_part": workout_data.body_part,
             "weight": workout_data.weight,
             "sets": workout_data.sets,
             "reps": workout_data.reps,
         }
+
+    def save_workout_logs(self, workout_data: WorkoutLogRequest):
+        data_to_insert = self._workout_row(workout_data)
         try:
             response = self.supabase.table("workout_logs").insert(data_to_insert).execute()
             # response.data 是一個 list，裡面包含一筆剛寫入的資料
@@ -96,6 +252,31 @@ class WorkOutRepository:
             print(f"資料寫入失敗，但仍返回 AI 分析結果")
             return None
 
+    def save_workout_logs_batch(self, workouts: List[WorkoutLogRequest]) -> Optional[List[dict]]:
+        """
+        一次寫入多筆健身記錄，只會送出一個 INSERT (同一個 statement，要嘛全部成功、要嘛全部失敗)
+        Returns:
+            寫入成功的資料 (順序與傳入相同)，失敗時回傳 None
+        """
+        if not workouts:
+            return []
+        try:
+            response = self.supabase.table("workout_logs").insert([self._workout_row(w) for w in workouts]).execute()
+            if response.data:
+                return response.data
+            raise Exception("Failed to save workout logs batch")
+        except Exception as e:
+            print(f"Supabase Error: {e}")
+            return None
+
+    def import_workout_rows(self, rows: List[dict]) -> bool:
+        """匯入已驗證好的健身記錄 (一批一個 INSERT)"""
+        return self._insert_rows("workout_logs", rows)
+
+    def get_workout_logs_page(self, limit: int, cursor: Optional[Tuple[str, Any]] = None) -> Optional[List[dict]]:
+        """匯出用，依 (created_at, id) 由舊到新取一頁健身記錄"""
+        return self._keyset_page("workout_logs", "id, exercise_name, body_part, weight, sets, reps, created_at", limit, cursor)
+
     # 根據使用者的查詢條件，從資料庫中取出最近的健身記錄
     def get_filtered_workouts(self, days: int, body_parts: Optional[List[str]] = None):
         # 取得絕對的現在時間 (UTC)
@@ -122,64 +303,31 @@ class WorkOutRepository:
             return []
 
     def get_workout_heatmap_month(self):
-        """取得當前月份每天的訓練次數"""
-        tw_tz = timezone(timedelta(hours=8))
-        now_tw = datetime.now(tw_tz)
-        # 台灣時間當年當月 1 號 00:00:00
-        start_of_month = datetime(now_tw.year, now_tw.month, 1, tzinfo=tw_tz)
-        # 將台灣時間校正回 UTC 給 Supabase 查詢，並轉換回字串格式
-        start_of_month_utc = start_of_month.astimezone(timezone.utc).isoformat()
+        """取得當前月份每天的訓練次數 (在資料庫內以台北時間分組彙總)"""
+        # 將台灣時間本月 1 號校正回 UTC 給 Supabase 查詢，並轉換回字串格式
+        since = start_of_month_utc().isoformat()
         try:
-            # 查詢從當月 1 號以來的資料
-            response = self.supabase.table("workout_logs").select("created_at").gte("created_at", start_of_month_utc).execute()
-            data = response.data
-            
-            heatmap = {}
-            # 統計一個月內訓練次數
-            for row in data:
-                date_str = row["created_at"].split("T")[0]
-                heatmap[date_str] = heatmap.get(date_str, 0) + 1  # 只要那個日期有一筆數據就加 1可以算出那天練了多少
-            
-            # 轉換為前端需要的格式，包含精確的 count
-            result = [{"date": k, "count": v} for k, v in heatmap.items()]
-            return result
+            # 回傳格式: [{"date": "2026-03-01", "count": 2}, ...]，一個月最多幾十筆
+            response = self.supabase.rpc("dashboard_workout_heatmap", {"start_at": since}).execute()
+            return [{"date": row["date"], "count": row["count"]} for row in response.data]
         except Exception as e:
             print(f"Heatmap data fetch error: {e}")
             return []
 
     def get_body_part_stats_month(self):
-        """取得當前月份各部位的訓練分佈"""
-        tw_tz = timezone(timedelta(hours=8))
-        now_tw = datetime.now(tw_tz)
-        start_of_month = datetime(now_tw.year, now_tw.month, 1, tzinfo=tw_tz)
-        start_of_month_utc = start_of_month.astimezone(timezone.utc).isoformat()
-
+        """取得當前月份各部位的訓練分佈 (在資料庫內分組彙總)"""
+        since = start_of_month_utc().isoformat()
         try:
-            # 查詢從當月 1 號以來的資料
-            response = self.supabase.table("workout_logs").select("body_part").gte("created_at", start_of_month_utc).execute()
-            data = response.data
-            stats = {}
-            # 計算這個月每天每個部位訓練的次數
-            for row in data:
-                part = row["body_part"]
-                stats[part] = stats.get(part, 0) + 1  # body_part 不存在就建立
-            
-            all_parts = ["胸部", "背部", "腿部", "肩膀", "手臂", "核心"]
-            result = [{"body_part": part, "count": stats.get(part, 0)} for part in all_parts]
-            return result
+            response = self.supabase.rpc("dashboard_body_part_stats", {"start_at": since}).execute()
+            stats = {row["body_part"]: row["count"] for row in response.data}
+            # 沒練到的部位也要列出，次數為 0
+            return [{"body_part": part, "count": stats.get(part, 0)} for part in BODY_PARTS]
         except Exception as e:
             print(f"Body part stats fetch error: {e}")
             return []
 
 # 負責存取 food_logs database
-class FoodRepository:
-    def __init__(self):
-        url = os.getenv("SUPABASE_URL")
-        key = os.getenv("SUPABASE_KEY")
-        if not url or not key:
-            raise ValueError("Supabase URL or Key not found in env")
-        self.supabase: Client = create_client(url, key)  # 建立 Supabase 連線
-
+class FoodRepository(BaseRepository):
     def get_today_summary(self):
         """取得今日攝取的營養總和 (以台北時間為準)"""
         # 台北時間是 UTC+8
@@ -191,31 +339,19 @@ class FoodRepository:
         start_of_day_utc = start_of_day.astimezone(timezone.utc).isoformat()
 
         try:
-            response = self.supabase.table("food_logs").select("calories, protein, fat, carbs").gte("created_at", start_of_day_utc).execute()
-            data = response.data
-            summary = {"calories": 0, "protein": 0, "fat": 0, "carbs": 0}
-            for row in data:
-                summary["calories"] += row["calories"]
-                summary["protein"] += row["protein"]
-                summary["fat"] += row["fat"]
-                summary["carbs"] += row["carbs"]
+            # 在資料庫內加總，只回傳一筆
+            response = self.supabase.rpc("dashboard_nutrition_totals", {"start_at": start_of_day_utc}).execute()
+            row = response.data[0] if response.data else {}
+            summary = {key: row.get(key) or 0 for key in ("calories", "protein", "fat", "carbs")}
             return summary  # 返回字典回去
         except Exception as e:
             print(f"Today summary fetch error: {e}")
             return {"calories": 0, "protein": 0, "fat": 0, "carbs": 0}
 
-    def save_food_logs(self, food_data: FoodAnalysisResult, image_url: str, food_name: str, meal_type: str) -> dict:
-        """
-        將 AI 分析結果寫入 Supabase 的 food_log 資料表中
-        Args:
-            food_data: AI 分析出來的數據
-            image_url: 圖片的 Supabase 公開網址 URL 字串
-            food_name: 使用者填寫的食物名稱
-            meal_type: 使用者選擇的用餐時段
-        """
-
-        # 過濾出要存進資料庫的欄位
-        data_to_insert = {
+    @staticmethod
+    def _to_food_row(food_data: FoodAnalysisResult, image_url: str, food_name: str, meal_type: str) -> dict:
+        """過濾出要存進資料庫的欄位"""
+        return {
             "food_name": food_name,
             "image_url": image_url, 
             "meal_type": meal_type,  # 上述兩者直接用使用者填寫的資料
@@ -227,6 +363,17 @@ class FoodRepository:
             "coach_comment": food_data.coach_comment,
         }
 
+    def save_food_logs(self, food_data: FoodAnalysisResult, image_url: str, food_name: str, meal_type: str) -> dict:
+        """
+        將 AI 分析結果寫入 Supabase 的 food_log 資料表中
+        Args:
+            food_data: AI 分析出來的數據
+            image_url: 圖片的 Supabase 公開網址 URL 字串
+            food_name: 使用者填寫的食物名稱
+            meal_type: 使用者選擇的用餐時段
+        """
+        data_to_insert = self._to_food_row(food_data, image_url, food_name, meal_type)
+
         try:
             response = self.supabase.table("food_logs").insert(data_to_insert).execute()
             # response.data 是一個 list，裡面包含一筆剛寫入的資料
@@ -238,3 +385,57 @@ class FoodRepository:
             print(f"Supabase Error: {e}")
             print(f"資料寫入失敗，但仍返回 AI 分析結果")
             return None
+
+    def save_food_logs_batch(self, entries: List[Tuple[FoodAnalysisResult, FoodAnalyzeRequest]]) -> List[dict]:
+        """
+        一次寫入多筆飲食記錄，只會送出一個 INSERT (減少資料庫來回次數)
+        Args:
+            entries: (AI 分析結果, 前端傳來的請求) 的 list
+        Returns:
+            寫入成功的資料，失敗時回傳空 list
+        """
+        if not entries:
+            return []
+
+        data_to_insert = [
+            self._to_food_row(food_data, req.image_url, req.food_name, req.meal_type)
+            for food_data, req in entries
+        ]
+        try:
+            response = self.supabase.table("food_logs").insert(data_to_insert).execute()
+            return response.data or []
+        except Exception as e:
+            print(f"Supabase Error: {e}")
+            print(f"批次資料寫入失敗，但仍返回 AI 分析結果")
+            return []
+
+    def import_food_rows(self, rows: List[dict]) -> bool:
+        """匯入已驗證好的飲食記錄 (一批一個 INSERT)"""
+        return self._insert_rows("food_logs", rows)
+
+    def get_food_logs_page(self, limit: int, cursor: Optional[Tuple[str, Any]] = None) -> Optional[List[dict]]:
+        """匯出用，依 (created_at, id) 由舊到新取一頁飲食記錄"""
+        return self._keyset_page(
+            "food_logs",
+            "id, food_name, meal_type, image_url, calories, protein, fat, carbs, score, coach_comment, created_at",
+            limit, cursor
+        )
+
+# 負責維護每日彙總表 (daily_nutrition_rollup / daily_training_rollup)
+# 平常由資料庫的 trigger 在每次寫入 food_logs / workout_logs 時即時更新，這裡只負責重建
+class RollupRepository(BaseRepository):
+    def rebuild(self, from_day: Optional[str] = None) -> Optional[dict]:
+        """
+        從原始記錄重建彙總表 (第一次部署回填，或手動修改過原始資料後使用)
+        重建期間資料庫會鎖住 food_logs / workout_logs 的寫入，記錄飲食與訓練的請求會等到重建完成
+        Args:
+            from_day: 只重建這天 (含) 之後的資料，格式 YYYY-MM-DD，不給代表全部重建
+        Returns:
+            {"nutrition_days": 彙總表天數, "training_rows": 訓練彙總筆數}，失敗時回傳 None
+        """
+        try:
+            response = self.supabase.rpc("rebuild_daily_rollups", {"from_day": from_day}).execute()
+            return response.data[0] if response.data else None
+        except Exception as e:
+            print(f"Rebuild daily rollups error: {e}")
+            return None
@@ -1,5 +1,6 @@
-from pydantic import BaseModel, Field
-from typing import List, Optional, Literal
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Dict, List, Optional, Literal
+from datetime import datetime
 
 """
 所有資料都需要經過以下定義驗證
@@ -24,6 +25,16 @@ class FoodAnalyzeRequest(BaseModel):
     food_name: str = Field(..., description="食物的名稱，例如：牛肉麵")
     meal_type: str = Field(..., description="餐點類型，例如：早餐、午餐等")
 
+# 一次分析多張飲食照片 (例如補記一整天的餐點)
+class FoodAnalyzeBatchRequest(BaseModel):
+    items: List[FoodAnalyzeRequest] = Field(..., min_length=1, max_length=20, description="要分析的餐點，一次最多 20 張")
+
+# 批次分析中單一張照片的結果，分析失敗時 result 為 None 並附上 error
+class FoodAnalyzeBatchItem(BaseModel):
+    index: int = Field(..., description="對應 items 中的位置")
+    result: Optional[FoodAnalysisResult] = None
+    error: Optional[str] = None
+
 # 前端傳來的健身記錄請求格式
 class WorkoutLogRequest(BaseModel):
     exercise_name: str = Field(..., description="運動名稱")
@@ -32,6 +43,58 @@ class WorkoutLogRequest(BaseModel):
     sets: int = Field(..., description="組數")
     reps: int = Field(..., description="次數")
 
+# 一次記錄多個訓練動作 (POST /workout/batch)，整批一起驗證、一起寫入
+class WorkoutLogBatchRequest(BaseModel):
+    items: List[WorkoutLogRequest] = Field(..., min_length=1, max_length=50, description="要記錄的訓練動作，一次最多 50 筆")
+
+# --- 大量匯入 / 匯出 (POST /import/{kind}, GET /export/{kind}) ---
+# 匯入檔案中的一筆健身記錄，created_at 不給代表匯入的時間
+class WorkoutImportRow(WorkoutLogRequest):
+    created_at: Optional[datetime] = Field(None, description="訓練時間 (ISO 8601)")
+
+# 匯入檔案中的一筆飲食記錄，營養素欄位沿用 FoodAnalysisResult，從其他 App 匯入的資料通常沒有 AI 的說明，給預設值
+class FoodImportRow(FoodAnalysisResult):
+    food_name: str = Field(..., description="食物名稱")
+    meal_type: str = Field(..., description="餐點類型，例如：早餐、午餐等")
+    image_url: str = Field("", description="圖片網址，沒有的話留空")
+    coach_comment: str = Field("", description="簡短的營養評價與建議")
+    reasoning: str = Field("", description="估算方式")
+    created_at: Optional[datetime] = Field(None, description="用餐時間 (ISO 8601)")
+
+# 匯入失敗的資料列
+class ImportRowError(BaseModel):
+    line: int = Field(..., description="在檔案中的行數 (CSV 含標題列，Parquet 為第幾筆)")
+    error: str
+
+# 匯入結果
+class ImportReport(BaseModel):
+    imported: int = 0
+    failed: int = 0
+    chunks: int = 0
+    seconds: float = 0.0
+    truncated: bool = Field(False, description="讀檔途中出錯而提早結束，最後一筆失敗記錄的行數之後都沒有匯入")
+    errors: List[ImportRowError] = Field(default_factory=list, description="失敗的資料列 (最多列出前 100 筆)")
+
+# --- 健身記錄分析 (analyze_workout_progress 工具與 Dashboard 共用) ---
+# 某個動作的進步狀況，alias 是工具回傳給 LLM 時使用的中文欄位名稱
+class ProgressHighlight(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    exercise_name: str = Field(..., alias="動作")
+    kind: str = Field(..., alias="類型", description="例如：重量提升、組數提升")
+    improvement: str = Field(..., alias="進步", description="例如：+2.5kg")
+
+class WorkoutSummaryStats(BaseModel):
+    total_days: int = Field(..., description="查詢範圍內有訓練的天數")
+    weekly_frequency: str = Field(..., description="每週平均訓練次數，例如：3.5次")
+    part_distribution: Dict[str, str] = Field(..., description="各部位佔比，例如：{'胸部': '40.0%'}")
+    progress_highlights: List[ProgressHighlight]
+
+# 健身記錄的分析結果，只有工具需要 workout_raw_data (每筆記錄給 LLM 看的格式)，Dashboard 不需要時為 None
+class WorkoutAnalytics(BaseModel):
+    workout_raw_data: Optional[List[Dict[str, str]]] = Field(None, description="每筆記錄: {'日期', '動作', '部位', '數據'}")
+    summary_stats: WorkoutSummaryStats
+
 # --- AI ChatBot 的資料 ---
 class ChatRequest(BaseModel):
     """
@@ -0,0 +1,63 @@
+import os
+from urllib.parse import quote
+import httpx
+from app.data.database import get_supabase_http
+
+"""
+Supabase Storage 的檔案操作
+storage3 的 copy() 只能在同一個 bucket 內複製，跨 bucket 時直接呼叫 Storage API 的 /object/copy，
+讓檔案在伺服器端複製，不用先下載到後端再上傳
+"""
+
+STREAM_CHUNK_SIZE = 256 * 1024  # 無法伺服器端複製時，串流搬移每次傳送的大小
+
+
+class StorageClient:
+    def __init__(self, http_client: httpx.Client | None = None, url: str | None = None, key: str | None = None):
+        self._http_client = http_client  # 沒指定就用全域共用的連線池
+        self.base_url = (url or os.getenv("SUPABASE_URL", "")).rstrip("/") + "/storage/v1"
+        key = key or os.getenv("SUPABASE_KEY", "")
+        self.headers = {"apikey": key, "Authorization": f"Bearer {key}"}
+
+    @property
+    def http(self) -> httpx.Client:
+        return self._http_client or get_supabase_http()
+
+    def _object_url(self, bucket: str, path: str) -> str:
+        return f"{self.base_url}/object/{bucket}/{quote(path)}"
+
+    def copy_object(self, src_bucket: str, src_path: str, dst_bucket: str, dst_path: str):
+        """
+        把 src_bucket/src_path 複製到 dst_bucket/dst_path
+        優先使用伺服器端複製 (只有一次 API 呼叫，檔案不經過後端)，失敗才改用串流搬移
+        """
+        response = self.http.post(
+            f"{self.base_url}/object/copy",
+            headers=self.headers,
+            json={
+                "bucketId": src_bucket,
+                "sourceKey": src_path,
+                "destinationBucket": dst_bucket,
+                "destinationKey": dst_path,
+            },
+        )
+        if response.is_success:
+            return
+
+        print(f"Storage 伺服器端複製失敗 ({response.status_code})，改用串流搬移: {response.text}")
+        self._stream_copy(src_bucket, src_path, dst_bucket, dst_path)
+
+    def _stream_copy(self, src_bucket: str, src_path: str, dst_bucket: str, dst_path: str):
+        """一邊下載一邊上傳，記憶體內最多只有一個 chunk，不會把整張圖片讀進來"""
+        with self.http.stream("GET", self._object_url(src_bucket, src_path), headers=self.headers) as source:
+            source.raise_for_status()
+            content_type = source.headers.get("content-type", "application/octet-stream")
+            response = self.http.post(
+                self._object_url(dst_bucket, dst_path),
+                headers={**self.headers, "content-type": content_type},
+                content=source.iter_bytes(STREAM_CHUNK_SIZE),
+            )
+            response.raise_for_status()
+
+
+storage_client = StorageClient()
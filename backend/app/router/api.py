@@ -1,13 +1,25 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Request, Response, UploadFile, status
 from fastapi.responses import StreamingResponse
-from typing import List
-from app.data.schema import FoodAnalyzeRequest, FoodAnalysisResult, ChatRequest, MessageSchema, WorkoutLogRequest, DashboardSummary, TodayNutrition
+from starlette.background import BackgroundTask
+from typing import List, Literal, Optional, Tuple
+from datetime import datetime
+from app.data.schema import FoodAnalyzeRequest, FoodAnalysisResult, FoodAnalyzeBatchRequest, FoodAnalyzeBatchItem, ChatRequest, MessageSchema, WorkoutLogRequest, WorkoutLogBatchRequest, DashboardSummary, TodayNutrition, ImportReport
 from app.services.ai_service import OpenAIService    # 負責 AI 圖片分析
+from app.services.vision_cache import vision_cache
+from app.services.dashboard_cache import dashboard_cache
+from app.services.message_writer import chat_message_writer
+from app.services.search_service import web_search_service
+from app.services.tool_executor import tool_stats
+from app.services.bulk_io import import_file, stream_export, detect_format
+from app.services.admission import chat_admission, AdmissionRejected, ChatTicket
 from app.services.agent_service import AgentService  # 負責 Agent 的服務 (對話、調用工具)
-from app.data.repositories import ChatRepository, WorkOutRepository, FoodRepository
-from app.tools.tools import fetch_workout_analytics
+from app.data.repositories import ChatRepository, WorkOutRepository, FoodRepository, AsyncRepository, run_in_db_executor
+from app.tools.tools import get_workout_analytics
 import traceback
 import json
+import asyncio
+import base64
+import os
 
 """
 這裡建立 API 的路由，並呼叫 services 的方法
@@ -18,9 +30,10 @@ router = APIRouter(
     tags=["AI GentleGains API"]
 )
 
-food_repo = FoodRepository()  # 負責資料庫操作
-workout_repo = WorkOutRepository()  # 負責資料庫操作
-chat_repo = ChatRepository()  # 負責資料庫操作
+# Repository 都包成非同步版本，資料庫 I/O 會在 thread pool 執行，不會卡住其他串流
+food_repo = AsyncRepository(FoodRepository())  # 負責資料庫操作
+workout_repo = AsyncRepository(WorkOutRepository())  # 負責資料庫操作
+chat_repo = AsyncRepository(ChatRepository())  # 負責資料庫操作
 agent_service = AgentService()  # 負責 AI 助手的實例
 
 # --- 以下開始路由每個 API ---
@@ -28,13 +41,59 @@ agent_service = AgentService()  # 負責 AI 助手的實例
 @router.post("/workout", status_code=status.HTTP_200_OK, summary="Add workout log")
 async def add_workout(workout_data: WorkoutLogRequest):
     try:
-        response = workout_repo.save_workout_logs(workout_data)
+        response = await workout_repo.save_workout_logs(workout_data)
+        if response:
+            dashboard_cache.invalidate()  # 有新的訓練記錄，儀表板要重新計算
         return response
     except Exception as e:
         error_traceback = traceback.format_exc()
         print(error_traceback)
         raise HTTPException(status_code=500, detail=f"{error_traceback}")
 
+# 一次新增多筆健身記錄，整批驗證後用一個 INSERT 寫入
+@router.post("/workout/batch", status_code=status.HTTP_200_OK, summary="Add workout logs in batch")
+async def add_workout_batch(request: WorkoutLogBatchRequest):
+    try:
+        response = await workout_repo.save_workout_logs_batch(request.items)
+        if response:
+            dashboard_cache.invalidate()  # 有新的訓練記錄，儀表板要重新計算
+        return response
+    except Exception as e:
+        error_traceback = traceback.format_exc()
+        print(error_traceback)
+        raise HTTPException(status_code=500, detail=f"{error_traceback}")
+
+# 從其他 App 搬家: 上傳 CSV / NDJSON / Parquet 檔案，大量匯入健身或飲食記錄
+@router.post("/import/{kind}", response_model=ImportReport, summary="Bulk import workout / food logs")
+async def import_logs(kind: Literal["workout", "food"], file: UploadFile,
+                      format: Optional[Literal["csv", "ndjson", "parquet"]] = None):
+    """
+    逐筆驗證後每 IMPORT_CHUNK_SIZE 筆寫入一次，驗證失敗的資料列會跳過，並在回傳結果列出行數與原因
+    format 不給的話依副檔名判斷 (.csv / .ndjson / .jsonl / .parquet)
+    """
+    try:
+        fmt = format or detect_format(file.filename)
+        insert_rows = workout_repo.sync.import_workout_rows if kind == "workout" else food_repo.sync.import_food_rows
+        # 讀檔、驗證、寫入都是同步的，整個丟到 thread pool 執行
+        report = await run_in_db_executor(import_file, kind, file.file, fmt, insert_rows)
+    except ValueError as e:
+        # 只有在寫入任何資料之前發現的問題 (格式不支援、缺少 pyarrow) 會丟出來，讀檔途中的錯誤會記在 report 裡
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if report.imported:
+        dashboard_cache.invalidate()  # 有新的記錄，儀表板要重新計算
+    return report
+
+# 匯出全部的健身或飲食記錄 (由舊到新)，邊查詢邊送出
+@router.get("/export/{kind}", summary="Export all workout / food logs (streaming)")
+async def export_logs(kind: Literal["workout", "food"], format: Literal["ndjson", "csv"] = "ndjson"):
+    fetch_page = workout_repo.get_workout_logs_page if kind == "workout" else food_repo.get_food_logs_page
+    return StreamingResponse(
+        stream_export(kind, fetch_page, format),
+        media_type="text/csv" if format == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{kind}_logs.{format}"'}
+    )
+
 # 進行 AI 分析飲食圖片的 API 端點
 @router.post("/analyze", response_model=FoodAnalysisResult, status_code=status.HTTP_200_OK, summary="AI analyze food image")
 async def analyze_food(request: FoodAnalyzeRequest):   
@@ -47,9 +106,9 @@ async def analyze_food(request: FoodAnalyzeRequest):
     """
     try:
         # result 是一個 FoodAnalysisResult 物件
-        ai_result = OpenAIService.analyze_food_image(request.image_url, request.food_name, request.meal_type)
+        ai_result = await OpenAIService.analyze_food_image_async(request.image_url, request.food_name, request.meal_type)
 
-        save_record = food_repo.save_food_logs(
+        save_record = await food_repo.save_food_logs(
             food_data=ai_result,
             image_url=request.image_url,
             food_name=request.food_name,
@@ -59,6 +118,7 @@ async def analyze_food(request: FoodAnalyzeRequest):
         # 若寫入成功，save_record 會有值
         if save_record:
             ai_result.is_saved = True  # 讓前端知道資料有存進去
+            dashboard_cache.invalidate()
         else:
             ai_result.is_saved = False
 
@@ -68,58 +128,225 @@ async def analyze_food(request: FoodAnalyzeRequest):
         print(error_traceback)
         raise HTTPException(status_code=500, detail=str(error_traceback))
 
+# 一次分析多張飲食照片，並以單一 INSERT 寫入資料庫
+@router.post("/analyze/batch", response_model=List[FoodAnalyzeBatchItem], status_code=status.HTTP_200_OK, summary="AI analyze multiple food images")
+async def analyze_food_batch(request: FoodAnalyzeBatchRequest):
+    """
+    1. 同時分析所有圖片 (同時進行的數量受 OPENAI_VISION_CONCURRENCY 限制)
+    2. 把分析成功的結果一次寫入資料庫
+    3. 依照傳入順序回傳每張圖片的結果，單張失敗不影響其他張
+    """
+    try:
+        results = await asyncio.gather(
+            *(OpenAIService.analyze_food_image_async(item.image_url, item.food_name, item.meal_type) for item in request.items),
+            return_exceptions=True
+        )
+
+        # 只有分析成功的才寫入資料庫
+        succeeded = [(result, item) for result, item in zip(results, request.items) if isinstance(result, FoodAnalysisResult)]
+        saved_records = await food_repo.save_food_logs_batch(succeeded)
+        is_saved = len(saved_records) == len(succeeded)
+        if saved_records:
+            dashboard_cache.invalidate()
+
+        response = []
+        for index, result in enumerate(results):
+            if isinstance(result, FoodAnalysisResult):
+                result.is_saved = is_saved
+                response.append(FoodAnalyzeBatchItem(index=index, result=result))
+            else:
+                response.append(FoodAnalyzeBatchItem(index=index, error=str(result)))
+        return response
+    except Exception as e:
+        error_traceback = traceback.format_exc()
+        print(error_traceback)
+        raise HTTPException(status_code=500, detail=str(error_traceback))
+
+# 查看 Vision 分析快取的命中狀況，以及省下的時間與 token
+@router.get("/analyze/cache/stats", summary="Food vision cache statistics")
+async def get_vision_cache_stats():
+    return vision_cache.stats()
+
+# 查看聯網搜尋快取的命中率與合併的請求數
+@router.get("/search/cache/stats", summary="Web search cache statistics")
+async def get_web_search_cache_stats():
+    return web_search_service.stats()
+
+async def stream_with_ticket(ticket: ChatTicket, stream):
+    """串流結束 (或前端斷線) 時歸還執行權"""
+    try:
+        async for chunk in stream:
+            yield chunk
+    finally:
+        ticket.release()
+
 @router.post("/chat", status_code=status.HTTP_200_OK, summary="Chat with AI Coach (Streaming)")
 async def chat_with_coach(request: ChatRequest):
     """
     AI 教練對話接口，ChatRequest 的格式是 {"session_id": "xxx", "content": "xxx"}
+    同時進行的串流數有上限，額滿時會先排隊，佇列也滿了就回 429；同一個 session 的對話會依序執行
     """
+    try:
+        ticket = await chat_admission.acquire(request.session_id)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=e.reason,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
     try:
         # 告訴瀏覽器這是 SSE 格式 (text/event-stream)，是串流傳資料進來
+        # background 是保險: 串流還沒開始前端就斷線時，generator 的 finally 不會執行
         return StreamingResponse(
-            agent_service.chat_stream(request.session_id, request.content, request.image_url),
-            media_type="text/event-stream"
+            stream_with_ticket(ticket, agent_service.chat_stream(request.session_id, request.content, request.image_url)),
+            media_type="text/event-stream",
+            background=BackgroundTask(ticket.release)
         )
         
     except Exception as e:
+        ticket.release()
         print(f"Chat Error: {e}")
         raise HTTPException(status_code=500, detail=f"{e}")
 
 
+# 歷史對話分頁: 每次向資料庫要的筆數 (limit=0 或串流匯出時內部也是一頁一頁撈)，以及單頁的上限
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "200"))
+CHAT_HISTORY_MAX_PAGE = 1000  # Supabase 預設單次回應最多 1000 筆
+
+def encode_cursor(row: dict) -> str:
+    """把一筆訊息的 (created_at, id) 編成前端看不懂也不需要懂的字串"""
+    raw = json.dumps([row["created_at"], row["id"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """
+    解開前端帶回來的 cursor，兩個欄位會直接組進 PostgREST 的 or_() 條件，所以要檢查型別
+    created_at 解析後重新輸出成 ISO 格式 (不會有引號、逗號、括號)，id 必須是整數，其他一律回 400
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, message_id = json.loads(raw)
+        if not isinstance(created_at, str) or type(message_id) is not int:
+            raise ValueError("cursor 欄位型別錯誤")
+        return datetime.fromisoformat(created_at).isoformat(), message_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def to_message(row: dict) -> dict:
+    """只留下 MessageSchema 的欄位"""
+    return {"role": row["role"], "content": row["content"], "image_url": row.get("image_url"), "created_at": row.get("created_at")}
+
+async def stream_history_ndjson(session_id: str):
+    """由舊到新把整個 session 一頁一頁撈出來，每則訊息一行 JSON，記憶體只會保留一頁"""
+    cursor = None
+    while True:
+        page = await chat_repo.get_messages_page(session_id, CHAT_HISTORY_PAGE_SIZE, cursor=cursor, newest_first=False)
+        if page is None:
+            yield json.dumps({"error": "Failed to fetch chat history"}, ensure_ascii=False) + "\n"
+            return
+        if not page:
+            return
+        yield "".join(json.dumps(to_message(row), ensure_ascii=False) + "\n" for row in page)
+        if len(page) < CHAT_HISTORY_PAGE_SIZE:
+            return
+        cursor = (page[-1]["created_at"], page[-1]["id"])
+
 # 根據 session_id 取出歷史對話，一個 session_id 代表一個唯一的對話
 @router.get("/chat/history/{session_id}", response_model=List[MessageSchema], summary="Get chat history by session_id")
-async def get_chat_history(session_id: str, limit: int):
-    history = chat_repo.get_recent_messages(session_id, limit=limit)
-    return history
+async def get_chat_history(session_id: str, response: Response, limit: int = 50, before: Optional[str] = None,
+                           format: Literal["json", "ndjson"] = "json"):
+    """
+    - limit > 0: 回傳 before 之前 (不給就是最新) 的 limit 則訊息，由舊到新排列；
+      還有更早的訊息時，response header 的 X-Next-Cursor 就是下一頁 (更早) 的 before
+    - limit = 0: 回傳整段對話 (相容舊的前端，內部仍以固定大小分頁向資料庫查詢)
+    - format=ndjson: 串流匯出整段對話 (由舊到新，一行一則)，適合很長的 session
+    """
+    # 還在背景寫入佇列的訊息要先寫進資料庫，剛結束的回覆才撈得到
+    await chat_message_writer.flush(session_id)
+
+    if format == "ndjson":
+        return StreamingResponse(stream_history_ndjson(session_id), media_type="application/x-ndjson")
+
+    cursor = decode_cursor(before) if before else None
+
+    if limit > 0:
+        page_size = min(limit, CHAT_HISTORY_MAX_PAGE)
+        # 多撈一筆用來判斷還有沒有下一頁
+        rows = await chat_repo.get_messages_page(session_id, page_size + 1, cursor=cursor)
+        if rows is None:
+            raise HTTPException(status_code=500, detail="Failed to fetch chat history")
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            response.headers["X-Next-Cursor"] = encode_cursor(rows[-1])
+        return [to_message(row) for row in reversed(rows)]  # 翻轉成由舊到新
+
+    # limit = 0: 由新到舊一頁一頁撈完，最後再翻轉
+    history = []
+    while True:
+        rows = await chat_repo.get_messages_page(session_id, CHAT_HISTORY_PAGE_SIZE, cursor=cursor)
+        if rows is None:
+            raise HTTPException(status_code=500, detail="Failed to fetch chat history")
+        history.extend(to_message(row) for row in rows)
+        if len(rows) < CHAT_HISTORY_PAGE_SIZE:
+            break
+        cursor = (rows[-1]["created_at"], rows[-1]["id"])
+    return history[::-1]
 
-# 取得 dashboard 頁面所需的全部資料，在函式內是一一取得並打包成 DashboardSummary 物件回傳給前端
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """檢查前端帶來的 If-None-Match (可能有多個，以逗號分隔) 是否包含目前的 ETag"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+# 取得 dashboard 頁面所需的全部資料，組好的結果會快取起來並附上 ETag，沒有新的記錄時重複載入只需要回 304
 @router.get("/dashboard/summary", response_model=DashboardSummary, summary="Get dashboard summary data")
-async def get_dashboard_summary():
+async def get_dashboard_summary(request: Request):
+    cached = dashboard_cache.get()
+    if cached is None:
+        generation = dashboard_cache.generation  # 查詢前先記下版本，查詢途中有寫入時就不快取這次的結果
+        summary = await build_dashboard_summary()
+        cached = dashboard_cache.set(summary.model_dump_json().encode("utf-8"), generation)
+
+    # no-cache: 瀏覽器可以存，但每次都要帶 ETag 回來確認
+    headers = {"ETag": cached.etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), cached.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=cached.body, media_type="application/json", headers=headers)
+
+async def build_coach_insight() -> str:
+    """根據過去 30 天的進步狀況產生一句教練建議 (只需要統計結果，不產生每筆記錄的文字)"""
+    try:
+        analytics = await run_in_db_executor(get_workout_analytics, days=30, include_raw=False)
+    except Exception as e:
+        print(f"Workout analytics error: {e}")
+        analytics = None
+
+    if analytics is None:
+        return "保持運動與飲食紀錄，我將為你提供更精準的教練建議！"
+
+    # 我們只需要 progress_highlights 欄位
+    highlights = analytics.summary_stats.progress_highlights
+    if highlights:
+        top = highlights[0]
+        return f"你在過去 30 天有顯著進步！{top.exercise_name}的{top.kind}提升了 {top.improvement}。"
+    return "繼續保持訓練！穩定的頻率是進步的關鍵，目前的訓練分佈還算平均，建議下週可以多挑戰一點重量。"
+
+# 同時發出所有查詢後打包成 DashboardSummary 物件
+async def build_dashboard_summary() -> DashboardSummary:
     try:
-        # Today's nutrition: {calories: ..., protein: ..., ...}
-        nutrition_data = food_repo.get_today_summary()
+        # 所有查詢同時發出，總耗時約等於最慢的那個查詢
+        # 營養、熱力圖、部位分佈都在資料庫內彙總 (RPC)，只回傳幾十筆資料
+        nutrition_data, heatmap, distribution, insight = await asyncio.gather(
+            food_repo.get_today_summary(),              # Today's nutrition: {calories: ..., protein: ..., ...}
+            workout_repo.get_workout_heatmap_month(),   # Workout heatmap (Current Month): [{"date": k, "count": v}, ...]
+            workout_repo.get_body_part_stats_month(),   # Body part distribution (Current Month): [{"body_part": k, "count": v}, ...]
+            build_coach_insight(),                      # Coach insight
+        )
         # 把字典裡的 key 變成「參數名稱」，把 value 變成「參數值」，並傳入 TodayNutrition 物件，讓它符合 pydantic
         today_nutrition = TodayNutrition(**nutrition_data)
 
-        # Workout heatmap (Current Month): [{"date": k, "count": v}, ...]
-        heatmap = workout_repo.get_workout_heatmap_month()
-
-        # Body part distribution (Current Month): [{"body_part": k, "count": v}, ...]
-        distribution = workout_repo.get_body_part_stats_month()
-
-        # Coach insight
-        analytics_str = fetch_workout_analytics(days=30)  # 改為呼叫邏輯函數
-        # 這裡 analytics_str 格式是 "[Tool Output]: {...json...}"
-        try:
-            analytics_json = json.loads(analytics_str.replace("[Tool Output]: ", ""))
-            # 我們只需要 progress_highlights 欄位
-            highlights = analytics_json.get("summary_stats", {}).get("progress_highlights", [])
-            if highlights:
-                insight = f"你在過去 30 天有顯著進步！{highlights[0]['動作']}的{highlights[0]['類型']}提升了 {highlights[0]['進步']}。"
-            else:
-                insight = "繼續保持訓練！穩定的頻率是進步的關鍵，目前的訓練分佈還算平均，建議下週可以多挑戰一點重量。"
-        except:
-            insight = "保持運動與飲食紀錄，我將為你提供更精準的教練建議！"
-
         # 把上面所有資訊打包
         return DashboardSummary(
             nutrition=today_nutrition,
@@ -131,6 +358,26 @@ async def get_dashboard_summary():
         print(f"Dashboard Summary Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# 查看 Agent 工具的排隊、執行時間與逾時次數
+@router.get("/tools/stats", summary="Agent tool executor statistics")
+async def get_tool_stats():
+    return tool_stats()
+
+# 查看 /chat 的流量控制狀況 (同時串流數、佇列深度、等待時間)
+@router.get("/chat/admission/stats", summary="Chat admission control statistics")
+async def get_chat_admission_stats():
+    return chat_admission.stats()
+
+# 查看對話訊息背景寫入佇列的狀況
+@router.get("/chat/writer/stats", summary="Chat message write-behind queue statistics")
+async def get_chat_writer_stats():
+    return chat_message_writer.stats()
+
+# 查看儀表板快取的命中狀況
+@router.get("/dashboard/cache/stats", summary="Dashboard cache statistics")
+async def get_dashboard_cache_stats():
+    return dashboard_cache.stats()
+
 @router.get("/")
 def health_check():
     return{"status": "ok", "message": "backend is running"}
\ No newline at end of file
@@ -1,7 +1,8 @@
 from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import RedirectResponse
 from google_auth_oauthlib.flow import Flow
-from supabase import create_client, Client
+from app.data.database import get_supabase
+from app.services.google_manager import invalidate_google_session
 import os, datetime, traceback, json
 import tempfile
 from dotenv import load_dotenv
@@ -17,10 +18,6 @@ REDIRECT_URI = os.getenv("GOOGLE_REDIRECT_URI", "http://localhost:8000/api/v1/au
 # 可被操作的服務
 GOOGLE_SCOPES = os.getenv("GOOGLE_SCOPES").split()
 
-supabase_url = os.getenv("SUPABASE_URL")
-supabase_key = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(supabase_url, supabase_key)
-
 # 如何讀取 google oauth2 憑證檔案
 def get_credentials_path():
     # 如果有環境變數（Railway），動態建立暫存檔
@@ -96,7 +93,9 @@ async def google_callback(request: Request, code: str, state: str):
         }
 
         # 如果 user_id 存在就更新，不存在就新增
-        supabase.table("user_oauth_tokens").upsert(data).execute()
+        get_supabase().table("user_oauth_tokens").upsert(data).execute()
+        # 丟掉舊的快取憑證，下次排定行程時改用新的 token
+        invalidate_google_session(data["user_id"])
 
         request.session.pop('oauth_state', None)
         request.session.pop('code_verifier', None)
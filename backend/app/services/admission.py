@@ -0,0 +1,169 @@
+import os, asyncio, math, time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+"""
+/chat 的流量控制
+- 全域同時進行的串流數上限 (每個串流都佔用一條 LLM 連線與工具呼叫)，額滿時在有上限的佇列裡等待，
+  佇列也滿了 (或等太久) 就回 429 + Retry-After
+- 每個 session 一把鎖，同一個 session (例如開了兩個分頁) 的對話依序執行，歷史記錄不會交錯
+- 記錄佇列深度與等待時間，方便決定要開多少 worker
+注意：限制是單一程序內的，部署多個 worker 時每個 worker 各自計算
+"""
+
+CHAT_MAX_CONCURRENT = int(os.getenv("CHAT_MAX_CONCURRENT", "16"))  # 同時進行的串流數
+CHAT_MAX_QUEUE = int(os.getenv("CHAT_MAX_QUEUE", "32"))  # 全域佇列最多幾個請求在等
+CHAT_MAX_SESSION_QUEUE = int(os.getenv("CHAT_MAX_SESSION_QUEUE", "2"))  # 同一個 session 最多幾個請求在排隊
+CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", "30"))  # 秒，在佇列等超過這個時間就放棄
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+@dataclass
+class _SessionSlot:
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    users: int = 0  # 正在執行 + 排隊中的請求數，歸零時移除
+
+
+class ChatTicket:
+    """取得的執行權，串流結束時呼叫 release() (重複呼叫沒關係)"""
+    def __init__(self, controller: "ChatAdmissionController", session_id: str, waited: float):
+        self.controller = controller
+        self.session_id = session_id
+        self.waited = waited
+        self.started_at = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+
+class ChatAdmissionController:
+    def __init__(self, max_concurrent: int = CHAT_MAX_CONCURRENT, max_queue: int = CHAT_MAX_QUEUE,
+                 max_session_queue: int = CHAT_MAX_SESSION_QUEUE, queue_timeout: float = CHAT_QUEUE_TIMEOUT):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_session_queue = max_session_queue
+        self.queue_timeout = queue_timeout
+
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._sessions: Dict[str, _SessionSlot] = {}
+
+        self.active = 0  # 正在串流
+        self.queued = 0  # 在全域佇列等待
+        self.session_waiting = 0  # 在等同一個 session 的前一輪結束
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self._waits = deque(maxlen=1000)  # 最近的等待時間 (秒)
+        self._avg_duration = 10.0  # 串流平均耗時 (指數移動平均)，用來估算 Retry-After
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+        return self._slots
+
+    def retry_after(self) -> int:
+        """估計多久後會有空位: 平均串流時間 x 前面排隊的批數"""
+        rounds = (self.queued + 1) / max(1, self.max_concurrent)
+        return max(1, min(60, math.ceil(self._avg_duration * rounds)))
+
+    async def acquire(self, session_id: str) -> ChatTicket:
+        """
+        先取得 session 的鎖 (同一個 session 依序執行)，再取得全域的串流名額
+        額滿或等待逾時會丟出 AdmissionRejected
+        """
+        slots = self._semaphore()
+        if slots.locked() and self.queued >= self.max_queue:
+            self._reject()
+            raise AdmissionRejected("Too many concurrent chats", self.retry_after())
+
+        slot = self._sessions.get(session_id)
+        if slot is None:
+            slot = self._sessions[session_id] = _SessionSlot()
+        if slot.users > self.max_session_queue:  # 一個在執行 + max_session_queue 個在排隊
+            self._reject()
+            raise AdmissionRejected("Too many pending messages for this session", self.retry_after())
+        slot.users += 1
+
+        start = time.monotonic()
+        deadline = start + self.queue_timeout
+        try:
+            await self._wait(slot.lock.acquire(), deadline, "session_waiting")
+            try:
+                await self._wait(slots.acquire(), deadline, "queued")
+            except BaseException:
+                slot.lock.release()
+                raise
+        except asyncio.TimeoutError:
+            self._drop_session_user(session_id, slot)
+            self.timeouts += 1
+            self._reject()
+            raise AdmissionRejected("Timed out waiting for a chat slot", self.retry_after())
+        except BaseException:
+            self._drop_session_user(session_id, slot)
+            raise
+
+        waited = time.monotonic() - start
+        self._waits.append(waited)
+        self.active += 1
+        self.admitted += 1
+        return ChatTicket(self, session_id, waited)
+
+    async def _wait(self, acquire, deadline: float, counter: str):
+        setattr(self, counter, getattr(self, counter) + 1)
+        try:
+            await asyncio.wait_for(acquire, timeout=max(0.0, deadline - time.monotonic()))
+        finally:
+            setattr(self, counter, getattr(self, counter) - 1)
+
+    def _reject(self):
+        self.rejected += 1
+
+    def _drop_session_user(self, session_id: str, slot: _SessionSlot):
+        slot.users -= 1
+        if slot.users == 0 and self._sessions.get(session_id) is slot:
+            del self._sessions[session_id]
+
+    def _release(self, ticket: ChatTicket):
+        duration = time.monotonic() - ticket.started_at
+        self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+        self.active -= 1
+        if self._slots is not None:
+            self._slots.release()
+        slot = self._sessions.get(ticket.session_id)
+        if slot is not None:
+            slot.lock.release()
+            self._drop_session_user(ticket.session_id, slot)
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+        return {
+            "active": self.active,
+            "max_concurrent": self.max_concurrent,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "session_waiting": self.session_waiting,
+            "sessions": len(self._sessions),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "wait_avg_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+            "wait_p95_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0,
+            "wait_max_ms": round(waits[-1] * 1000, 1) if waits else 0.0,
+            "avg_stream_seconds": round(self._avg_duration, 2),
+        }
+
+
+chat_admission = ChatAdmissionController()
@@ -0,0 +1,38 @@
+from datetime import datetime
+from agents import Agent, AsyncOpenAI, OpenAIChatCompletionsModel
+from app.tools import tools
+from app.services.agent_instructions import get_agent_instructions
+
+"""
+預先建好的 GentleCoach Agent 模板
+model 物件與 tools 整個程序只建立一次，instructions 每天 (日期改變時) 才重新產生一次，
+每次對話只需要 clone() 一份淺拷貝，不用重新組裝整個 Agent
+"""
+
+
+def today_str(now: datetime | None = None) -> str:
+    return (now or datetime.now()).strftime("%Y-%m-%d (%A)")  # 例如：2026-03-08 (Sunday)
+
+
+class CoachAgentFactory:
+    def __init__(self, client: AsyncOpenAI, model: str = "gpt-4o", agent_tools: list | None = None):
+        # 這個實例要讓 Agent 使用，否則 Agent 會自己建立一個新的
+        self.model = OpenAIChatCompletionsModel(model=model, openai_client=client)
+        # 預設使用 AGENT_TOOLS，評測的 cassette 會傳入包裝過的版本
+        self.tools = list(tools.AGENT_TOOLS if agent_tools is None else agent_tools)
+        self._template: Agent | None = None
+        self._template_day: str | None = None
+
+    def get_agent(self, now_str: str | None = None) -> Agent:
+        """取得當天的 Agent (模板的淺拷貝，可以安全地在每次對話中使用)"""
+        now_str = now_str or today_str()
+        if self._template is None or self._template_day != now_str:
+            # 日期改變 (或第一次使用) 才重新產生 instructions，讓 Agent 知道今天的日期
+            self._template = Agent(
+                name="GentleCoach",
+                instructions=get_agent_instructions(now_str),
+                tools=self.tools,
+                model=self.model
+            )
+            self._template_day = now_str
+        return self._template.clone()
@@ -1,15 +1,28 @@
 import os, json, traceback, asyncio
-from datetime import datetime
 from openai.types.responses import ResponseTextDeltaEvent
-from app.data.repositories import ChatRepository
+from app.data.repositories import ChatRepository, AsyncRepository
 from app.services.context import current_image_ctx
-from agents import Agent, Runner, AsyncOpenAI, OpenAIChatCompletionsModel
-from app.tools import tools
+from app.services.conversation_cache import ConversationCache, SessionHistory, CHAT_HISTORY_LIMIT
+from app.services.history_summarizer import summarize_history
+from app.services.message_writer import chat_message_writer
+from app.services.sse_encoder import SSEStream, encode_event, DONE_FRAME
+from agents import Runner, AsyncOpenAI
 from typing import Dict, List, Any
 from langsmith.wrappers import wrap_openai
 from langsmith.run_trees import RunTree
 from langsmith.run_helpers import tracing_context
-from app.services.agent_instructions import get_agent_instructions
+from app.services.agent_factory import CoachAgentFactory, today_str
+from app.services.tool_executor import TOOL_UNKNOWN_PREFIX
+
+# 內容固定的訊息與 SSE frame，只需要編碼一次
+TOOL_DONE_TEXT = "[Tool Use] 工具執行完畢\n\n"
+TOOL_FAILED_TEXT = "[Tool Use] 工具執行失敗，請稍後在試\n\n"
+TOOL_UNKNOWN_TEXT = "[Tool Use] 工具執行逾時，無法確認是否已寫入，請先查看記錄再決定是否重新記錄\n\n"
+ERROR_TEXT = "抱歉，GentleCoach 大腦暫時短路了，請稍後再試，或聯絡開發者 a0938692163@gmail.com"
+TOOL_DONE_FRAME = encode_event({'type': 'tool_output', 'content': TOOL_DONE_TEXT})
+TOOL_FAILED_FRAME = encode_event({'type': 'tool_output', 'content': TOOL_FAILED_TEXT})
+TOOL_UNKNOWN_FRAME = encode_event({'type': 'tool_output', 'content': TOOL_UNKNOWN_TEXT})
+ERROR_FRAME = encode_event({'type': 'error', 'content': ERROR_TEXT}, ensure_ascii=True)
 
 class AgentService:
     def __init__(self):
@@ -17,65 +30,134 @@ class AgentService:
         self.async_client = wrap_openai(
             AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))  # AsyncOpenAI 是建立非同步版本，比較適合 stream
         )
-        self.chat_repo = ChatRepository()  # 查詢歷史對話記錄的工具
+        # Agent 模板只建立一次，每次對話 clone 一份使用 (傳入已經 wrap_openai 的 client，確保所有 LLM 呼叫都會被蹤到)
+        self.agent_factory = CoachAgentFactory(self.async_client)
+        self.chat_repo = AsyncRepository(ChatRepository())  # 查詢歷史對話記錄的工具 (非同步版本，不會卡住其他串流)
+        self.message_writer = chat_message_writer  # 對話訊息的背景寫入佇列
+        self.conversation_cache = ConversationCache()  # 每個 session 已轉換好格式的歷史訊息
+        self._background_tasks = set()  # 背景更新摘要的 task，要保留參考避免被 GC 回收
+
+    def _save_message(self, session_id: str, role: str, content: str, image_url: str | None = None):
+        """
+        放進背景寫入佇列 (不等資料庫)，並立刻寫進對話快取
+        佇列決定的 created_at 就是之後存進資料庫的時間，快取與摘要的時間會與資料庫一致
+        重試後還是寫不進資料庫的話，丟掉這個 session 的快取，快取與之後的摘要才不會有 chat_messages 沒有的訊息
+        """
+        message = self.message_writer.enqueue(session_id, role, content, image_url)
+        self.conversation_cache.append(session_id, role, content, image_url, message.created_at)
+        message.done.add_done_callback(lambda done: self._on_message_written(session_id, done))
+        return message
+
+    def _on_message_written(self, session_id: str, done: asyncio.Future):
+        if not done.cancelled() and done.result() is False:
+            print(f"⚠️ 對話訊息沒有寫入資料庫，丟掉 session 的快取: session={session_id}")
+            self.conversation_cache.invalidate(session_id)
+
+    async def _get_history(self, session_id: str, current: dict):
+        """
+        取得要送給 Agent 的歷史訊息：[滾動摘要] + 裝得進 token 預算的最近訊息
+        快取沒有時才回資料庫撈 (例如 session 的第一輪對話)
+        current: 這一輪使用者的提問 (chat_messages 的 row)，撈歷史失敗時至少要送給 Agent
+        """
+        session = self.conversation_cache.get_session(session_id)
+        if session is None:
+            # 資料庫還沒寫完的訊息 (例如剛放進佇列的這則提問) 要先寫進去，撈到的歷史才會完整
+            await self.message_writer.flush(session_id)
+            # 撈取歷史對話記錄 (由最舊的對話開始往後走，最多50筆) 與已存的摘要
+            chat_history, summary = await asyncio.gather(
+                self.chat_repo.get_recent_messages(session_id, limit=CHAT_HISTORY_LIMIT),
+                self.chat_repo.get_summary(session_id),
+            )
+            if chat_history is None or summary is None:
+                # 讀取失敗不是「沒有歷史」：不放進快取 (下一輪再從資料庫撈)，也不更新摘要 (會覆蓋掉資料庫裡原本的摘要)
+                print(f"⚠️ 撈取歷史對話失敗，這一輪只使用讀得到的部分: session={session_id}")
+                session = self.conversation_cache.build_session(chat_history or [current], summary or {})
+                return self.conversation_cache.build_window(session)
+            session = self.conversation_cache.load(session_id, chat_history, summary)
+
+        # 有訊息被擠出預算時併入摘要；併入之前這些訊息還是會放進這一輪的 prompt (build_window)
+        self.conversation_cache.evict(session)
+        if session.pending:
+            task = self._start_fold(session_id, session)
+            if session.pending_tokens > self.conversation_cache.pending_token_limit:
+                # 累積太多還沒摘要的訊息 (摘要太慢或失敗)，等摘要更新完再回應，prompt 才不會一直變長
+                # shield: 使用者中途斷線也要讓摘要做完
+                await asyncio.shield(task)
+        return self.conversation_cache.build_window(session)
+
+    def _start_fold(self, session_id: str, session: SessionHistory) -> asyncio.Task:
+        """在背景併入摘要 (同一個 session 同時只會有一個)，不影響這一輪的回應速度"""
+        if session.fold_task is None or session.fold_task.done():
+            task = asyncio.create_task(self._fold_history(session_id, session))
+            session.fold_task = task
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+        return session.fold_task
+
+    async def _fold_history(self, session_id: str, session: SessionHistory):
+        """
+        把 session.pending 的舊訊息併入滾動摘要，並存回資料庫
+        摘要更新完才從 pending 移除，在那之前 build_window 還是會把這些訊息送給 Agent
+        """
+        try:
+            while session.pending:
+                batch = list(session.pending)
+                session.summary = await summarize_history(self.async_client, session.summary, [cached.message for cached in batch])
+                if session.stale:
+                    return  # 摘要期間 session 被丟掉了 (有訊息沒寫進資料庫)，不要把它存進 chat_summaries
+                # 摘要期間可能又有新的訊息移出 (只會接在後面)，只移除這次處理的部分；失敗的話留在 pending，下一輪再試
+                del session.pending[:len(batch)]
+                folded_until = next((cached.created_at for cached in reversed(batch) if cached.created_at), None)
+                await self.chat_repo.save_summary(session_id, session.summary, folded_until)
+        except Exception as e:
+            print(f"更新對話摘要失敗: {e}")
 
     async def chat_stream(self, session_id: str, user_query: str, image_url: str | None = None):
         """
         處理對話的核心流程：存訊息 -> 撈歷史 -> 交給 Runner 處理 -> 存回覆，並可以使用 Local 的工具
+        Agent 的事件迴圈在背景 task 執行 (_run_chat)，產生的事件交給 SSEStream 合併成較少的 SSE frame 再送給前端
         """
-        now_str = datetime.now().strftime("%Y-%m-%d (%A)") # 例如：2026-03-08 (Sunday)
-        print(f"🕒 系統時間：{now_str}")
-
-        # RunTree 像是追蹤的根節點，可以追蹤整個對話流程 (把這一次完整的聊天流程，視為一條 chain)
-        rt = RunTree(
-            name="GentleCoach_Chat_Flow",
-            run_type="chain",    # 告訴 LangSmith 這是一個「串聯流程」
-            inputs={
-                "user_query": user_query
-            },
-            project_name=os.environ.get("LANGSMITH_PROJECT")
-        )
-
-        # 這個實例要讓 Agent 使用，否則 Agent 會自己建立一個新的
-        agent_model = OpenAIChatCompletionsModel(
-            model="gpt-4o",
-            openai_client=self.async_client  # 傳入已經 wrap_openai，確保所有 LLM 呼叫都會被蹤到
-        )
+        stream = SSEStream()
+        # 將網址注入到此 ContextVar 變數，create_task 會複製目前的 context，背景 task 與工具調用時都抓得到
+        token = current_image_ctx.set(image_url)
+        producer = asyncio.create_task(self._run_chat(stream, session_id, user_query, image_url))
+        try:
+            async for chunk in stream:
+                yield chunk
+            await producer
+        finally:
+            if not producer.done():
+                producer.cancel()  # 前端中途斷線，停止 Agent
+            current_image_ctx.reset(token)
 
-        # 建立 Agent 實例，並將 tools 掛載上去 (要放在函式內，這樣每次對話都可以抓到最新的 now_str)
-        coach_agent = Agent(
-            name="GentleCoach",
-            instructions=get_agent_instructions(now_str),
-            tools=tools.AGENT_TOOLS,
-            model=agent_model  # 掛載
-        )
+    async def _run_chat(self, stream: SSEStream, session_id: str, user_query: str, image_url: str | None):
+        """
+        執行 Agent 並把事件送進 stream，結束 (或出錯) 時關閉 stream
+        從準備 Agent 開始全部都在 try 裡面，任何一步出錯都會送出 ERROR_FRAME 並關閉 stream，前端不會一直等
+        """
+        now_str = None
+        rt = None
         try:
-            # 將網址注入到此 COntextVar 變數，只要整個非同步還沒結束，contextvar 就不會消失，工具調用時也還在非同步，所以可以直接抓 
-            token = current_image_ctx.set(image_url)
-
-            # 存入「當下」的使用者訊息
-            self.chat_repo.create_message(session_id, "user", user_query, image_url)
-            # 撈取歷史對話記錄，這裡會由最舊的對話開始往後走 (最多50筆)
-            chat_history = self.chat_repo.get_recent_messages(session_id, limit=50)
-
-            # 轉換為多模態格式 (這裡之所以不用加入當下的 query 是因為前面已經將它存到歷史訊息了)
-            processed_messages = []
-            for msg in chat_history:
-                role = msg["role"]
-                text = msg["content"]
-                image_url = msg.get("image_url")
-
-                # 若這則訊息帶有圖片，則要傳入文字與圖片
-                if image_url:
-                    processed_messages.append({
-                        "role": role,
-                        "content": [
-                            {"type": "input_text", "text": text},
-                            {"type": "input_image", "image_url": image_url},  # LLM 透過此網址看到圖片
-                        ]
-                    })
-                else:
-                    processed_messages.append({"role": role, "content": text})
+            now_str = today_str() # 例如：2026-03-08 (Sunday)
+            print(f"🕒 系統時間：{now_str}")
+
+            # RunTree 像是追蹤的根節點，可以追蹤整個對話流程 (把這一次完整的聊天流程，視為一條 chain)
+            rt = RunTree(
+                name="GentleCoach_Chat_Flow",
+                run_type="chain",    # 告訴 LangSmith 這是一個「串聯流程」
+                inputs={
+                    "user_query": user_query
+                },
+                project_name=os.environ.get("LANGSMITH_PROJECT")
+            )
+
+            # 取得當天的 Agent (instructions 每天只產生一次，這裡只是 clone 模板)
+            coach_agent = self.agent_factory.get_agent(now_str)
+
+            # 存入「當下」的使用者訊息 (背景寫入，不用等資料庫)
+            message = self._save_message(session_id, "user", user_query, image_url)
+            # 取得多模態格式的歷史對話 (這裡之所以不用加入當下的 query 是因為前面已經將它存到歷史訊息了)
+            processed_messages = await self._get_history(session_id, message.row)
             
             print("🏃‍♂️ 交由 Runner 開始執行工具與對話迴圈...")
             
@@ -100,31 +182,35 @@ class AgentService:
 
                             full_response_text += content  # 這樣讓工具調用過程也存入資料庫
                             # 通知前端：正在執行工具 (轉成 JSON 方便前端解析，開頭與結尾加上 data: /n/n 是 SSE 的通訊格式)
-                            yield f"data: {json.dumps({'type': 'tool_calling', 'content': content}, ensure_ascii=False)}\n\n"
+                            await stream.send_frame(encode_event({'type': 'tool_calling', 'content': content}))
                         elif event.item.type == "tool_call_output_item":
                             tool_output_string = event.item.output   # tool function 回傳的結果
                             print(f"📦 [工具回傳]: {tool_output_string}")
-                            if tool_output_string.startswith("[工具調用失敗]"):
-                                full_response_text += f"[Tool Use] 工具執行失敗，請稍後在試\n\n"
+                            if tool_output_string.startswith(TOOL_UNKNOWN_PREFIX):
+                                # 寫入途中逾時，不要讓使用者以為失敗而重新記錄
+                                full_response_text += TOOL_UNKNOWN_TEXT
+                                await stream.send_frame(TOOL_UNKNOWN_FRAME)
+                            elif tool_output_string.startswith("[工具調用失敗]"):
+                                full_response_text += TOOL_FAILED_TEXT
                                 # 通知前端：工具執行失敗，使用 \n\n 確保 Markdown 換行
-                                yield f"data: {json.dumps({'type': 'tool_output', 'content': f'[Tool Use] 工具執行失敗，請稍後在試\n\n'}, ensure_ascii=False)}\n\n"
+                                await stream.send_frame(TOOL_FAILED_FRAME)
                             else:
-                                full_response_text += f"[Tool Use] 工具執行完畢\n\n"
+                                full_response_text += TOOL_DONE_TEXT
                                 # 通知前端：工具執行完畢，使用 \n\n 確保 Markdown 換行
-                                yield f"data: {json.dumps({'type': 'tool_output', 'content': f'[Tool Use] 工具執行完畢\n\n'}, ensure_ascii=False)}\n\n"             
+                                await stream.send_frame(TOOL_DONE_FRAME)
                             
                     # 2. 捕捉到 LLM 的「純文字」輸出，讓前端能以「串流」的方式顯示回覆
                     elif event.type == "raw_response_event" and isinstance(event.data, ResponseTextDeltaEvent):
                         if event.data.delta:
                             full_response_text += event.data.delta  # 一小段回應s組裝
-                            # 即時將文字傳送給前端
-                            yield f"data: {json.dumps({'type': 'llm_generate', 'content': event.data.delta}, ensure_ascii=False)}\n\n"
+                            # 交給 SSEStream，連續的小段文字會合併成一個 frame 再送出
+                            await stream.send_text(event.data.delta)
                 
-                # 對話結束
+                # 對話結束 (背景寫入，done 不用等資料庫)
                 if full_response_text:
-                    self.chat_repo.create_message(session_id, "assistant", full_response_text)
+                    self._save_message(session_id, "assistant", full_response_text)
 
-                yield f"data: {json.dumps({'type': 'done'})}\n\n"  # 讓前端知道完成了
+                await stream.send_frame(DONE_FRAME)  # 讓前端知道完成了
             
             rt.end(outputs={"output": full_response_text}, metadata={"session_id": session_id, 'image_url': image_url, 'system_time': now_str})   # 結束整個流程，並存入 outputs
             rt.post()    # 真正結束，上傳到伺服器存檔
@@ -134,13 +220,14 @@ class AgentService:
             print(f"[系統錯誤]: {error_traceback}")
             print(f"Agent Error: {e}")
 
-            rt.end(outputs={"output": f"Error: {error_traceback}"}, metadata={"session_id": session_id, 'image_url': image_url, 'system_time': now_str})
-            rt.post()
+            if rt is not None:  # 建立 RunTree 之前就出錯的話沒有東西可以上傳
+                rt.end(outputs={"output": f"Error: {error_traceback}"}, metadata={"session_id": session_id, 'image_url': image_url, 'system_time': now_str})
+                rt.post()
 
             # 錯誤訊息也要存到資料庫
-            self.chat_repo.create_message(session_id, "assistant", f"抱歉，GentleCoach 大腦暫時短路了，請稍後再試，或聯絡開發者 a0938692163@gmail.com")
+            self._save_message(session_id, "assistant", ERROR_TEXT)
             # 避免 API 錯誤導致整個聊天室崩潰，還是要回傳訊息
-            yield f"data: {json.dumps({'type': 'error', 'content': f'抱歉，GentleCoach 大腦暫時短路了，請稍後再試，或聯絡開發者 a0938692163@gmail.com'})}\n\n"
+            await stream.send_frame(ERROR_FRAME)
         
         finally:
-            current_image_ctx.reset(token)
+            stream.close()
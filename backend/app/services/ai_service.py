@@ -1,12 +1,116 @@
-import os
-from openai import OpenAI
+import os, asyncio, time
+import httpx
+from openai import OpenAI, AsyncOpenAI
 from app.data.schema import FoodAnalysisResult, FoodAnalyzeRequest
+from app.services.vision_cache import vision_cache
 from dotenv import load_dotenv
 import traceback
 
 load_dotenv()
 
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+async_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))  # 給 async 路由與工具使用，不會卡住 event loop
+
+# 同時進行的 Vision 分析上限，避免批次分析一次打爆 OpenAI 的 rate limit
+OPENAI_VISION_CONCURRENCY = int(os.getenv("OPENAI_VISION_CONCURRENCY", "4"))
+_vision_semaphore = asyncio.Semaphore(OPENAI_VISION_CONCURRENCY)
+
+# 快取 key 用的圖片識別：只發 HEAD 請求拿 Storage 物件的 ETag (內容的 hash)，不下載整張圖片
+# 同一張照片換了網址 (例如從 chat_images 複製到 food_images) ETag 一樣，還是能命中
+_image_http: httpx.AsyncClient | None = None
+
+def _get_image_http() -> httpx.AsyncClient:
+    global _image_http
+    if _image_http is None:
+        _image_http = httpx.AsyncClient(timeout=5, follow_redirects=True)
+    return _image_http
+
+async def close_image_http():
+    """關閉 HEAD 請求用的連線池 (應用程式結束時呼叫)"""
+    global _image_http
+    if _image_http is not None:
+        await _image_http.aclose()
+        _image_http = None
+
+def _image_identity(response: httpx.Response, image_url: str) -> str:
+    """有 ETag 就用 ETag + 大小，沒有的話退回用網址 (Storage 的檔名不會重複)"""
+    etag = response.headers.get("etag")
+    if etag:
+        return f"etag:{etag}:{response.headers.get('content-length', '')}"
+    return f"url:{image_url}"
+
+def _fetch_image_identity(image_url: str) -> str | None:
+    try:
+        response = httpx.head(image_url, timeout=5, follow_redirects=True)
+        response.raise_for_status()
+        return _image_identity(response, image_url)
+    except Exception as e:
+        print(f"讀取圖片資訊失敗，略過快取: {e}")
+        return None
+
+async def _fetch_image_identity_async(image_url: str) -> str | None:
+    try:
+        response = await _get_image_http().head(image_url)
+        response.raise_for_status()
+        return _image_identity(response, image_url)
+    except Exception as e:
+        print(f"讀取圖片資訊失敗，略過快取: {e}")
+        return None
+
+def _build_vision_messages(image_url: str, food_name: str) -> list:
+    """
+    組裝送給 GPT-4o 的 system prompt 與圖片訊息，同步與非同步版本共用
+    """
+    system_prompt = """
+        你是一位專業的台灣營養師與健身教練。你的專長是視覺化營養估算。
+        你的任務是從使用者的食物照片中，精準估算營養成分。
+        ⚠️ 特別注意：請不要將**熱量**與**蛋白質**估得太高。
+
+        ## 分析步驟
+        請在輸出 JSON 之前，先在腦中進行以下推理步驟：
+        1. **識別食物**：辨識盤中的每一項食材（例如：白飯、炸雞腿、炒高麗菜）。
+        2. **估算份量**：根據你所能觀察到的食物的大小 (被遮擋的部分請不要過度猜測大小，以保守為主)，推估每項食材的重量（公克）。
+        3. **對照資料庫**：參考常見連鎖餐廳網路上的數據，例如麥當勞套餐大約在 400~700 大卡，除非是多人分享餐，否則不太可能超過 1000 大卡
+        4. **計算總和**：將所有食材的營養加總。
+        5. 請給出簡短的飲食建議 (約 50~80 字)
+
+        ## 估算準則
+        1. **請就照片中能觀察到的各項食物的大小去進行推算，若被遮擋的部分請不要過度猜測大小，大小會重點影響營養素多寡**
+        2. **保守原則**：如果無法確定，請給出一個合理的範圍平均值，不要過度高估。
+        
+        ## 評分準則
+        使用者目標為「增肌」，評分邏輯如下 (0-5分)：
+        - **高分關鍵**：高蛋白質是首要條件，總熱量足夠 (不低於 500 kcal)。
+        1. **熱量過低** (例如 < 400 kcal)：無法支持增肌，視為不合格。
+        2. **蛋白質或碳水不足** (例如 < 20g)：無法修復肌肉。
+
+        請嚴格遵守 JSON 格式輸出。
+    """
+
+    user_prompt = f"""
+    這是一張飲食照片，食物名稱是：『{food_name}』。
+    請執行以下分析：請分析其熱量、蛋白質、碳水與脂肪，並給出評分與整體建議。
+    """
+
+    return [
+        {"role": "system", "content": system_prompt},
+        {
+            "role": "user",
+            "content":[
+                # image process 的固定格式
+                {
+                    "type": "text",      
+                    "text": user_prompt
+                },
+                {
+                    "type": "image_url", 
+                    "image_url": {
+                        "url": image_url  # Supabase 的公開網址，用這個網址到 bucket 內去存取
+                    }
+                },
+            ],
+        },
+    ]
 
 class OpenAIService:
     @staticmethod
@@ -14,68 +118,59 @@ class OpenAIService:
         """
         發送圖片給 GPT-4o 進行分析，強制回傳 FoodAnalysisResult 物件
         """
-            
-        system_prompt = """
-            你是一位專業的台灣營養師與健身教練。你的專長是視覺化營養估算。
-            你的任務是從使用者的食物照片中，精準估算營養成分。
-            ⚠️ 特別注意：請不要將**熱量**與**蛋白質**估得太高。
-
-            ## 分析步驟
-            請在輸出 JSON 之前，先在腦中進行以下推理步驟：
-            1. **識別食物**：辨識盤中的每一項食材（例如：白飯、炸雞腿、炒高麗菜）。
-            2. **估算份量**：根據你所能觀察到的食物的大小 (被遮擋的部分請不要過度猜測大小，以保守為主)，推估每項食材的重量（公克）。
-            3. **對照資料庫**：參考常見連鎖餐廳網路上的數據，例如麥當勞套餐大約在 400~700 大卡，除非是多人分享餐，否則不太可能超過 1000 大卡
-            4. **計算總和**：將所有食材的營養加總。
-            5. 請給出簡短的飲食建議 (約 50~80 字)
-
-            ## 估算準則
-            1. **請就照片中能觀察到的各項食物的大小去進行推算，若被遮擋的部分請不要過度猜測大小，大小會重點影響營養素多寡**
-            2. **保守原則**：如果無法確定，請給出一個合理的範圍平均值，不要過度高估。
-            
-            ## 評分準則
-            使用者目標為「增肌」，評分邏輯如下 (0-5分)：
-            - **高分關鍵**：高蛋白質是首要條件，總熱量足夠 (不低於 500 kcal)。
-            1. **熱量過低** (例如 < 400 kcal)：無法支持增肌，視為不合格。
-            2. **蛋白質或碳水不足** (例如 < 20g)：無法修復肌肉。
-
-            請嚴格遵守 JSON 格式輸出。
-        """
-
-        user_prompt = f"""
-        這是一張飲食照片，食物名稱是：『{food_name}』。
-        請執行以下分析：請分析其熱量、蛋白質、碳水與脂肪，並給出評分與整體建議。
-        """
+        # 同一張照片分析過就直接回傳快取結果
+        image_id = _fetch_image_identity(image_url)
+        cache_key = vision_cache.make_key(image_id, food_name, meal_type) if image_id is not None else None
+        if cache_key:
+            cached = vision_cache.get(cache_key)
+            if cached:
+                return cached
 
         try:
+            start = time.perf_counter()
             # Strutured output 可以確保回傳格式一致
             completion = client.beta.chat.completions.parse(
                 model="gpt-4o",  # 更換為穩定支援視覺與 Structured Output 的 gpt-4o
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {
-                        "role": "user",
-                        "content":[
-                            # image process 的固定格式
-                            {
-                                "type": "text",      
-                                "text": user_prompt
-                            },
-                            {
-                                "type": "image_url", 
-                                "image_url": {
-                                    "url": image_url  # Supabase 的公開網址，用這個網址到 bucket 內去存取
-                                }
-                            },
-                        ],
-                    },
-                ],
+                messages=_build_vision_messages(image_url, food_name),
                 response_format=FoodAnalysisResult,  # 強制回傳 FoodAnalysisResult 物件
             )
             result = completion.choices[0].message.parsed
+            if cache_key:
+                tokens = completion.usage.total_tokens if completion.usage else 0
+                vision_cache.set(cache_key, result, time.perf_counter() - start, tokens)
             return result  # 這個 result 會是 FoodAnalysisResult 物件 (有被強制輸出格式)
         except Exception as e:
             error_traceback = traceback.format_exc()
             print(f"AI 分析圖片失敗，OpneAI API error: {error_traceback}")
             raise e
 
-        
\ No newline at end of file
+    @staticmethod
+    async def analyze_food_image_async(image_url: str, food_name: str, meal_type: str) -> FoodAnalysisResult:
+        """
+        analyze_food_image 的非同步版本，給 async 路由與工具使用
+        同時進行的請求數受 OPENAI_VISION_CONCURRENCY 限制，超過的會在這裡排隊
+        """
+        image_id = await _fetch_image_identity_async(image_url)
+        cache_key = vision_cache.make_key(image_id, food_name, meal_type) if image_id is not None else None
+        if cache_key:
+            cached = vision_cache.get(cache_key)
+            if cached:
+                return cached
+
+        try:
+            async with _vision_semaphore:
+                start = time.perf_counter()
+                completion = await async_client.beta.chat.completions.parse(
+                    model="gpt-4o",
+                    messages=_build_vision_messages(image_url, food_name),
+                    response_format=FoodAnalysisResult,
+                )
+            result = completion.choices[0].message.parsed
+            if cache_key:
+                tokens = completion.usage.total_tokens if completion.usage else 0
+                vision_cache.set(cache_key, result, time.perf_counter() - start, tokens)
+            return result
+        except Exception as e:
+            error_traceback = traceback.format_exc()
+            print(f"AI 分析圖片失敗，OpneAI API error: {error_traceback}")
+            raise e
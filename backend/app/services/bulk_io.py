@@ -0,0 +1,239 @@
+import os, io, csv, json, time
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, BinaryIO, Callable, Iterable, Iterator, List, Optional, Tuple
+from pydantic import BaseModel, ValidationError
+from app.data.schema import WorkoutImportRow, FoodImportRow, ImportReport, ImportRowError
+from app.data.repositories import WorkOutRepository, FoodRepository, TW_TZ
+
+"""
+健身 / 飲食記錄的大量匯入與匯出 (從其他 App 搬家、備份)
+匯入:
+- 支援 CSV (第一列是欄位名稱)、NDJSON (一行一筆 JSON)，有安裝 pyarrow 的話也支援 Parquet
+- 一筆一筆讀檔、驗證 (WorkoutImportRow / FoodImportRow)，湊滿 IMPORT_CHUNK_SIZE 筆就用一個 INSERT 寫入，
+  記憶體只會保留一批資料，檔案再大都一樣
+- 驗證失敗的資料列會跳過並記錄行數與原因，不會讓整個匯入失敗
+- 讀到一半檔案壞掉 (編碼錯誤、CSV 欄位過長等) 時停止讀取，已經寫入的照樣回報 (truncated)，
+  只有在寫入任何資料之前發現的問題 (格式不支援、缺少 pyarrow、不是 Parquet 檔) 才會丟出 ValueError
+- 沒有時區的時間視為台北時間，沒有時間的記錄使用匯入當下的時間
+匯出:
+- 依 (created_at, id) 一頁一頁撈出來邊撈邊送 (keyset 分頁)，不會把整張表讀進記憶體
+- 匯出的欄位可以直接再匯入
+"""
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+IMPORT_MAX_ERRORS = 100  # ImportReport 最多列出幾筆失敗的資料列
+
+# 匯出的欄位 (依序)，與匯入的欄位相同 (id 匯入時會被忽略)
+EXPORT_COLUMNS = {
+    "workout": ["id", "exercise_name", "body_part", "weight", "sets", "reps", "created_at"],
+    "food": ["id", "food_name", "meal_type", "image_url", "calories", "protein", "fat", "carbs", "score", "coach_comment", "created_at"],
+}
+
+# 讀檔時每一筆的結果: (行數, 資料)，資料是解析失敗的 Exception 時直接記為失敗
+Record = Tuple[int, Any]
+
+
+def _created_at(value: Optional[datetime], default: str) -> str:
+    if value is None:
+        return default
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=TW_TZ)  # 沒寫時區的當作台北時間
+    return value.isoformat()
+
+
+def _workout_row(item: WorkoutImportRow, default_created_at: str) -> dict:
+    row = WorkOutRepository._workout_row(item)
+    row["created_at"] = _created_at(item.created_at, default_created_at)
+    return row
+
+
+def _food_row(item: FoodImportRow, default_created_at: str) -> dict:
+    row = FoodRepository._to_food_row(item, item.image_url, item.food_name, item.meal_type)
+    row["created_at"] = _created_at(item.created_at, default_created_at)
+    return row
+
+
+# 每種記錄的驗證模型，以及轉成資料庫欄位的方式
+IMPORT_KINDS: dict[str, Tuple[type[BaseModel], Callable[[Any, str], dict]]] = {
+    "workout": (WorkoutImportRow, _workout_row),
+    "food": (FoodImportRow, _food_row),
+}
+
+
+# --- 讀檔 (都是逐筆產生，不會一次讀進整個檔案) ---
+def read_csv(binary: BinaryIO) -> Iterator[Record]:
+    text = io.TextIOWrapper(binary, encoding="utf-8-sig", newline="")  # utf-8-sig: Excel 存的 CSV 開頭有 BOM
+    try:
+        reader = csv.DictReader(text)
+        for record in reader:
+            # 空白欄位當作沒給，讓模型使用預設值；多出來的欄位 (key 為 None) 忽略
+            yield reader.line_num, {key: value for key, value in record.items() if key is not None and value not in ("", None)}
+    finally:
+        text.detach()  # 不要連帶關閉原本的檔案
+
+
+def read_ndjson(binary: BinaryIO) -> Iterator[Record]:
+    for line_no, line in enumerate(binary, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_no, ValueError(f"JSON 格式錯誤: {e}")
+            continue
+        yield line_no, record if isinstance(record, dict) else ValueError("每一行必須是一個 JSON 物件")
+
+
+def read_parquet(binary: BinaryIO, batch_size: int = IMPORT_CHUNK_SIZE) -> Iterator[Record]:
+    # 不是 generator：缺少 pyarrow 或檔案不是 Parquet 時，在開始寫入前就丟出 ValueError
+    try:
+        import pyarrow.parquet as pq  # 選用套件，只有匯入 Parquet 時才需要
+    except ImportError:
+        raise ValueError("匯入 Parquet 需要安裝 pyarrow (pip install pyarrow)，或改用 CSV / NDJSON")
+    try:
+        parquet_file = pq.ParquetFile(binary)
+    except Exception as e:
+        raise ValueError(f"無法讀取 Parquet 檔案: {e}")
+
+    def records() -> Iterator[Record]:
+        line_no = 0
+        for batch in parquet_file.iter_batches(batch_size=batch_size):
+            for record in batch.to_pylist():
+                line_no += 1
+                yield line_no, {key: value for key, value in record.items() if value is not None}
+    return records()
+
+
+READERS = {"csv": read_csv, "ndjson": read_ndjson, "parquet": read_parquet}
+
+
+def detect_format(filename: Optional[str]) -> str:
+    """依副檔名判斷檔案格式"""
+    suffix = os.path.splitext(filename or "")[1].lower()
+    if suffix == ".csv":
+        return "csv"
+    if suffix in (".ndjson", ".jsonl"):
+        return "ndjson"
+    if suffix == ".parquet":
+        return "parquet"
+    raise ValueError(f"無法從檔名判斷格式: {filename}，請指定 format=csv / ndjson / parquet")
+
+
+# --- 匯入 ---
+def _describe(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(loc) for loc in item['loc'])}: {item['msg']}" for item in error.errors())
+
+
+def _fail(report: ImportReport, line: int, error: str, count: int = 1):
+    report.failed += count
+    if len(report.errors) < IMPORT_MAX_ERRORS:
+        report.errors.append(ImportRowError(line=line, error=error))
+
+
+def import_records(kind: str, records: Iterable[Record], insert_rows: Callable[[List[dict]], bool],
+                   chunk_size: int = IMPORT_CHUNK_SIZE) -> ImportReport:
+    """
+    逐筆驗證，每 chunk_size 筆呼叫一次 insert_rows (同步函式，在 thread pool 內執行)
+    insert_rows 失敗 (回傳 False) 時，整批都算失敗
+    讀檔途中出錯時不會丟出例外：已經驗證好的資料照常寫入，回傳的 report 標記 truncated，
+    前面的批次已經寫進資料庫了，讓使用者知道從哪一行之後沒有匯入，不要整個檔案重新上傳
+    """
+    model, to_row = IMPORT_KINDS[kind]
+    report = ImportReport()
+    start = time.perf_counter()
+    default_created_at = datetime.now(timezone.utc).isoformat()
+    chunk: List[dict] = []
+    chunk_line = 0  # 這一批第一筆的行數，寫入失敗時回報用
+
+    def flush():
+        if not chunk:
+            return
+        report.chunks += 1
+        if insert_rows(chunk):
+            report.imported += len(chunk)
+        else:
+            _fail(report, chunk_line, f"寫入資料庫失敗 (這一批共 {len(chunk)} 筆)", count=len(chunk))
+        chunk.clear()
+
+    iterator = iter(records)
+    last_line = 0
+    while True:
+        try:
+            line, record = next(iterator)
+        except StopIteration:
+            break
+        except Exception as e:
+            # 檔案本身壞掉 (UnicodeDecodeError、csv.Error...)，後面的資料讀不到了
+            # 這筆一定要列出來 (不受 IMPORT_MAX_ERRORS 限制)，使用者才知道從哪裡開始補匯入
+            report.truncated = True
+            report.failed += 1
+            report.errors.append(ImportRowError(line=last_line + 1, error=f"讀取檔案失敗，從第 {last_line + 1} 行開始的資料都沒有匯入: {e}"))
+            break
+        last_line = line
+
+        if isinstance(record, Exception):
+            _fail(report, line, str(record))
+            continue
+        try:
+            item = model.model_validate(record)
+        except ValidationError as e:
+            _fail(report, line, _describe(e))
+            continue
+
+        if not chunk:
+            chunk_line = line
+        chunk.append(to_row(item, default_created_at))
+        if len(chunk) >= chunk_size:
+            flush()
+    flush()
+
+    report.seconds = round(time.perf_counter() - start, 3)
+    return report
+
+
+def import_file(kind: str, binary: BinaryIO, fmt: str, insert_rows: Callable[[List[dict]], bool],
+                chunk_size: int = IMPORT_CHUNK_SIZE) -> ImportReport:
+    """讀取上傳的檔案 (binary 模式) 並匯入，格式不支援時丟出 ValueError"""
+    if fmt not in READERS:
+        raise ValueError(f"不支援的格式: {fmt}")
+    return import_records(kind, READERS[fmt](binary), insert_rows, chunk_size)
+
+
+# --- 匯出 ---
+async def stream_export(kind: str, fetch_page: Callable[[int, Optional[Tuple[str, Any]]], Awaitable[Optional[List[dict]]]],
+                        fmt: str = "ndjson", page_size: int = EXPORT_PAGE_SIZE) -> AsyncIterator[str]:
+    """
+    由舊到新一頁一頁撈出來並轉成 CSV / NDJSON，記憶體只會保留一頁
+    fetch_page(limit, cursor) 是 Repository 的 get_*_logs_page (非同步版本)
+    """
+    columns = EXPORT_COLUMNS[kind]
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore", lineterminator="\n")
+    if fmt == "csv":
+        writer.writeheader()
+
+    cursor = None
+    while True:
+        page = await fetch_page(page_size, cursor)
+        if page is None:
+            # 中途失敗，讓下載的人知道檔案不完整
+            if fmt == "ndjson":
+                yield json.dumps({"error": f"Failed to fetch {kind} logs"}, ensure_ascii=False) + "\n"
+            print(f"匯出 {kind} 記錄時查詢失敗，檔案不完整")
+            return
+
+        if fmt == "csv":
+            writer.writerows(page)
+            chunk = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        else:
+            chunk = "".join(json.dumps({column: row.get(column) for column in columns}, ensure_ascii=False) + "\n" for row in page)
+        if chunk:
+            yield chunk
+
+        if len(page) < page_size:
+            return
+        cursor = (page[-1]["created_at"], page[-1]["id"])
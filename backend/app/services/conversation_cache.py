@@ -0,0 +1,182 @@
+import os, re
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+"""
+每個 session 的對話快取，存放「已經轉成 Agent 輸入格式」的歷史訊息
+- 每個 session 是一個 ring buffer，組 prompt 時由新到舊裝進 token 預算，裝不下的舊訊息移出，等待併入滾動摘要
+- 移出的訊息在併入摘要之前還是會送給 Agent (放在摘要後面)，不會有一輪對話同時看不到訊息與摘要
+- session 數量超過上限時，淘汰最久沒有對話的 session (LRU)
+- 寫入資料庫成功後會同步寫進快取 (write-through)，熱的 session 不需要再回資料庫撈歷史
+注意：快取是單一程序內的，若部署多個 worker，同一個 session 應該固定到同一個 worker
+"""
+
+CHAT_CACHE_MAX_SESSIONS = int(os.getenv("CHAT_CACHE_MAX_SESSIONS", "256"))
+CHAT_HISTORY_LIMIT = int(os.getenv("CHAT_HISTORY_LIMIT", "50"))  # 每個 session 最多保留的訊息數 (與撈資料庫的 limit 一致)
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "6000"))  # 歷史訊息 (不含摘要) 的 token 預算
+# 等待併入摘要的訊息最多佔多少 token，超過時要等摘要更新完才回應 (prompt 不會因為摘要太慢或失敗而一直變長)
+CHAT_PENDING_TOKEN_LIMIT = int(os.getenv("CHAT_PENDING_TOKEN_LIMIT", str(CHAT_HISTORY_TOKEN_BUDGET)))
+IMAGE_TOKEN_ESTIMATE = 765  # 一張圖片大約的 token 數 (detail=auto 的常見值)
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗估文字的 token 數，不需要載入 tokenizer
+    中日韓文字大約一個字一個 token，其他字元大約四個字元一個 token
+    """
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def to_agent_message(role: str, content: str, image_url: Optional[str] = None) -> Dict[str, Any]:
+    """把一則資料庫的對話記錄轉換成 Agent 的多模態輸入格式"""
+    # 若這則訊息帶有圖片，則要傳入文字與圖片
+    if image_url:
+        return {
+            "role": role,
+            "content": [
+                {"type": "input_text", "text": content},
+                {"type": "input_image", "image_url": image_url},  # LLM 透過此網址看到圖片
+            ]
+        }
+    return {"role": role, "content": content}
+
+
+@dataclass
+class CachedMessage:
+    message: Dict[str, Any]  # Agent 輸入格式
+    tokens: int
+    created_at: Optional[str] = None  # 資料庫的 created_at，用來記錄摘要涵蓋到哪一則
+
+    @classmethod
+    def create(cls, role: str, content: str, image_url: Optional[str] = None, created_at: Optional[str] = None):
+        tokens = estimate_tokens(content) + (IMAGE_TOKEN_ESTIMATE if image_url else 0)
+        return cls(to_agent_message(role, content, image_url), tokens, created_at)
+
+
+@dataclass
+class SessionHistory:
+    messages: deque = field(default_factory=deque)  # 還沒被摘要的訊息 (由舊到新)
+    summary: str = ""  # 較早對話的滾動摘要
+    pending: List[CachedMessage] = field(default_factory=list)  # 已移出視窗、等待併入摘要的訊息 (由舊到新)
+    fold_task: Optional[Any] = None  # 正在背景更新摘要的 asyncio.Task
+    stale: bool = False  # 已經從快取移除 (內容與資料庫不一致)，正在進行的摘要不可以再存回資料庫
+
+    @property
+    def pending_tokens(self) -> int:
+        return sum(cached.tokens for cached in self.pending)
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+class ConversationCache:
+    def __init__(self, max_sessions: int = CHAT_CACHE_MAX_SESSIONS, max_messages: int = CHAT_HISTORY_LIMIT,
+                 token_budget: int = CHAT_HISTORY_TOKEN_BUDGET, pending_token_limit: int = CHAT_PENDING_TOKEN_LIMIT):
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.token_budget = token_budget
+        self.pending_token_limit = pending_token_limit
+        self._sessions: OrderedDict[str, SessionHistory] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_session(self, session_id: str) -> Optional[SessionHistory]:
+        """取得 session 的快取，沒有時回傳 None"""
+        session = self._sessions.get(session_id)
+        if session is None:
+            self.misses += 1
+            return None
+        self._sessions.move_to_end(session_id)  # 最近有對話，移到最後面 (最晚被淘汰)
+        self.hits += 1
+        return session
+
+    def load(self, session_id: str, rows: List[Dict[str, Any]], summary: Optional[Dict[str, Any]] = None) -> SessionHistory:
+        """用資料庫撈回來的記錄 (由舊到新) 與已存的摘要建立 session 的快取"""
+        session = self.build_session(rows, summary)
+        self._sessions[session_id] = session
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)  # 淘汰最久沒對話的 session
+        return session
+
+    @staticmethod
+    def build_session(rows: List[Dict[str, Any]], summary: Optional[Dict[str, Any]] = None) -> SessionHistory:
+        """
+        建立 SessionHistory 但不放進快取 (讀取資料庫失敗時，只給這一輪使用)
+        已經被摘要涵蓋的訊息 (created_at <= folded_until) 不會再放進來
+        """
+        session = SessionHistory()
+        folded_until = None
+        if summary:
+            session.summary = summary.get("summary") or ""
+            folded_until = _parse_time(summary.get("folded_until"))
+
+        for row in rows:
+            created_at = _parse_time(row.get("created_at"))
+            if folded_until and created_at and created_at <= folded_until:
+                continue
+            session.messages.append(CachedMessage.create(row["role"], row["content"], row.get("image_url"), row.get("created_at")))
+        return session
+
+    def append(self, session_id: str, role: str, content: str, image_url: Optional[str] = None, created_at: Optional[str] = None):
+        """新訊息寫入資料庫後同步加進快取；session 不在快取內時不處理 (下次會從資料庫重新載入)"""
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.messages.append(CachedMessage.create(role, content, image_url, created_at))
+
+    def evict(self, session: SessionHistory):
+        """
+        由新到舊把訊息裝進 token 預算，裝不下 (或超過 max_messages) 的舊訊息移到 session.pending，由呼叫端併入摘要
+        最新的一則訊息 (當下的提問) 不論多長都一定會保留
+        """
+        used = 0
+        kept = 0
+        for cached in reversed(session.messages):
+            if kept > 0 and (used + cached.tokens > self.token_budget or kept >= self.max_messages):
+                break
+            used += cached.tokens
+            kept += 1
+
+        while len(session.messages) > kept:
+            session.pending.append(session.messages.popleft())
+
+    def build_window(self, session: SessionHistory) -> List[Dict[str, Any]]:
+        """
+        組出要送給 Agent 的歷史訊息：[摘要] + 還沒併入摘要的舊訊息 + 裝進 token 預算的訊息
+        還沒併入摘要的訊息由新到舊最多放 pending_token_limit 個 token (摘要一直失敗時才會超過)
+        """
+        self.evict(session)
+
+        used = 0
+        carried = []
+        for cached in reversed(session.pending):
+            if used + cached.tokens > self.pending_token_limit:
+                break
+            used += cached.tokens
+            carried.append(cached.message)
+        carried.reverse()
+
+        window = carried + [cached.message for cached in session.messages]
+        if session.summary:
+            window.insert(0, {"role": "system", "content": f"以下是這段對話較早內容的摘要，請當作背景知識參考：\n{session.summary}"})
+        return window
+
+    def invalidate(self, session_id: str):
+        """丟掉 session 的快取 (例如有訊息最後沒寫進資料庫)，下一輪會從資料庫重新載入"""
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            session.stale = True
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        return {"sessions": len(self._sessions), "hits": self.hits, "misses": self.misses, "invalidations": self.invalidations}
@@ -0,0 +1,81 @@
+import os, hashlib, threading, time
+from datetime import datetime
+from typing import Optional
+from app.data.repositories import TW_TZ
+
+"""
+/dashboard/summary 的回應快取
+- 組好的 DashboardSummary 以 JSON bytes 存起來，並附上內容雜湊當作 ETag，前端重複載入時可以直接回 304
+- 有寫入 (/workout、/analyze、Agent 的記錄工具) 時呼叫 invalidate()，下次讀取才重新查詢
+- 快取綁定台北時間的日期，跨日 (也就包含跨月) 時自動失效，「今日營養」與「本月熱力圖」不會停留在前一天
+- 另外有 TTL 當保險 (例如直接在資料庫改資料、或有多個 worker 時其他 worker 的寫入)
+注意：快取是單一程序內的
+"""
+
+DASHBOARD_CACHE_TTL = float(os.getenv("DASHBOARD_CACHE_TTL", "600"))  # 秒
+
+
+class CachedDashboard:
+    def __init__(self, body: bytes, day: str, generation: int):
+        self.body = body
+        self.etag = f'"{hashlib.sha1(body).hexdigest()}"'  # 內容相同 ETag 就相同
+        self.day = day
+        self.generation = generation
+        self.created_at = time.monotonic()
+
+
+def taipei_today() -> str:
+    return datetime.now(TW_TZ).strftime("%Y-%m-%d")
+
+
+class DashboardCache:
+    def __init__(self, ttl: float = DASHBOARD_CACHE_TTL):
+        self.ttl = ttl
+        self._entry: Optional[CachedDashboard] = None
+        self._generation = 0  # 每次寫入 +1，用來丟掉「查詢途中有新寫入」的結果
+        self._lock = threading.Lock()  # 記錄工具在 thread pool 內呼叫 invalidate，要加鎖
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def generation(self) -> int:
+        """開始查詢前先記下目前的版本，存入快取時帶回來"""
+        return self._generation
+
+    def get(self) -> Optional[CachedDashboard]:
+        """取得仍然有效的快取，沒有或已失效時回傳 None"""
+        with self._lock:
+            entry = self._entry
+            if (entry is None
+                    or entry.generation != self._generation
+                    or entry.day != taipei_today()
+                    or time.monotonic() - entry.created_at > self.ttl):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry
+
+    def set(self, body: bytes, generation: int) -> CachedDashboard:
+        """
+        存入剛組好的回應，generation 是開始查詢前取得的版本
+        若查詢途中有新的寫入 (版本已經改變)，這份結果仍會回傳給這次的請求，但不會被快取
+        """
+        entry = CachedDashboard(body, taipei_today(), generation)
+        with self._lock:
+            if generation == self._generation:
+                self._entry = entry
+        return entry
+
+    def invalidate(self):
+        """有新的飲食或訓練記錄寫入時呼叫"""
+        with self._lock:
+            self._generation += 1
+            self._entry = None
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "invalidations": self.invalidations, "cached": self._entry is not None}
+
+
+dashboard_cache = DashboardCache()
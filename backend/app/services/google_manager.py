@@ -1,8 +1,12 @@
-import os, datetime, json
+import os, datetime, json, threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 from google.auth.transport.requests import Request
-from supabase import create_client, Client
+from supabase import Client
+from app.data.database import get_supabase
+from app.services.cache import TTLCache
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -16,30 +20,83 @@ CREDENTIALS_PATH= os.path.join(BASE_DIR, "AI_playground_jason_gentlegains.json")
 # 可被操作的服務
 GOOGLE_SCOPES = os.getenv("GOOGLE_SCOPES").split()
 
+# 每個使用者的 Credentials 與已建立的 service 物件保留多久 (秒)，最多保留幾個使用者
+GOOGLE_SESSION_CACHE_TTL = float(os.getenv("GOOGLE_SESSION_CACHE_TTL", "3600"))
+GOOGLE_SESSION_CACHE_SIZE = int(os.getenv("GOOGLE_SESSION_CACHE_SIZE", "256"))
+
+_client_config: Optional[dict] = None
+
+
+# 讀取 json 憑證內的內容 (程式的憑證不會變，只讀一次)
+def load_client_config() -> dict:
+    global _client_config
+    if _client_config is None:
+        # for railway 部署
+        credentials_json = os.getenv("GOOGLE_CREDENTIALS_JSON")
+        if credentials_json:
+            _client_config = json.loads(credentials_json).get("web")
+        else:
+            # for 畚箕開發部署
+            with open(CREDENTIALS_PATH, 'r') as f:
+                _client_config = json.load(f).get("web")
+    return _client_config
+
+
+@dataclass
+class GoogleSession:
+    """一個使用者的 Credentials 與已建立的 service 物件 (build 要載入 discovery 文件，很花時間)"""
+    creds: Credentials
+    services: Dict[tuple, Any] = field(default_factory=dict)
+    # httplib2 的連線不是 thread-safe，同一個使用者的 Google API 呼叫要依序執行
+    lock: threading.RLock = field(default_factory=threading.RLock)
+
+
+# 每個使用者的 GoogleSession 快取
+# 失效時機：超過 TTL、refresh 失敗 (RefreshError)、使用者重新授權 (OAuth callback)
+_sessions = TTLCache(maxsize=GOOGLE_SESSION_CACHE_SIZE, ttl=GOOGLE_SESSION_CACHE_TTL)
+_sessions_lock = threading.Lock()
+
+
+def invalidate_google_session(user_id: str):
+    """丟掉使用者快取的 Credentials 與 service，下次使用時重新從資料庫讀取"""
+    _sessions.pop(user_id)
+
+
 class GoogleManager:
     """
     負責處理多個 Google API (Calendar, Gmail, etc.) 的認證與連線
+    同一個使用者的 Credentials 與 service 物件會快取起來，排定行程時只需要一次 Google API 呼叫
     """
     def __init__(self, user_id: str):
         self.user_id = user_id  # 目前要使用 google 服務的那個人
-        self.supabase: Client = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
-        self.client_config = self._load_client_config()  # 這個是 gentle-gains 網頁程式的憑證，不是使用者的
-        self.creds = self._load_and_refresh_credentials()  # 使用者的 token
-        
-    # 讀取 json 憑證內的內容
-    def _load_client_config(self):
-        # for railway 部署
-        credentials_json = os.getenv("GOOGLE_CREDENTIALS_JSON")
-        if credentials_json:
-            return json.loads(credentials_json).get("web")
+        self.supabase: Client = get_supabase()  # 共用的連線池，不再每次建立新的 client
+        self.client_config = load_client_config()  # 這個是 gentle-gains 網頁程式的憑證，不是使用者的
+        self.session = self._get_session()
+        self.creds = self.session.creds if self.session else None  # 使用者的 token
+
+    def _get_session(self) -> Optional[GoogleSession]:
+        session = _sessions.get(self.user_id)
+        if session is None:
+            with _sessions_lock:
+                session = _sessions.get(self.user_id)  # 等鎖的期間可能已經有人讀好了
+                if session is None:
+                    creds = self._load_credentials()
+                    if creds is None:
+                        return None  # 還沒授權的不快取，授權完馬上就能用
+                    session = GoogleSession(creds)
+                    _sessions.set(self.user_id, session)
 
-        # for 畚箕開發部署
-        with open(CREDENTIALS_PATH, 'r') as f:
-            return json.load(f).get("web")
+        with session.lock:
+            try:
+                self._refresh_if_expired(session.creds)
+            except Exception:
+                invalidate_google_session(self.user_id)  # refresh 失敗 (例如被撤銷)，下次重新讀取
+                raise
+        return session
 
-    def _load_and_refresh_credentials(self):
+    def _load_credentials(self) -> Optional[Credentials]:
         """
-        從資料庫讀取 Token，並在過期時可以用 refresh_token 換取新的 access token
+        從資料庫讀取 Token，包裝成 Credentials 物件
         """
         response = self.supabase.table("user_oauth_tokens") \
             .select("*").eq("user_id", self.user_id).single().execute()
@@ -48,7 +105,7 @@ class GoogleManager:
         if not token_data:
             print(f"Warning: No OAuth token found for user {self.user_id}")
             return None
-        
+
         # 建立通行證，把所有資訊包裝成 Credentials 物件
         creds = Credentials(
             token=token_data['access_token'],
@@ -62,9 +119,14 @@ class GoogleManager:
         # 如果 refresh_token 是這個，就代表使用者還未開通權限
         if creds and creds.refresh_token == '未開通權限':
             return None
+        return creds
 
-        # 檢查 acces token 是否過期
-        if creds and creds.expired and creds.refresh_token:
+    def _refresh_if_expired(self, creds: Credentials):
+        """
+        檢查 access token 是否過期，過期時用 refresh_token 換取新的 access token
+        (剛從資料庫讀出來的 token 沒有 expiry，會先當作有效，過期的話 Google 回 401 時 service 會自己 refresh)
+        """
+        if creds.expired and creds.refresh_token:
             print(f"Token expired, refreshing for user {self.user_id}")
             creds.refresh(Request())  # 用 refresh_token 換取新的 access token
 
@@ -74,11 +136,15 @@ class GoogleManager:
                 "updated_at": datetime.datetime.now().isoformat()
             }).eq("user_id", self.user_id).execute()
 
-        return creds
-
     def get_service(self, service_name: str, version: str):
-        if not self.creds:
+        if not self.session:
             return None
-        
-        # 會自動檢查 creds 物件，並返回一個能操作指定 API 的物件
-        return build(service_name, version, credentials=self.creds)
+
+        key = (service_name, version)
+        with self.session.lock:
+            service = self.session.services.get(key)
+            if service is None:
+                # 會自動檢查 creds 物件，並返回一個能操作指定 API 的物件 (同一個使用者只 build 一次)
+                service = build(service_name, version, credentials=self.session.creds)
+                self.session.services[key] = service
+        return service
@@ -0,0 +1,41 @@
+import os
+from typing import Any, Dict, List
+from agents import AsyncOpenAI
+
+"""
+把移出 token 預算的舊對話併入滾動摘要 (每次只處理新移出的訊息，不會重讀整段對話)
+"""
+
+CHAT_SUMMARY_MODEL = os.getenv("CHAT_SUMMARY_MODEL", "gpt-4o-mini")
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "600"))
+
+SUMMARY_PROMPT = """
+你負責維護健身教練 GentleCoach 與使用者之間對話的「滾動摘要」。
+請把【新的對話片段】整合進【目前的摘要】，輸出一份更新後的完整摘要。
+- 保留對之後對話有用的事實：使用者的目標、身體狀況、偏好、已記錄的訓練與飲食、教練給過的重要建議與約定的行程。
+- 刪除寒暄、重複內容與工具呼叫的過程訊息。
+- 使用繁體中文，條列式，總長度不超過 400 字。
+"""
+
+
+def _render_message(message: Dict[str, Any]) -> str:
+    """把 Agent 輸入格式的訊息轉成純文字 (圖片以 [圖片] 表示)"""
+    content = message["content"]
+    if isinstance(content, list):
+        parts = [part["text"] if part.get("type") == "input_text" else "[圖片]" for part in content]
+        content = " ".join(parts)
+    return f"{message['role']}: {content}"
+
+
+async def summarize_history(client: AsyncOpenAI, previous_summary: str, messages: List[Dict[str, Any]]) -> str:
+    """回傳把 messages 併入 previous_summary 之後的新摘要"""
+    transcript = "\n".join(_render_message(message) for message in messages)
+    completion = await client.chat.completions.create(
+        model=CHAT_SUMMARY_MODEL,
+        max_tokens=CHAT_SUMMARY_MAX_TOKENS,
+        messages=[
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"【目前的摘要】\n{previous_summary or '(無)'}\n\n【新的對話片段】\n{transcript}"},
+        ],
+    )
+    return completion.choices[0].message.content.strip()
@@ -0,0 +1,169 @@
+import os, asyncio
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Optional, Set
+from app.data.repositories import ChatRepository, AsyncRepository
+
+"""
+chat_messages 的背景寫入佇列 (write-behind)
+- chat_stream 只把訊息放進佇列就繼續串流，開始回覆與送出 done 都不需要等資料庫
+- 背景 worker 把佇列內的訊息累積成一批，用一個 INSERT 寫入，依放入順序處理，所以同一個 session 的順序不會亂
+- created_at 在放入佇列時就決定 (嚴格遞增)，資料庫的排序與快取、摘要使用的時間一致
+- 寫入失敗會以指數退避重試，全部失敗時改成逐筆寫入，只丟掉真的寫不進去的訊息
+  (丟掉的訊息 done 的結果為 False，有快取這則訊息的呼叫端要自己處理，數量記在 stats() 的 dropped)
+- 需要讀資料庫前 (冷啟動撈歷史、前端載入歷史) 先 flush 該 session，程式關閉時 (lifespan) 會把佇列寫完
+"""
+
+CHAT_WRITE_BATCH_SIZE = int(os.getenv("CHAT_WRITE_BATCH_SIZE", "50"))
+CHAT_WRITE_FLUSH_INTERVAL = float(os.getenv("CHAT_WRITE_FLUSH_INTERVAL", "0.05"))  # 秒，等待更多訊息湊成一批的時間
+CHAT_WRITE_MAX_RETRIES = int(os.getenv("CHAT_WRITE_MAX_RETRIES", "3"))
+CHAT_WRITE_RETRY_BACKOFF = float(os.getenv("CHAT_WRITE_RETRY_BACKOFF", "0.5"))  # 秒，每次重試加倍
+
+
+@dataclass
+class PendingMessage:
+    session_id: str
+    row: dict  # 要寫入 chat_messages 的資料
+    done: asyncio.Future  # 寫入完成後結果為 True，放棄寫入為 False
+
+    @property
+    def created_at(self) -> str:
+        return self.row["created_at"]
+
+
+class ChatMessageWriter:
+    def __init__(self, repo=None, batch_size: int = CHAT_WRITE_BATCH_SIZE, flush_interval: float = CHAT_WRITE_FLUSH_INTERVAL,
+                 max_retries: int = CHAT_WRITE_MAX_RETRIES, retry_backoff: float = CHAT_WRITE_RETRY_BACKOFF):
+        self.repo = repo or AsyncRepository(ChatRepository())
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+        self._buffer: deque[PendingMessage] = deque()
+        self._unfinished: Dict[str, Set[asyncio.Future]] = {}  # session_id -> 還沒寫完的訊息
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._last_created_at: Optional[datetime] = None
+
+        self.written = 0
+        self.dropped = 0  # 重試後還是寫不進去，已放棄的訊息
+        self.retries = 0
+        self.batches = 0
+
+    def _ensure_worker(self):
+        """第一次使用 (或 event loop 換了) 時才建立背景 worker"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._worker = None
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._run())
+
+    def _next_created_at(self) -> str:
+        """嚴格遞增的時間，同一個時間點放入的多則訊息也能保持順序"""
+        now = datetime.now(timezone.utc)
+        if self._last_created_at and now <= self._last_created_at:
+            now = self._last_created_at + timedelta(microseconds=1)
+        self._last_created_at = now
+        return now.isoformat()
+
+    def enqueue(self, session_id: str, role: str, content: str, image_url: str | None = None) -> PendingMessage:
+        """把訊息放進佇列後立刻回傳 (不等資料庫)，回傳的 created_at 就是之後存進資料庫的時間"""
+        self._ensure_worker()
+        row = {
+            "session_id": session_id,
+            "role": role,
+            "content": content,
+            "image_url": image_url,
+            "created_at": self._next_created_at(),
+        }
+        message = PendingMessage(session_id, row, self._loop.create_future())
+        self._buffer.append(message)
+        self._unfinished.setdefault(session_id, set()).add(message.done)
+        self._wakeup.set()
+        return message
+
+    async def flush(self, session_id: str | None = None):
+        """等待 (某個 session 或全部) 已放入佇列的訊息寫完"""
+        if session_id is not None:
+            futures = set(self._unfinished.get(session_id, ()))
+        else:
+            futures = {future for pending in self._unfinished.values() for future in pending}
+        if futures:
+            # 用 wait 而不是 gather，呼叫端被取消時不會連帶取消寫入
+            await asyncio.wait(futures)
+
+    async def close(self):
+        """程式關閉時呼叫：把佇列內的訊息全部寫完，再停止 worker"""
+        await self.flush()
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if len(self._buffer) < self.batch_size and self.flush_interval > 0:
+                await asyncio.sleep(self.flush_interval)  # 等一下，讓同時進來的訊息湊成一批
+
+            while self._buffer:
+                batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                try:
+                    await self._write(batch)
+                except Exception as e:
+                    print(f"背景寫入對話訊息發生錯誤: {e}")
+                    for message in batch:
+                        self._finish(message, False)
+
+    async def _write(self, batch: list[PendingMessage]):
+        self.batches += 1
+        rows = [message.row for message in batch]
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.retries += 1
+                await asyncio.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            if await self.repo.create_messages_batch(rows) is not None:
+                for message in batch:
+                    self._finish(message, True)
+                return
+
+        # 整批一直失敗，可能是其中某一則有問題，改成逐筆寫入
+        for message in batch:
+            saved = await self.repo.create_messages_batch([message.row]) is not None
+            if not saved:
+                print(f"對話訊息寫入失敗，已放棄: session={message.session_id}, role={message.row['role']}")
+            self._finish(message, saved)
+
+    def _finish(self, message: PendingMessage, saved: bool):
+        if saved:
+            self.written += 1
+        else:
+            self.dropped += 1
+        if not message.done.done():
+            message.done.set_result(saved)
+        pending = self._unfinished.get(message.session_id)
+        if pending is not None:
+            pending.discard(message.done)
+            if not pending:
+                del self._unfinished[message.session_id]
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._buffer),
+            "written": self.written,
+            "dropped": self.dropped,
+            "retries": self.retries,
+            "batches": self.batches,
+        }
+
+
+chat_message_writer = ChatMessageWriter()
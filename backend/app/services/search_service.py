@@ -0,0 +1,135 @@
+import os, re, threading, time, unicodedata
+from typing import Any, Dict, Optional, Protocol
+from app.services.cache import TTLCache
+
+"""
+web_search 工具用的聯網搜尋服務
+- 健身問題在不同使用者之間重複率很高 (例如「肌酸 劑量」)，搜尋結果以正規化後的關鍵字快取 (LRU + TTL)
+  正規化只用在快取與 single-flight 的 key，送給 Tavily 的還是使用者原本的問題 (第一個發出搜尋的請求)
+- 同一個關鍵字同時有多個請求在搜尋時，只有第一個真的呼叫 Tavily，其他的等它的結果 (single-flight)
+- 搜尋失敗或沒有結果不會快取，下一次會重新搜尋
+- client 可以替換 (只要有 search(query, **kwargs) -> dict)，本機測試可以換成假的 client，不用真的連網
+"""
+
+WEB_SEARCH_CACHE_SIZE = int(os.getenv("WEB_SEARCH_CACHE_SIZE", "512"))
+WEB_SEARCH_CACHE_TTL = float(os.getenv("WEB_SEARCH_CACHE_TTL", str(24 * 3600)))  # 預設保留 1 天
+WEB_SEARCH_DEPTH = os.getenv("WEB_SEARCH_DEPTH", "advanced")
+WEB_SEARCH_MAX_RESULTS = int(os.getenv("WEB_SEARCH_MAX_RESULTS", "3"))
+
+_SPACES = re.compile(r"\s+")
+_EDGE_PUNCTUATION = " \t\n?!.,;:？！。，；：、\"'「」"
+
+
+class SearchClient(Protocol):
+    def search(self, query: str, **kwargs) -> Dict[str, Any]: ...
+
+
+def normalize_query(query: str) -> str:
+    """全形轉半形、轉小寫、合併空白、去掉頭尾的標點，讓「Creatine 劑量？」與「creatine  劑量」命中同一筆快取"""
+    query = unicodedata.normalize("NFKC", query).lower()
+    return _SPACES.sub(" ", query).strip(_EDGE_PUNCTUATION)
+
+
+def _default_client() -> Optional[SearchClient]:
+    """有設定 TAVILY_API_KEY 才建立 Tavily client"""
+    api_key = os.getenv("TAVILY_API_KEY")
+    if not api_key:
+        return None
+    from tavily import TavilyClient
+    return TavilyClient(api_key=api_key)
+
+
+class _InFlight:
+    """正在進行中的一次搜尋，等待同一個關鍵字的請求共用它的結果"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[BaseException] = None
+
+
+class WebSearchService:
+    """
+    工具在 thread pool 執行 (同步函式)，所以用 threading 的鎖與 Event 做 single-flight
+    search() 回傳 Tavily 的原始 response (dict)，格式化交給工具本身
+    """
+    def __init__(self, client: Optional[SearchClient] = None, maxsize: int = WEB_SEARCH_CACHE_SIZE,
+                 ttl: float = WEB_SEARCH_CACHE_TTL, search_depth: str = WEB_SEARCH_DEPTH,
+                 max_results: int = WEB_SEARCH_MAX_RESULTS):
+        self.client = client if client is not None else _default_client()
+        self.search_depth = search_depth
+        self.max_results = max_results
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._inflight: Dict[str, _InFlight] = {}
+        self._lock = threading.Lock()
+
+        self.upstream_calls = 0
+        self.coalesced = 0  # 搭上別人正在進行的搜尋的次數
+        self.upstream_seconds = 0.0
+
+    def set_client(self, client: Optional[SearchClient]):
+        """替換搜尋 client (例如測試時換成假的)，舊的快取一併清掉"""
+        self.client = client
+        self._cache.clear()
+
+    @property
+    def enabled(self) -> bool:
+        return self.client is not None
+
+    def search(self, query: str) -> Dict[str, Any]:
+        key = normalize_query(query)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _InFlight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._fetch(query)  # 原始問題，大小寫與標點可能會影響搜尋結果
+            if call.result.get("answer") or call.result.get("results"):
+                self._cache.set(key, call.result)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.done.set()
+
+    def _fetch(self, query: str) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            return self.client.search(
+                query=query,
+                search_depth=self.search_depth,
+                max_results=self.max_results,
+                include_answer=True
+            )
+        finally:
+            with self._lock:
+                self.upstream_calls += 1
+                self.upstream_seconds += time.perf_counter() - start
+
+    def stats(self) -> dict:
+        return {
+            **self._cache.stats(),
+            "upstream_calls": self.upstream_calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+            "avg_upstream_seconds": round(self.upstream_seconds / self.upstream_calls, 3) if self.upstream_calls else 0.0,
+        }
+
+
+web_search_service = WebSearchService()
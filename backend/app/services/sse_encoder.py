@@ -0,0 +1,133 @@
+import os, json, asyncio
+from typing import List, Optional
+
+"""
+/chat 串流用的 SSE 編碼器
+LLM 的文字 delta 通常只有一兩個 token，如果每個 delta 都各自 json.dumps 成一個 SSE frame，
+同時很多串流時會產生大量很小的寫入。這裡把連續的文字 delta 合併:
+- 時間窗: 第一段文字進來後最多等 SSE_FLUSH_INTERVAL 秒就送出 (第一段回覆不等待，維持首字延遲)
+- 大小: 累積超過 SSE_MAX_FRAME_BYTES 就先封成一個 frame
+- 工具狀態、done、error 等事件會先把累積的文字送出，再送出事件本身，順序不變
+- frame 的前綴與結尾事先編碼好，文字只需要 json.dumps 字串本身
+- 前端讀得慢時 (送出被卡住)，文字會在這裡累積成更大的 frame (自動加大批次)；
+  累積超過 SSE_MAX_PENDING_BYTES 時，生產端 (Agent 事件迴圈) 會暫停等待前端讀取
+輸出的每個 frame 格式與原本相同: data: {"type": ..., "content": ...}\n\n
+"""
+
+SSE_FLUSH_INTERVAL = float(os.getenv("SSE_FLUSH_INTERVAL", "0.03"))  # 秒
+SSE_MAX_FRAME_BYTES = int(os.getenv("SSE_MAX_FRAME_BYTES", "4096"))
+SSE_MAX_PENDING_BYTES = int(os.getenv("SSE_MAX_PENDING_BYTES", str(256 * 1024)))
+
+# 事先編碼好的 frame 片段
+TEXT_FRAME_PREFIX = b'data: {"type": "llm_generate", "content": '
+FRAME_SUFFIX = b'}\n\n'
+
+
+def encode_event(payload: dict, ensure_ascii: bool = False) -> bytes:
+    """把一個事件編成 SSE frame (非文字 delta 的事件使用)"""
+    return b"data: " + json.dumps(payload, ensure_ascii=ensure_ascii).encode("utf-8") + b"\n\n"
+
+
+def encode_text(text: str) -> bytes:
+    return TEXT_FRAME_PREFIX + json.dumps(text, ensure_ascii=False).encode("utf-8") + FRAME_SUFFIX
+
+
+# 內容固定的事件，整個 frame 只編碼一次
+DONE_FRAME = encode_event({"type": "done"}, ensure_ascii=True)
+
+
+class SSEStream:
+    """
+    生產端 (Agent 事件迴圈) 呼叫 send_text / send_frame / close，
+    消費端 (StreamingResponse) 以 async for 讀取合併後的 bytes
+    """
+    def __init__(self, flush_interval: float = SSE_FLUSH_INTERVAL, max_frame_bytes: int = SSE_MAX_FRAME_BYTES,
+                 max_pending_bytes: int = SSE_MAX_PENDING_BYTES):
+        self.flush_interval = flush_interval
+        self.max_frame_bytes = max_frame_bytes
+        self.max_pending_bytes = max_pending_bytes
+
+        self._frames: List[bytes] = []  # 已經封好、等待送出的 frame
+        self._frames_bytes = 0
+        self._text: List[str] = []  # 還在累積的文字 delta
+        self._text_bytes = 0
+        self._text_started: Optional[float] = None  # 這一段文字開始累積的時間
+        self._closed = False
+        self._ready = asyncio.Event()  # 有資料可以送出 (或已結束)
+        self._drained = asyncio.Event()  # 消費端剛讀走資料
+        self._drained.set()
+
+        self.frames_sent = 0  # 實際送出的 frame 數 (合併後)
+        self.writes = 0  # 消費端讀取 (寫到 socket) 的次數
+        self.deltas = 0  # 收到的文字 delta 數
+
+    # --- 生產端 ---
+    async def send_text(self, delta: str):
+        if not delta:
+            return
+        if not self._text:
+            self._text_started = asyncio.get_running_loop().time()
+        self._text.append(delta)
+        self._text_bytes += len(delta.encode("utf-8"))
+        self.deltas += 1
+        if self._text_bytes >= self.max_frame_bytes:
+            self._seal_text()
+        self._ready.set()
+        await self._backpressure()
+
+    async def send_frame(self, frame: bytes):
+        """送出一個已編碼的事件 frame，之前累積的文字會先送出"""
+        self._seal_text()
+        self._frames.append(frame)
+        self._frames_bytes += len(frame)
+        self._ready.set()
+        await self._backpressure()
+
+    def close(self):
+        self._seal_text()
+        self._closed = True
+        self._ready.set()
+
+    async def _backpressure(self):
+        # 前端讀太慢，累積太多時先暫停生產端
+        while self._frames_bytes + self._text_bytes > self.max_pending_bytes and not self._closed:
+            self._drained.clear()
+            await self._drained.wait()
+
+    def _seal_text(self):
+        """把累積中的文字封成一個 frame"""
+        if not self._text:
+            return
+        frame = encode_text("".join(self._text))
+        self._frames.append(frame)
+        self._frames_bytes += len(frame)
+        self._text.clear()
+        self._text_bytes = 0
+        self._text_started = None
+
+    # --- 消費端 ---
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._ready.wait()
+
+            # 只有文字在累積時，等到時間窗結束再送 (第一段文字不等，讓使用者儘快看到回覆)
+            if self._text and not self._frames and not self._closed and self.frames_sent > 0:
+                delay = self._text_started + self.flush_interval - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            self._seal_text()
+            frames, self._frames, self._frames_bytes = self._frames, [], 0
+            self._ready.clear()
+            self._drained.set()
+
+            if frames:
+                self.frames_sent += len(frames)
+                self.writes += 1
+                yield b"".join(frames)  # 一次寫入可以包含多個 frame
+            if self._closed and not self._frames and not self._text:
+                return
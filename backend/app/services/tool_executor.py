@@ -0,0 +1,226 @@
+import os, asyncio, contextvars, functools, inspect, threading, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+"""
+Agent 工具專用的執行環境
+openai-agents 的 function_tool 遇到同步函式會直接在 event loop 上呼叫，
+工具裡的 Supabase / Tavily / Google API 呼叫會卡住同一個 worker 上所有人的串流
+- 同步工具丟到有上限的 thread pool 執行 (跟資料庫的 pool 分開，工具卡住不會影響一般 API)
+- 每個工具有自己的逾時，逾時回傳失敗訊息給 LLM，不會讓整個對話一直等
+- 記錄每個工具的排隊時間、執行時間、逾時與失敗次數
+注意：逾時只是不再等待結果，thread 內的呼叫會繼續跑完 (Python 沒辦法中斷 thread)
+      所以寫入類的工具要在真正寫入前呼叫 mark_write_started()，逾時時如果寫入已經開始，
+      回傳「結果未知」(TOOL_UNKNOWN_PREFIX) 而不是「稍後再試」，避免 LLM 或使用者重試造成重複記錄；
+      已經回傳「稍後再試」的話，mark_write_started() 會回傳 False，工具必須放棄寫入
+"""
+
+TOOL_MAX_WORKERS = int(os.getenv("TOOL_MAX_WORKERS", "8"))
+TOOL_DEFAULT_TIMEOUT = float(os.getenv("TOOL_DEFAULT_TIMEOUT", "30"))  # 秒
+TOOL_UNKNOWN_PREFIX = "[工具結果未知]"  # 寫入可能已經完成，不能當作失敗重試
+TOOL_ABANDONED_MESSAGE = "[工具調用失敗]：執行逾時，已放棄寫入。"  # 呼叫端已經逾時放棄時，工具的回傳值 (不會送到 LLM)
+
+_tool_executor = ThreadPoolExecutor(max_workers=TOOL_MAX_WORKERS, thread_name_prefix="agent-tool")
+
+
+@dataclass
+class ToolStats:
+    calls: int = 0
+    active: int = 0  # 正在執行
+    queued: int = 0  # 在 thread pool 排隊
+    timeouts: int = 0
+    failures: int = 0
+    waits: deque = field(default_factory=lambda: deque(maxlen=500))  # 排隊時間 (秒)
+    durations: deque = field(default_factory=lambda: deque(maxlen=500))  # 執行時間 (秒)
+
+
+_stats: Dict[str, ToolStats] = {}
+_stats_lock = threading.Lock()
+
+# 目前這次工具呼叫的狀態 (dict 是可變的，thread pool 與 wait_for 的 task 複製 context 後改的是同一個物件)
+# write_started / abandoned 由工具的 thread 與逾時的一方同時讀寫，都要在 _call_lock 內
+_call_state: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("tool_call_state", default=None)
+_call_lock = threading.Lock()
+
+
+def mark_write_started() -> bool:
+    """
+    寫入類工具在送出寫入 (INSERT、建立行程) 之前呼叫，之後逾時的話結果就是未知
+    回傳 False 代表呼叫端已經逾時放棄 (LLM 拿到的是可以重試的失敗訊息)，這時不可以再寫入，否則重試會造成重複記錄
+    用法:
+        if not mark_write_started():
+            return TOOL_ABANDONED_MESSAGE
+    """
+    state = _call_state.get()
+    if state is None:
+        return True
+    with _call_lock:
+        if state["abandoned"]:
+            return False
+        state["write_started"] = True
+        return True
+
+
+def _abandon(state: dict) -> bool:
+    """逾時時呼叫：標記呼叫端已經放棄，回傳寫入是否已經開始 (之後的 mark_write_started() 都會回傳 False)"""
+    with _call_lock:
+        state["abandoned"] = True
+        return state["write_started"]
+
+
+def _tool_stats(name: str) -> ToolStats:
+    with _stats_lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = ToolStats()
+        return stats
+
+
+async def run_in_tool_executor(func: Callable[..., Any], *args, name: Optional[str] = None,
+                               timeout: float = TOOL_DEFAULT_TIMEOUT, **kwargs) -> Any:
+    """
+    在工具專用的 thread pool 執行同步函式，並等待結果 (最多 timeout 秒，逾時丟出 asyncio.TimeoutError)
+    會複製目前的 context，讓 ContextVar (例如 LangSmith 追蹤、圖片網址) 在 thread 內也拿得到
+    """
+    stats = _tool_stats(name or func.__name__)
+    ctx = contextvars.copy_context()
+    submitted = time.monotonic()
+    state = {"started": False, "abandoned": False}  # 兩邊都要在 _stats_lock 內讀寫
+    with _stats_lock:
+        stats.calls += 1
+        stats.queued += 1
+
+    def run():
+        with _stats_lock:
+            if state["abandoned"]:
+                return None  # 還在排隊時就逾時了，不用執行
+            state["started"] = True
+            stats.queued -= 1
+            stats.active += 1
+            stats.waits.append(time.monotonic() - submitted)
+        start = time.monotonic()
+        try:
+            return ctx.run(func, *args, **kwargs)
+        finally:
+            with _stats_lock:
+                stats.active -= 1
+                stats.durations.append(time.monotonic() - start)
+
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.wait_for(loop.run_in_executor(_tool_executor, run), timeout=timeout)
+    except asyncio.TimeoutError:
+        with _stats_lock:
+            stats.timeouts += 1
+        raise
+    except Exception:
+        with _stats_lock:
+            stats.failures += 1
+        raise
+    finally:
+        with _stats_lock:
+            if not state["started"] and not state["abandoned"]:
+                state["abandoned"] = True
+                stats.queued -= 1
+
+
+def offload_tool(timeout: float = TOOL_DEFAULT_TIMEOUT, timeout_message: Optional[str] = None):
+    """
+    把工具函式包成 async 版本：同步函式丟到工具的 thread pool，async 函式直接執行，兩者都有逾時與統計
+    用 functools.wraps 保留函式名稱、參數與 docstring，function_tool 產生的 schema 不變
+    用法 (放在 function_tool / traceable 的下面):
+        @function_tool
+        @traceable(run_type="tool")
+        @offload_tool(timeout=20)
+        def web_search(query: str) -> str: ...
+    """
+    def decorator(func):
+        name = func.__name__
+        message = timeout_message or f"[工具調用失敗]：{name} 執行超過 {timeout:g} 秒，請告知使用者稍後再試。"
+        # 寫入已經開始才逾時：資料可能已經寫進去了，不要讓 LLM 自動重試
+        unknown_message = (f"{TOOL_UNKNOWN_PREFIX}：{name} 執行超過 {timeout:g} 秒，寫入可能已經完成。"
+                           "請不要再次呼叫工具，請告知使用者先查看記錄是否已經存在，沒有的話再重新記錄。")
+
+        def timed_out(state: dict) -> str:
+            write_started = _abandon(state)
+            print(f"⏱️ [工具逾時]: {name} 超過 {timeout:g} 秒 (寫入{'已' if write_started else '未'}開始)")
+            return unknown_message if write_started else message
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                stats = _tool_stats(name)
+                with _stats_lock:
+                    stats.calls += 1
+                    stats.active += 1
+                    stats.waits.append(0.0)
+                state = {"write_started": False, "abandoned": False}
+                token = _call_state.set(state)
+                start = time.monotonic()
+                try:
+                    return await asyncio.wait_for(func(*args, **kwargs), timeout=timeout)
+                except asyncio.TimeoutError:
+                    with _stats_lock:
+                        stats.timeouts += 1
+                    return timed_out(state)
+                except Exception:
+                    with _stats_lock:
+                        stats.failures += 1
+                    raise
+                finally:
+                    _call_state.reset(token)
+                    with _stats_lock:
+                        stats.active -= 1
+                        stats.durations.append(time.monotonic() - start)
+        else:
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                # 還在排隊就逾時的話不會執行，已經在執行但還沒開始寫入的話，之後也不會寫入，兩者都可以安全重試
+                state = {"write_started": False, "abandoned": False}
+                token = _call_state.set(state)
+                try:
+                    return await run_in_tool_executor(func, *args, name=name, timeout=timeout, **kwargs)
+                except asyncio.TimeoutError:
+                    return timed_out(state)
+                finally:
+                    _call_state.reset(token)
+        return wrapper
+    return decorator
+
+
+def _summary(values) -> dict:
+    values = sorted(values)
+    if not values:
+        return {"avg_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+    return {
+        "avg_ms": round(sum(values) / len(values) * 1000, 1),
+        "p95_ms": round(values[min(len(values) - 1, int(len(values) * 0.95))] * 1000, 1),
+        "max_ms": round(values[-1] * 1000, 1),
+    }
+
+
+def tool_stats() -> dict:
+    with _stats_lock:  # thread 內會同時更新，先複製一份
+        snapshot = {
+            name: (stats.calls, stats.active, stats.queued, stats.timeouts, stats.failures, list(stats.waits), list(stats.durations))
+            for name, stats in _stats.items()
+        }
+    return {
+        "max_workers": TOOL_MAX_WORKERS,
+        "queued": sum(item[2] for item in snapshot.values()),
+        "active": sum(item[1] for item in snapshot.values()),
+        "tools": {
+            name: {
+                "calls": calls,
+                "active": active,
+                "queued": queued,
+                "timeouts": timeouts,
+                "failures": failures,
+                "wait": _summary(waits),
+                "duration": _summary(durations),
+            }
+            for name, (calls, active, queued, timeouts, failures, waits, durations) in snapshot.items()
+        },
+    }
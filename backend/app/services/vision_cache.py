@@ -0,0 +1,100 @@
+import os, json, hashlib, sqlite3, threading, time
+from app.data.schema import FoodAnalysisResult
+from app.services.cache import TTLCache
+
+"""
+食物 Vision 分析結果的快取
+同一張照片 (以 Storage 物件的 ETag 判斷，也就是內容的 hash，不看網址) + 同樣的食物名稱與餐別，
+直接回傳上次的 FoodAnalysisResult，不再呼叫 GPT-4o (ETag 用 HEAD 請求取得，不用下載圖片)
+"""
+
+VISION_CACHE_SIZE = int(os.getenv("VISION_CACHE_SIZE", "512"))
+VISION_CACHE_TTL = float(os.getenv("VISION_CACHE_TTL", str(7 * 24 * 3600)))  # 預設保留 7 天
+VISION_CACHE_PATH = os.getenv("VISION_CACHE_PATH")  # 選填，有設定的話會額外存到 SQLite 檔案，重啟後仍有效
+
+
+class VisionResultCache:
+    """
+    兩層快取：記憶體 (LRU + TTL) -> SQLite 檔案 (選填)
+    每筆記錄會一併存下當初分析花的時間與 token 數，命中時累計到 saved_seconds / saved_tokens
+    """
+    def __init__(self, maxsize: int = VISION_CACHE_SIZE, ttl: float = VISION_CACHE_TTL, path: str | None = VISION_CACHE_PATH):
+        self.ttl = ttl
+        self._memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS vision_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self.saved_tokens = 0
+
+    @staticmethod
+    def make_key(image_id: str, food_name: str, meal_type: str) -> str:
+        """以圖片識別 (ETag 或網址) + 食物名稱 + 餐別產生快取 key"""
+        digest = hashlib.sha256(image_id.encode("utf-8"))
+        digest.update(b"\0" + food_name.strip().encode("utf-8"))
+        digest.update(b"\0" + meal_type.strip().encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> FoodAnalysisResult | None:
+        entry = self._memory.get(key)
+        if entry is None and self._db is not None:
+            entry = self._load(key)
+            if entry is not None:
+                self._memory.set(key, entry)  # 從檔案讀到的放回記憶體，下次更快
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.saved_seconds += entry["latency"]
+            self.saved_tokens += entry["tokens"]
+
+        # 每次都回傳新的物件，避免呼叫端修改 is_saved 時影響到快取內容
+        return FoodAnalysisResult.model_validate(entry["result"])
+
+    def set(self, key: str, result: FoodAnalysisResult, latency: float, tokens: int):
+        entry = {"result": result.model_dump(), "latency": latency, "tokens": tokens}
+        self._memory.set(key, entry)
+        if self._db is not None:
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO vision_cache (key, value, created_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(entry, ensure_ascii=False), time.time())
+                )
+                self._db.commit()
+
+    def _load(self, key: str) -> dict | None:
+        with self._lock:
+            row = self._db.execute("SELECT value, created_at FROM vision_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if time.time() - created_at > self.ttl:
+                self._db.execute("DELETE FROM vision_cache WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+        return json.loads(value)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "memory_size": len(self._memory),
+            "persistent": self._db is not None,
+            "saved_seconds": round(self.saved_seconds, 2),
+            "saved_tokens": self.saved_tokens,
+        }
+
+
+vision_cache = VisionResultCache()
@@ -0,0 +1,173 @@
+import numpy as np
+from datetime import datetime, timezone, timedelta
+from operator import itemgetter
+from typing import Any, Dict, List, Tuple
+from app.data.schema import ProgressHighlight, WorkoutAnalytics, WorkoutSummaryStats
+
+"""
+健身記錄的分析 (analyze_workout_progress 工具與 Dashboard 共用的計算核心)，以欄位 (column) 為單位用 NumPy 計算:
+- 時間字串一次轉成 datetime64 陣列，統一加 8 小時轉成台灣時間
+- 各部位次數用分組計數 (bincount) 一次算完；每個動作前後半段的平均先依動作排好，每段只呼叫一次內建的 sum()
+回傳 WorkoutAnalytics 物件，由工具轉成文字給 LLM，內容與原本逐筆計算的版本完全相同 (包含順序與小數點格式)
+"""
+
+TW_OFFSET = np.timedelta64(8, "h")
+
+# 進步的門檻 (與原本的判斷一致)
+PROGRESS_RULES = [
+    # (欄位, 類型, 單位, 門檻)
+    ("weights", "重量提升", "kg", 0),
+    ("sets", "組數提升", "組", 0),
+    ("reps", "次數提升", "下", 0.5),  # 次數提升至少要 0.5 下才能算進步
+    ("volume", "總量突破", "kg", 50),
+]
+
+
+def format_utc_to_tw_time(utc_str: str) -> str:
+    """把 DB 的 created_at 欄位字串，轉換成台灣時間字串 (LLM 要看)"""
+    try:
+        # Supabase 預設回傳的格式類似: "2026-02-25T02:47:08.55647+00:00"，是字串
+        # 轉成 Python 感知時間物件
+        utc_dt = datetime.fromisoformat(utc_str)
+
+        # 轉換為台灣的時區時間
+        tw_tz = timezone(timedelta(hours=8))
+        tw_datetime = utc_dt.astimezone(tw_tz)
+
+        # 轉成 LLM 容易讀的格式 (乾淨時間字串)
+        return tw_datetime.strftime("%Y-%m-%d %H:%M:%S")
+
+    except Exception as e:
+        print(f"[時間轉換錯誤] {e}")
+        return utc_str
+
+
+def _is_iso_datetime(raw: np.ndarray) -> np.ndarray:
+    """每一筆是否為 "YYYY-MM-DDTHH:MM:SS..." 的格式 (日期在前 10 個字元)"""
+    return np.strings.find(raw, "T") == 10
+
+
+def _day_keys(created_at: List[str]) -> np.ndarray:
+    """每筆記錄的日期字串 (created_at 中 'T' 之前的部分)"""
+    raw = np.array(created_at, dtype=str)
+    if np.all(_is_iso_datetime(raw)):
+        return raw.astype("U10")
+    return np.array([dt.split("T")[0] for dt in created_at], dtype=str)
+
+
+def _tw_times(created_at: List[str]) -> List[str]:
+    """
+    把 created_at 轉成台灣時間字串
+    Supabase 回傳的都是 "YYYY-MM-DDTHH:MM:SS[.ffffff]+00:00"，這種格式整批交給 NumPy 解析，
+    只要有一筆不是這個格式，就整批改用原本逐筆的 format_utc_to_tw_time (結果保證一致)
+    """
+    raw = np.array(created_at, dtype=str)
+    if np.all(np.strings.endswith(raw, "+00:00")) and np.all(_is_iso_datetime(raw)):
+        try:
+            # 前 19 個字元就是到秒的時間 (strftime 的 %S 本來就會捨去小數秒)
+            utc = raw.astype("U19").astype("datetime64[s]")
+            tw = np.datetime_as_string(utc + TW_OFFSET, unit="s")
+            return np.strings.replace(tw, "T", " ").tolist()
+        except ValueError:
+            pass
+    return [format_utc_to_tw_time(dt) for dt in created_at]
+
+
+def _group_by_first_appearance(values: List[str]) -> Tuple[List[str], np.ndarray]:
+    """
+    把字串分組，回傳 (依第一次出現順序排列的組名, 每一筆所屬的組別編號)
+    與 dict / Counter 的插入順序相同
+    """
+    uniques, first_index, inverse = np.unique(np.array(values, dtype=str), return_index=True, return_inverse=True)
+    order = np.argsort(first_index, kind="stable")  # 依第一次出現的位置排序
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return uniques[order].tolist(), rank[inverse]
+
+
+def _half_split_improvement(group: np.ndarray, counts: np.ndarray, columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    每個動作把記錄分成前半段 / 後半段 (依查詢結果的順序)，回傳「後半段平均 - 前半段平均」
+    加總刻意用內建的 sum() 而不是 bincount：Python 3.12 之後 sum() 對浮點數用補償加總 (compensated summation)，
+    逐筆累加的結果會差一點點 (例如 10.1+10.2+10.3 前後顛倒會多出 1.8e-15，被判成「+0.0kg」的進步)，
+    用同一個 sum() 才能跟原本的版本在任何 Python 版本都算出一模一樣的浮點數
+    """
+    n_groups = len(counts)
+    # 依動作排序 (stable，同一個動作內還是第幾次訓練的順序)，每個動作是 order 中連續的一段
+    order = np.argsort(group, kind="stable")
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    mid = counts // 2  # (取整，5 // 2 = 2)
+    bounds = [(int(start), int(start + half), int(start + count)) for start, half, count in zip(starts, mid, counts)]
+
+    improvements = {}
+    for key, values in columns.items():
+        ordered = values[order].tolist()  # 依動作排好 (同一個動作內保持原本的順序)
+        improvement = np.zeros(n_groups)
+        for index, (start, split, end) in enumerate(bounds):
+            if split == start:
+                continue  # 只有一筆的動作 mid = 0，之後會被略過
+            past = sum(ordered[start:split]) / (split - start)
+            recent = sum(ordered[split:end]) / (end - split)
+            improvement[index] = recent - past
+        improvements[key] = improvement
+    return improvements
+
+
+def compute_workout_analytics(db_records: List[Dict[str, Any]], days: int, include_raw: bool = True) -> WorkoutAnalytics:
+    """
+    計算健身記錄的分析結果
+    Args:
+        db_records: get_filtered_workouts 查到的記錄 (不可為空)
+        days: 查詢的天數，用來計算每週頻率
+        include_raw: 是否要附上每筆記錄 (給 LLM 看的格式)，Dashboard 只需要統計結果，不用產生
+    """
+    total = len(db_records)
+    names = list(map(itemgetter("exercise_name"), db_records))
+    parts = list(map(itemgetter("body_part"), db_records))
+    created_at = list(map(itemgetter("created_at"), db_records))
+    weights_raw = list(map(itemgetter("weight"), db_records))
+    sets_raw = list(map(itemgetter("sets"), db_records))
+    reps_raw = list(map(itemgetter("reps"), db_records))
+
+    workout_raw_list = None
+    if include_raw:
+        # 這是之後要給 LLM 看的返回 (關於所有查詢到的記錄)
+        workout_raw_list = [
+            {"日期": dt, "動作": name, "部位": part, "數據": f"{w}kg x {s}組 x {r}下"}
+            for dt, name, part, w, s, r in zip(_tw_times(created_at), names, parts, weights_raw, sets_raw, reps_raw)
+        ]
+
+    # 各部位的訓練次數 (依第一次出現的順序)
+    part_names, part_group = _group_by_first_appearance(parts)
+    part_counts = np.bincount(part_group, minlength=len(part_names))
+
+    # 將同個動作的不同時間訓練分在同一組，這樣就可以知道多次訓練的進步幅度
+    exercise_names, exercise_group = _group_by_first_appearance(names)
+    exercise_counts = np.bincount(exercise_group, minlength=len(exercise_names))
+    weights = np.asarray(weights_raw, dtype=np.float64)
+    sets = np.asarray(sets_raw, dtype=np.float64)
+    reps = np.asarray(reps_raw, dtype=np.float64)
+    improvements = _half_split_improvement(exercise_group, exercise_counts, {
+        "weights": weights, "sets": sets, "reps": reps, "volume": weights * sets * reps,
+    })
+
+    progress_highlights = []  # 記錄動作的進步狀況
+    for index, name in enumerate(exercise_names):
+        if exercise_counts[index] < 2:  # 至少要有兩次訓練才能算進步
+            continue
+        for key, label, unit, threshold in PROGRESS_RULES:
+            imp = float(improvements[key][index])
+            if imp > threshold:
+                progress_highlights.append(ProgressHighlight(exercise_name=name, kind=label, improvement=f"+{imp:.1f}{unit}"))
+
+    total_days = len(np.unique(_day_keys(created_at)))  # 同一天的訓練只記一次
+    summary_stats = WorkoutSummaryStats(
+        total_days=total_days,  # 這是使用者給的特定 days 內的訓練天數
+        weekly_frequency=f"{total_days / (days/7):.1f}次",
+        part_distribution={part: f"{(int(count)/total)*100:.1f}%" for part, count in zip(part_names, part_counts)},
+        progress_highlights=progress_highlights,
+    )
+    # workout_raw_data 可能有上百萬筆，都是上面剛組好的字串，不需要再讓 pydantic 逐筆驗證
+    return WorkoutAnalytics.model_construct(workout_raw_data=workout_raw_list, summary_stats=summary_stats)
+
@@ -1,51 +1,37 @@
-from typing import Counter, Dict, List, Any, Optional, Literal
+from typing import Dict, List, Any, Optional, Literal
 from agents import function_tool
-from app.data.repositories import WorkOutRepository, FoodRepository
-from app.data.schema import WorkoutLogRequest
+from app.data.repositories import WorkOutRepository, FoodRepository, run_in_db_executor
+from app.data.schema import WorkoutLogRequest, WorkoutAnalytics
 from app.services.ai_service import OpenAIService
+from app.services.dashboard_cache import dashboard_cache
+from app.services.workout_analytics import compute_workout_analytics
 from app.services.context import current_image_ctx  # 去共用的 context.py 拿 current_image_ctx
-from app.services.google_manager import GoogleManager
-from datetime import datetime, timezone, timedelta
-from supabase import create_client, Client
-import json, os, traceback
-from tavily import TavilyClient
+from app.services.google_manager import GoogleManager, invalidate_google_session
+from app.services.search_service import web_search_service
+from app.services.tool_executor import offload_tool, mark_write_started, TOOL_ABANDONED_MESSAGE
+from datetime import datetime, timedelta
+from app.data.database import get_supabase
+from app.data.storage import storage_client
+import json, traceback
 from langsmith import traceable
 from google.auth.exceptions import RefreshError
 
-# 可以聯網搜尋的工具
-tavily_client = TavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
-
 workout_repo = WorkOutRepository()
 food_repo = FoodRepository()
 
-supabase_url = os.getenv("SUPABASE_URL")
-supabase_key = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(supabase_url, supabase_key)
-
 # --- 輔助 Tools 的函式 ---
 
-# 幫忙把 DB 的 created_at 欄位字串，轉換成台灣時間字串 (LLM 要看)
-def format_utc_to_tw_time(utc_str: str) -> str:
-    try:
-        # Supabase 預設回傳的格式類似: "2026-02-25T02:47:08.55647+00:00"，是字串
-        # 轉成 Python 感知時間物件
-        utc_dt = datetime.fromisoformat(utc_str)
-
-        # 轉換為台灣的時區時間
-        tw_tz = timezone(timedelta(hours=8))
-        tw_datetime = utc_dt.astimezone(tw_tz)
-
-        # 轉成 LLM 容易讀的格式 (乾淨時間字串)
-        return tw_datetime.strftime("%Y-%m-%d %H:%M:%S")
-
-    except Exception as e:
-        print(f"[時間轉換錯誤] {e}")
-        return utc_str  
+# 把聊天室的圖片複製一份到 food_images bucket，回傳新圖片的公開網址 (同步的 storage 呼叫，要丟到 thread pool 執行)
+def copy_chat_image_to_food_bucket(path_in_bucket: str, new_path_in_bucket: str) -> str:
+    # 在 Storage 伺服器端直接複製，圖片不會經過後端 (不再下載整張圖片再上傳)
+    storage_client.copy_object('chat_images', path_in_bucket, 'food_images', new_path_in_bucket)
+    return get_supabase().storage.from_('food_images').get_public_url(new_path_in_bucket)
 
 
 # --- Define Tools ---
 @function_tool
 @traceable(run_type="tool")
+@offload_tool(timeout=15)  # 同步的資料庫呼叫丟到工具的 thread pool，不卡住其他人的串流
 def record_workout_exercise(exercise_name: str, body_part: Literal["胸部","背部","腿部","肩膀","手臂","核心"], weight: float, sets: int, reps: int) -> str:
     """
     當使用者提到他們完成某項訓練動作，或提及記錄訓練動作，呼叫此工具將數據寫入系統。
@@ -66,7 +52,10 @@ def record_workout_exercise(exercise_name: str, body_part: Literal["胸部","背
         )
         
         # 將健身記錄儲存至資料庫 (呼叫 repositories 的方法)
-        workout_repo.save_workout_logs(workout_data)
+        if not mark_write_started():  # 從這裡開始逾時的話，記錄可能已經寫入；已經逾時的話就不寫入
+            return TOOL_ABANDONED_MESSAGE
+        if workout_repo.save_workout_logs(workout_data):
+            dashboard_cache.invalidate()  # 有新的訓練記錄，儀表板要重新計算
         return f"[Tool Output]: 已成功記錄 {body_part} 訓練 - {exercise_name}，{weight}kg，{sets}組，{reps}下。"
     except ValueError as ve:
         # 如果 Pydantic 驗證失敗，會噴出 ValueError
@@ -78,6 +67,37 @@ def record_workout_exercise(exercise_name: str, body_part: Literal["胸部","背
 
 @function_tool
 @traceable(run_type="tool")
+@offload_tool(timeout=15)
+def record_workout_exercises(workouts: List[WorkoutLogRequest]) -> str:
+    """
+    當使用者一次提到「兩個以上」完成的訓練動作時 (例如：「今天臥推 60kg 4組8下、飛鳥 12kg 3組12下」)，呼叫此工具一次記錄全部動作，
+    不要為每個動作分別呼叫 record_workout_exercise。
+    參數:
+        workouts: 每個訓練動作的資料。
+            exercise_name: 訓練動作名稱。請「絕對保留」使用者原本輸入的原始語言與字詞，絕對不要自行翻譯成英文。
+            body_part: 訓練部位，請根據使用者的描述（如：胸肌、練胸、推胸），自動理解語意並映射到最符合的部位選項。
+    """
+    try:
+        print(f"⚙️ [Tool 執行] record_workout_exercises: {len(workouts)} 個動作")
+        if not workouts:
+            return "[工具調用失敗]：沒有可以記錄的訓練動作，請使用者提供動作、重量、組數與次數。"
+
+        # 整批一起寫入 (一次資料庫往返)
+        if not mark_write_started():
+            return TOOL_ABANDONED_MESSAGE
+        if not workout_repo.save_workout_logs_batch(workouts):
+            return "[工具調用失敗]：寫入系統失敗，請告知使用者系統發生內部錯誤，稍後再試。"
+        dashboard_cache.invalidate()  # 有新的訓練記錄，儀表板要重新計算
+
+        lines = [f"- {w.body_part} - {w.exercise_name}，{w.weight}kg，{w.sets}組，{w.reps}下" for w in workouts]
+        return f"[Tool Output]: 已成功記錄 {len(workouts)} 個訓練動作：\n" + "\n".join(lines)
+    except Exception as e:
+        print(f"[系統錯誤]: {e}")
+        return "[工具調用失敗]：寫入系統失敗，請告知使用者系統發生內部錯誤，稍後再試。"
+
+@function_tool
+@traceable(run_type="tool")
+@offload_tool(timeout=20)
 def analyze_workout_progress(days: int, 
                         body_parts: Optional[List[Literal["胸部", "背部", "腿部", "肩膀", "手臂", "核心"]]] = None,  # Optional 可選填，不限定只能一種
                         ) -> str: # 回傳的字串，給 LLM 讀的
@@ -89,91 +109,32 @@ def analyze_workout_progress(days: int,
     """
     return fetch_workout_analytics(days, body_parts)
 
+def get_workout_analytics(days: int, body_parts: Optional[List[str]] = None, include_raw: bool = True) -> Optional[WorkoutAnalytics]:
+    """查詢並分析健身記錄，供工具與 API 共用，沒有符合條件的記錄時回傳 None"""
+    print(f"⚙️ [數據分析] get_workout_analytics: 查詢最近 {days} 天，部位={body_parts}")
+    # 查詢特定條件的健身記錄
+    db_records = workout_repo.get_filtered_workouts(
+        days=days,
+        body_parts=body_parts
+    )
+    if not db_records:
+        return None
+    # 逐欄計算 (NumPy)
+    return compute_workout_analytics(db_records, days, include_raw=include_raw)
+
 def fetch_workout_analytics(days: int, body_parts: Optional[List[str]] = None) -> str:
-    """這是純 Python 邏輯函數，供工具與 API 共用"""
-    print(f"⚙️ [數據分析] fetch_workout_analytics: 查詢最近 {days} 天，部位={body_parts}")
+    """analyze_workout_progress 工具的文字輸出，把分析結果轉成 LLM 看的 JSON 字串"""
     try:
-        # 查詢特定條件的健身記錄
-        db_records = workout_repo.get_filtered_workouts(
-            days=days,
-            body_parts=body_parts
-        )
-        if not db_records:
+        analytics = get_workout_analytics(days, body_parts)
+        if analytics is None:
             return "[工具調用失敗]: 資料庫回傳空陣列，請告訴使用者過去 {days} 天內沒有符合條件的健身記錄。"
 
-        unique_days = set()  # 有可能同一天有多筆訓練紀錄，我們會想知道範圍內哪幾天有訓練的
-        part_counter = Counter()  # 計算各部位的訓練次數
-
-        exercise_data = {}  # ex: {"深蹲": {"weights": [60, 62], "reps": [10, 8], "volumes": [600, 496]}}
-
-        workout_raw_list = []
-        
-        for row in db_records:
-            dt = row["created_at"]
-            unique_days.add(dt.split('T')[0])  # 同一天的訓練只記一次   
-            part = row["body_part"]
-            part_counter[part] += 1  # 記該部位練了幾次
-            name = row["exercise_name"]
-            w ,s, r = row["weight"], row["sets"], row["reps"]
-            volume = w * s * r  
-
-            # 這是之後要給 LLM 看的返回 (關於所有查詢到的記錄)
-            workout_raw_list.append({
-                "日期": format_utc_to_tw_time(dt),
-                "動作": name, "部位": part, "數據": f"{w}kg x {s}組 x {r}下"
-            })
-
-            # 要將同個動作的的不同時間訓練串在一起，這樣就可以知道多次訓練的進步幅度
-            if name not in exercise_data:
-                exercise_data[name] = {"weights": [], "sets": [], "reps": [], "volume": []}
-            exercise_data[name]["weights"].append(w)
-            exercise_data[name]["sets"].append(s)
-            exercise_data[name]["reps"].append(r)
-            exercise_data[name]["volume"].append(volume)
-
-        progress_highlights = []  # 記錄動作的進步狀況，給 LLM 看的
-
-        # 一個動作一個動作判斷
-        for name, metrics in exercise_data.items():
-            if len(metrics["weights"]) < 2:  # 至少要有兩次訓練才能算進步
-                continue
-
-            # 如何判斷有無進步: 將使用者給的時間範圍內的記錄，取前半段和後半段，比較
-            mid = len(metrics["weights"]) // 2   # (取整，5 // 2 = 2)
-
-            # 輔助: 判斷 key 這個值的進步幅度
-            def get_imp(key):
-                past = sum(metrics[key][:mid]) / mid  # 前半段的平均
-                recent = sum(metrics[key][mid:]) / (len(metrics[key]) - mid)  # 後半段的平均
-                return recent - past
-
-            imp_w = get_imp("weights")
-            imp_s = get_imp("sets")
-            imp_r = get_imp("reps")
-            imp_v = get_imp("volume")
-
-            # 開始判斷所有數據有無進步
-            if imp_w > 0:
-                progress_highlights.append({"動作": name, "類型": "重量提升", "進步": f"+{imp_w:.1f}kg"})
-            if imp_s > 0:
-                progress_highlights.append({"動作": name, "類型": "組數提升", "進步": f"+{imp_s:.1f}組"})
-            if imp_r > 0.5:  # 次數提升至少要 0.5 下才能算進步
-                progress_highlights.append({"動作": name, "類型": "次數提升", "進步": f"+{imp_r:.1f}下"})
-            if imp_v > 50:
-                progress_highlights.append({"動作": name, "類型": "總量突破", "進步": f"+{imp_v:.1f}kg"})
-
-       # 結構化最後的結果，要返回給 LLM 看的
-        analytics = {
-            "workout_raw_data": workout_raw_list,
-            "summary_stats": {
-                "total_days": len(unique_days),  # 這是使用者給的特定 days 內的訓練天數
-                "weekly_frequency": f"{len(unique_days) / (days/7):.1f}次",
-                "part_distribution": {k: f"{(v/len(db_records))*100:.1f}%" for k, v in part_counter.items()},
-                "progress_highlights": progress_highlights
-            }
+        # 結構化最後的結果 (中文欄位名稱)，要返回給 LLM 看的
+        output = {
+            "workout_raw_data": analytics.workout_raw_data,
+            "summary_stats": analytics.summary_stats.model_dump(by_alias=True),
         }
-        
-        return f"[Tool Output]: {json.dumps(analytics, ensure_ascii=False)}"
+        return f"[Tool Output]: {json.dumps(output, ensure_ascii=False)}"
     
     except Exception as e:
         print(f"[系統錯誤]: {e}")
@@ -181,7 +142,8 @@ def fetch_workout_analytics(days: int, body_parts: Optional[List[str]] = None) -
 
 @function_tool
 @traceable(run_type="tool")
-def record_food_intake_with_vision(meal_type: str, food_name: str) -> str:
+@offload_tool(timeout=60)  # 已經是 async (Vision 分析比較久)，這裡只加上逾時與統計
+async def record_food_intake_with_vision(meal_type: str, food_name: str) -> str:
     """
     當使用者傳送圖片，並「表達」要儲存或記錄這餐飲食時（例如說：「幫我記錄這餐」）呼叫此工具。
     參數:
@@ -204,21 +166,16 @@ def record_food_intake_with_vision(meal_type: str, food_name: str) -> str:
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
         new_path_in_bucket = f"{timestamp}_{path_in_bucket}"
 
-        # 從 chat_images 下載檔案內容
-        file_content = supabase.storage.from_('chat_images').download(path_in_bucket)
-
-        # 把剛剛下載的檔案 (圖片) 上傳一份到 food_images 的 bucket 上
-        supabase.storage.from_('food_images').upload(
-            path=new_path_in_bucket,
-            file=file_content,
-        )
-
-        new_food_url = supabase.storage.from_('food_images').get_public_url(new_path_in_bucket)
+        new_food_url = await run_in_db_executor(copy_chat_image_to_food_bucket, path_in_bucket, new_path_in_bucket)
 
-        # 呼叫 AI 分析圖片
-        ai_result = OpenAIService.analyze_food_image(new_food_url, food_name, meal_type)
+        # 呼叫 AI 分析圖片 (非同步版本，分析期間其他使用者的串流不會被卡住)
+        ai_result = await OpenAIService.analyze_food_image_async(new_food_url, food_name, meal_type)
 
-        save_record = food_repo.save_food_logs(
+        # 分析 (最花時間的部分) 完成後才寫入，在這之前逾時可以安全重試
+        if not mark_write_started():
+            return TOOL_ABANDONED_MESSAGE
+        save_record = await run_in_db_executor(
+            food_repo.save_food_logs,
             food_data=ai_result,
             image_url=new_food_url,
             food_name=food_name,
@@ -227,6 +184,7 @@ def record_food_intake_with_vision(meal_type: str, food_name: str) -> str:
 
         if not save_record:
             return "[工具調用失敗]：記錄失敗。請告知使用者稍後再試。"
+        dashboard_cache.invalidate()
 
         ai_result_dict = ai_result.model_dump()  # pyｄantic 物件轉成 dict
 
@@ -240,7 +198,8 @@ def record_food_intake_with_vision(meal_type: str, food_name: str) -> str:
 
 @function_tool
 @traceable(run_type="tool")
-async def schedule_appointment(summary: str, start_time: str, user_id: str = "tester_01", duration_minutes: int = 60) -> str:
+@offload_tool(timeout=20)  # Google API 的呼叫都是同步的，改成同步函式丟到 thread pool
+def schedule_appointment(summary: str, start_time: str, user_id: str = "tester_01", duration_minutes: int = 60) -> str:
     """
     當使用者想要「預約」、「安排」、「約定」任何未來的健身行程、課程或重要事件時，必須呼叫此工具。
     這是系統唯一的行程排定管道。
@@ -272,13 +231,17 @@ async def schedule_appointment(summary: str, start_time: str, user_id: str = "te
             'end': {'dateTime': end_dt.isoformat(), 'timeZone': 'Asia/Taipei'},
         }
 
-        # 新增行程 (primary 代表要操作使用者的主要日曆)
-        result = calendar.events().insert(calendarId='primary', body=event).execute()
+        # 新增行程 (primary 代表要操作使用者的主要日曆)，service 是快取共用的，同一個使用者要依序呼叫
+        if not mark_write_started():  # GoogleManager / build() 花太久已經逾時，不要在使用者重試後多出一筆行程
+            return TOOL_ABANDONED_MESSAGE
+        with gm.session.lock:
+            result = calendar.events().insert(calendarId='primary', body=event).execute()
         return f"[Tool Output]✅ 行程已排定！名稱：{summary}，連結：[點我查看]({result.get('htmlLink')})"
 
     except RefreshError as e:
         # 當 Token 失效、被撤銷或過期時會進到這裡
         print(f"⚠️ [授權失效]: 使用者 {user_id} 的 Google Token 已過期或被撤銷")
+        invalidate_google_session(user_id)  # 丟掉快取的憑證，重新授權後才會讀到新的 token
         
         return (
             f"[工具調用失敗]: 由於您的 Google 授權已過期，無法自動排定行程。請點擊下方連結重新授權：\n"
@@ -292,24 +255,21 @@ async def schedule_appointment(summary: str, start_time: str, user_id: str = "te
 
 @function_tool
 @traceable(run_type="tool")
+@offload_tool(timeout=30)
 def web_search(query: str) -> str:
     """
     當使用者詢問關於健身科學、營養研究、動作細節、補給品建議，或任何即時健身資訊時，呼叫此工具聯網搜尋。
     參數:
         query: 搜尋關鍵字，請將使用者的問題轉化為適合搜尋健身知識的關鍵字。
     """
-    if not tavily_client:
+    if not web_search_service.enabled:
         return f"[工具調用失敗]: 聯網搜尋功能尚未啟用。"
     
     try:
         print(f"🌐 [Tool 執行] web_search: 正在搜尋 '{query}'")
 
-        response = tavily_client.search(
-            query=query,
-            search_depth="advanced",
-            max_results=3,             
-            include_answer=True
-        )
+        # 相同 (正規化後) 的關鍵字會直接用快取，同時在搜尋的相同關鍵字只會呼叫一次 Tavily
+        response = web_search_service.search(query)
 
         # 整理搜尋結果給 LLM 看
         search_results = []
@@ -341,4 +301,4 @@ def web_search(query: str) -> str:
 
 
 # 將所有 tools 打包成一個 list，給 AI 讀取
-AGENT_TOOLS = [record_workout_exercise, analyze_workout_progress, record_food_intake_with_vision, schedule_appointment, web_search]
+AGENT_TOOLS = [record_workout_exercise, record_workout_exercises, analyze_workout_progress, record_food_intake_with_vision, schedule_appointment, web_search]
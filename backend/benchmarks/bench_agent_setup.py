@@ -0,0 +1,52 @@
+"""
+量測每一輪對話建立 Agent 的成本:
+    舊做法: 每次都新建 OpenAIChatCompletionsModel + Agent，並重新產生 get_agent_instructions(now_str)
+    新做法: CoachAgentFactory.get_agent() (同一天只 clone 模板)
+
+執行方式 (在 backend/ 底下，不會呼叫 OpenAI API):
+    python -m benchmarks.bench_agent_setup --turns 20000
+"""
+import argparse, time
+from agents import Agent, AsyncOpenAI, OpenAIChatCompletionsModel
+from app.tools import tools
+from app.services.agent_instructions import get_agent_instructions
+from app.services.agent_factory import CoachAgentFactory, today_str
+
+
+def legacy_setup(client: AsyncOpenAI) -> Agent:
+    now_str = today_str()
+    agent_model = OpenAIChatCompletionsModel(model="gpt-4o", openai_client=client)
+    return Agent(
+        name="GentleCoach",
+        instructions=get_agent_instructions(now_str),
+        tools=tools.AGENT_TOOLS,
+        model=agent_model
+    )
+
+
+def bench(fn, turns: int) -> float:
+    """回傳每一輪平均花費的微秒數"""
+    start = time.perf_counter()
+    for _ in range(turns):
+        fn()
+    return (time.perf_counter() - start) / turns * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=20000)
+    args = parser.parse_args()
+
+    client = AsyncOpenAI(api_key="bench")
+    factory = CoachAgentFactory(client)
+
+    legacy_us = bench(lambda: legacy_setup(client), args.turns)
+    factory_us = bench(lambda: factory.get_agent(today_str()), args.turns)
+
+    print(f"每輪 Agent 建立成本 ({args.turns} 輪平均)")
+    print(f"  每次新建 Agent      : {legacy_us:8.1f} µs")
+    print(f"  CoachAgentFactory   : {factory_us:8.1f} µs  ({legacy_us / factory_us:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
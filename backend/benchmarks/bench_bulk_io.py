@@ -0,0 +1,118 @@
+"""
+大量匯入 / 匯出的吞吐量測試 (不連資料庫):
+    匯入: 產生 N 筆的 CSV / NDJSON 檔案 (混入少量錯誤資料)，用 import_file 逐筆驗證、分批寫入
+          寫入用假的 insert_rows (只計數，可用 --insert-latency 模擬每批 INSERT 的耗時)
+          對照組是原本一筆一個 /workout 請求 (每筆一次 INSERT)
+    匯出: 用假的 fetch_page 產生 N 筆記錄，測 stream_export 轉成 CSV / NDJSON 的速度
+同時記錄最大記憶體用量 (ru_maxrss) 的增加量，確認記憶體不會隨筆數成長
+
+執行方式 (在 backend/ 底下):
+    python -m benchmarks.bench_bulk_io --rows 1000000
+"""
+import argparse, asyncio, csv, json, os, random, resource, tempfile, time
+from datetime import datetime, timezone, timedelta
+from app.services.bulk_io import import_file, stream_export
+
+EXERCISES = [("臥推", "胸部"), ("深蹲", "腿部"), ("硬舉", "背部"), ("肩推", "肩膀"), ("二頭彎舉", "手臂"), ("棒式", "核心")]
+FIELDS = ["exercise_name", "body_part", "weight", "sets", "reps", "created_at"]
+
+
+def max_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Linux 的單位是 KB
+
+
+def make_rows(n: int, seed: int = 0, bad_every: int = 10000):
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for i in range(n):
+        name, part = rng.choice(EXERCISES)
+        row = {
+            "exercise_name": name,
+            "body_part": part,
+            "weight": round(rng.uniform(5, 150) * 2) / 2,
+            "sets": rng.randint(1, 6),
+            "reps": rng.randint(1, 15),
+            "created_at": (start + timedelta(minutes=i)).isoformat(),
+        }
+        if bad_every and i % bad_every == bad_every - 1:
+            row["body_part"] = "屁股"  # 不在選項內，驗證會失敗
+        yield row
+
+
+def write_files(directory: str, n: int):
+    csv_path = os.path.join(directory, "workouts.csv")
+    ndjson_path = os.path.join(directory, "workouts.ndjson")
+    with open(csv_path, "w", encoding="utf-8", newline="") as csv_file, open(ndjson_path, "w", encoding="utf-8") as ndjson_file:
+        writer = csv.DictWriter(csv_file, fieldnames=FIELDS)
+        writer.writeheader()
+        for row in make_rows(n):
+            writer.writerow(row)
+            ndjson_file.write(json.dumps(row, ensure_ascii=False) + "\n")
+    return {"csv": csv_path, "ndjson": ndjson_path}
+
+
+def bench_import(path: str, fmt: str, chunk_size: int, insert_latency: float):
+    stats = {"statements": 0}
+
+    def insert_rows(rows):
+        stats["statements"] += 1
+        if insert_latency:
+            time.sleep(insert_latency)
+        return True
+
+    rss = max_rss_mb()
+    start = time.perf_counter()
+    with open(path, "rb") as binary:
+        report = import_file("workout", binary, fmt, insert_rows, chunk_size=chunk_size)
+    wall = time.perf_counter() - start
+    return report, stats["statements"], wall, max_rss_mb() - rss
+
+
+async def bench_export(n: int, fmt: str, page_size: int):
+    template = list(make_rows(page_size, bad_every=0))  # 事先產生一頁，測的是轉換格式與送出的速度
+    served = 0
+
+    async def fetch_page(limit, cursor):
+        nonlocal served
+        count = min(limit, n - served)
+        page = [{"id": served + i + 1, **template[i % len(template)]} for i in range(count)]
+        served += count
+        return page
+
+    rss = max_rss_mb()
+    size = 0
+    start = time.perf_counter()
+    async for chunk in stream_export("workout", fetch_page, fmt, page_size=page_size):
+        size += len(chunk.encode("utf-8"))
+    return size, time.perf_counter() - start, max_rss_mb() - rss
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--insert-latency", type=float, default=0.0, help="模擬每個 INSERT 的耗時 (秒)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        paths = write_files(directory, args.rows)
+        print(f"產生 {args.rows:,} 筆測試檔案: {time.perf_counter() - start:.1f}s "
+              f"(CSV {os.path.getsize(paths['csv']) / 1e6:.0f} MB, NDJSON {os.path.getsize(paths['ndjson']) / 1e6:.0f} MB)")
+
+        print(f"\n匯入 (每批 {args.chunk_size} 筆)")
+        print(f"{'格式':<8} | {'成功':>9} | {'失敗':>6} | {'INSERT 次數':>11} | {'逐筆 INSERT':>11} | {'耗時 (s)':>8} | {'筆/秒':>9} | {'記憶體增加 (MB)':>14}")
+        for fmt in ("csv", "ndjson"):
+            report, statements, wall, rss = bench_import(paths[fmt], fmt, args.chunk_size, args.insert_latency)
+            print(f"{fmt:<8} | {report.imported:>9,} | {report.failed:>6,} | {statements:>11,} | {args.rows:>11,} | "
+                  f"{wall:>8.2f} | {args.rows / wall:>9,.0f} | {rss:>14.1f}")
+
+    print(f"\n匯出 (每頁 {args.chunk_size} 筆)")
+    print(f"{'格式':<8} | {'大小 (MB)':>9} | {'耗時 (s)':>8} | {'筆/秒':>9} | {'記憶體增加 (MB)':>14}")
+    for fmt in ("csv", "ndjson"):
+        size, wall, rss = asyncio.run(bench_export(args.rows, fmt, args.chunk_size))
+        print(f"{fmt:<8} | {size / 1e6:>9.1f} | {wall:>8.2f} | {args.rows / wall:>9,.0f} | {rss:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
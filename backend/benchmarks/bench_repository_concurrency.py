@@ -0,0 +1,78 @@
+"""
+模擬 N 個同時進行的 /chat 串流，比較「同步 Repository」與「AsyncRepository」的總耗時與 event loop 卡頓
+每個串流的資料庫動作與 AgentService.chat_stream 一致: 存使用者訊息 -> 撈歷史 -> 存 AI 回覆
+
+執行方式 (在 backend/ 底下):
+    python -m benchmarks.bench_repository_concurrency --streams 20 --latency 0.15
+"""
+import argparse, asyncio, time
+from app.data.repositories import ChatRepository, AsyncRepository
+
+
+class SlowChatRepository(ChatRepository):
+    """不連 Supabase，只用 time.sleep 模擬一次 PostgREST 來回的延遲"""
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def get_recent_messages(self, session_id: str, limit: int):
+        time.sleep(self.latency)
+        return [{"role": "user", "content": "hi", "image_url": None}]
+
+    def create_message(self, session_id: str, role: str, content: str, image_url: str | None = None):
+        time.sleep(self.latency)
+        return True
+
+
+async def sync_stream(repo: ChatRepository, session_id: str):
+    repo.create_message(session_id, "user", "hi")
+    repo.get_recent_messages(session_id, limit=50)
+    await asyncio.sleep(0.05)  # 模擬 LLM 串流的時間
+    repo.create_message(session_id, "assistant", "hello")
+
+
+async def async_stream(repo: AsyncRepository, session_id: str):
+    await repo.create_message(session_id, "user", "hi")
+    await repo.get_recent_messages(session_id, limit=50)
+    await asyncio.sleep(0.05)
+    await repo.create_message(session_id, "assistant", "hello")
+
+
+async def measure(stream_fn, repo, streams: int):
+    """回傳 (總耗時, event loop 最大延遲)"""
+    max_lag = 0.0
+    running = True
+
+    # 心跳任務：每 10ms 醒來一次，實際醒來的延遲就是 event loop 被卡住的時間
+    async def heartbeat():
+        nonlocal max_lag
+        while running:
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            max_lag = max(max_lag, time.perf_counter() - start - 0.01)
+
+    hb = asyncio.create_task(heartbeat())
+    start = time.perf_counter()
+    await asyncio.gather(*(stream_fn(repo, f"session-{i}") for i in range(streams)))
+    elapsed = time.perf_counter() - start
+    running = False
+    await hb
+    return elapsed, max_lag
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.15, help="單次資料庫呼叫延遲 (秒)")
+    args = parser.parse_args()
+
+    repo = SlowChatRepository(args.latency)
+    sync_elapsed, sync_lag = await measure(sync_stream, repo, args.streams)
+    async_elapsed, async_lag = await measure(async_stream, AsyncRepository(repo), args.streams)
+
+    print(f"{args.streams} 個串流，每次資料庫呼叫 {args.latency * 1000:.0f}ms")
+    print(f"  同步 Repository : 總耗時 {sync_elapsed:.2f}s，event loop 最大卡頓 {sync_lag * 1000:.0f}ms")
+    print(f"  AsyncRepository : 總耗時 {async_elapsed:.2f}s，event loop 最大卡頓 {async_lag * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+"""
+模擬多個同時進行的 /chat 串流，比較 SSE 的送出方式:
+    舊做法: 每個文字 delta 各自 json.dumps 成一個 frame (每個 frame 一次寫入)
+    新做法: SSEStream 合併連續的 delta (時間窗 + 大小上限，前端讀得慢時自動加大批次)
+輸出 frame 數、寫入次數、每秒 frame 數、每個 frame 平均帶了幾個字，並確認前端收到的文字完全相同
+
+執行方式 (在 backend/ 底下，不會呼叫 OpenAI API):
+    python -m benchmarks.bench_sse_stream --streams 50 --deltas 400 --token-interval 0.002 --write-latency 0.0005
+"""
+import argparse, asyncio, json, random, time
+from app.services.sse_encoder import SSEStream, DONE_FRAME
+
+PIECES = ["你", "好", "今天", "練", "胸", "的", "重量", " ", "kg", "，", "建議", "多", "休息", "。", "\n"]
+
+
+def make_deltas(n: int, seed: int):
+    rng = random.Random(seed)
+    return ["".join(rng.choice(PIECES) for _ in range(rng.randint(1, 2))) for _ in range(n)]
+
+
+async def legacy_stream(deltas, token_interval: float):
+    """重構前 chat_stream 的做法"""
+    for delta in deltas:
+        await asyncio.sleep(token_interval)  # 模擬 LLM 產生 token 的間隔
+        yield f"data: {json.dumps({'type': 'llm_generate', 'content': delta}, ensure_ascii=False)}\n\n"
+    yield f"data: {json.dumps({'type': 'done'})}\n\n"
+
+
+async def coalesced_stream(deltas, token_interval: float, flush_interval: float):
+    stream = SSEStream(flush_interval=flush_interval)
+
+    async def produce():
+        try:
+            for delta in deltas:
+                await asyncio.sleep(token_interval)
+                await stream.send_text(delta)
+            await stream.send_frame(DONE_FRAME)
+        finally:
+            stream.close()
+
+    producer = asyncio.create_task(produce())
+    async for chunk in stream:
+        yield chunk
+    await producer
+
+
+async def client(stream, write_latency: float):
+    """模擬 StreamingResponse + socket: 每次寫入都要花一點時間，回傳 (收到的文字, frame 數, 寫入次數)"""
+    received, frames, writes = [], 0, 0
+    async for chunk in stream:
+        data = chunk if isinstance(chunk, bytes) else chunk.encode("utf-8")  # Starlette 會把 str 編成 bytes
+        writes += 1
+        if write_latency:
+            await asyncio.sleep(write_latency)
+        else:
+            await asyncio.sleep(0)  # 每次寫入至少讓出一次 event loop
+        for frame in data.decode("utf-8").split("\n\n"):
+            if frame.startswith("data: "):
+                frames += 1
+                received.append(json.loads(frame[6:]).get("content", ""))
+    return "".join(received), frames, writes
+
+
+async def run(kind: str, all_deltas, args):
+    if kind == "legacy":
+        streams = [legacy_stream(d, args.token_interval) for d in all_deltas]
+    else:
+        streams = [coalesced_stream(d, args.token_interval, args.flush_interval) for d in all_deltas]
+
+    wall, cpu = time.perf_counter(), time.process_time()
+    results = await asyncio.gather(*(client(s, args.write_latency) for s in streams))
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+    texts = [r[0] for r in results]
+    frames = sum(r[1] for r in results)
+    writes = sum(r[2] for r in results)
+    chars = sum(len(t) for t in texts)
+    return texts, {"frames": frames, "writes": writes, "chars": chars, "wall": wall, "cpu": cpu}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--deltas", type=int, default=400, help="每個串流的文字 delta 數")
+    parser.add_argument("--token-interval", type=float, default=0.002, help="LLM 每個 delta 的間隔 (秒)")
+    parser.add_argument("--write-latency", type=float, default=0.0005, help="每次寫入 socket 的耗時 (秒)，模擬前端讀取速度")
+    parser.add_argument("--flush-interval", type=float, default=0.03)
+    args = parser.parse_args()
+
+    all_deltas = [make_deltas(args.deltas, seed) for seed in range(args.streams)]
+    expected = ["".join(d) for d in all_deltas]
+
+    print(f"{args.streams} 個串流 x {args.deltas} 個 delta，寫入延遲 {args.write_latency * 1000:.1f} ms")
+    print(f"{'':<10} | {'frames':>8} | {'writes':>8} | {'frames/s':>9} | {'字/frame':>8} | {'CPU (s)':>8} | {'總耗時 (s)':>9} | 文字相同")
+    for kind in ("legacy", "coalesced"):
+        texts, m = asyncio.run(run(kind, all_deltas, args))
+        print(f"{kind:<10} | {m['frames']:>8} | {m['writes']:>8} | {m['frames'] / m['wall']:>9.0f} | "
+              f"{m['chars'] / m['frames']:>8.1f} | {m['cpu']:>8.3f} | {m['wall']:>9.3f} | {texts == expected}")
+
+
+if __name__ == "__main__":
+    main()
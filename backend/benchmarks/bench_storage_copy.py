@@ -0,0 +1,125 @@
+"""
+比較 record_food_intake_with_vision 把圖片從 chat_images 搬到 food_images 的三種做法:
+    1. 舊做法: storage3 download() 整張讀進記憶體再 upload()
+    2. 伺服器端複製: StorageClient.copy_object() (POST /object/copy)
+    3. 串流搬移: 伺服器端複製失敗時的備援路徑
+Storage 用記憶體內的本地替身模擬，以 --bandwidth 模擬後端與 Supabase 之間的傳輸速度
+
+執行方式 (在 backend/ 底下):
+    python -m benchmarks.bench_storage_copy --sizes 2 8 32 --bandwidth 50
+"""
+import argparse, hashlib, time, tracemalloc
+from urllib.parse import unquote
+import httpx
+from supabase import create_client
+from supabase.lib.client_options import SyncClientOptions
+from app.data.storage import StorageClient
+
+URL = "http://storage.local"
+KEY = "bench-key"
+
+
+CHUNK = 64 * 1024
+
+
+class FakeStorage:
+    """
+    記憶體內的 Storage 替身，傳輸檔案內容時依照頻寬 sleep
+    下載時分 chunk 送出、上傳時邊收邊算 hash，讓記憶體峰值只反映後端 (呼叫端) 的用量
+    """
+    def __init__(self, bandwidth_mb: float, allow_copy: bool = True):
+        self.objects: dict[tuple[str, str], bytes] = {}
+        self.uploads: dict[tuple[str, str], tuple[int, str]] = {}  # (bucket, key) -> (大小, sha256)
+        self.bytes_per_sec = bandwidth_mb * 1024 * 1024
+        self.allow_copy = allow_copy
+
+    def _transfer(self, size: int):
+        time.sleep(size / self.bytes_per_sec)
+
+    def _send(self, data: bytes):
+        view = memoryview(data)
+        for i in range(0, len(data), CHUNK):
+            self._transfer(min(CHUNK, len(data) - i))
+            yield bytes(view[i:i + CHUNK])
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path.removeprefix("/storage/v1/object/")
+        if request.method == "POST" and path == "copy":
+            if not self.allow_copy:
+                return httpx.Response(400, json={"error": "copy disabled"})
+            body = httpx.Response(200, content=request.read()).json()
+            data = self.objects[(body["bucketId"], body["sourceKey"])]
+            self.uploads[(body["destinationBucket"], body["destinationKey"])] = (len(data), hashlib.sha256(data).hexdigest())
+            return httpx.Response(200, json={"Key": body["destinationKey"]})
+
+        bucket, _, key = path.partition("/")
+        key = unquote(key)
+        if request.method == "GET":
+            return httpx.Response(200, content=self._send(self.objects[(bucket, key)]), headers={"content-type": "image/jpeg"})
+
+        size, digest = 0, hashlib.sha256()
+        for chunk in request.stream:
+            self._transfer(len(chunk))
+            size += len(chunk)
+            digest.update(chunk)
+        self.uploads[(bucket, key)] = (size, digest.hexdigest())
+        return httpx.Response(200, json={"Key": f"{bucket}/{key}"})
+
+
+class StreamingTransport(httpx.BaseTransport):
+    """跟 httpx.MockTransport 一樣呼叫 handler，但不會先把 request body 整個讀進記憶體"""
+    def __init__(self, handler):
+        self.handler = handler
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        return self.handler(request)
+
+
+def legacy_copy(http_client: httpx.Client, src: str, dst: str):
+    supabase = create_client(URL, KEY, options=SyncClientOptions(httpx_client=http_client))
+    file_content = supabase.storage.from_("chat_images").download(src)
+    supabase.storage.from_("food_images").upload(path=dst, file=file_content)
+
+
+def measure(fn) -> tuple[float, float]:
+    """回傳 (耗時秒數, 記憶體峰值 MB)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2, 8, 32], help="圖片大小 (MB)")
+    parser.add_argument("--bandwidth", type=float, default=50, help="模擬頻寬 (MB/s)")
+    args = parser.parse_args()
+
+    print(f"模擬頻寬 {args.bandwidth} MB/s")
+    print(f"{'大小':>6} | {'舊做法':>16} | {'伺服器端複製':>16} | {'串流搬移':>16}")
+    for size in args.sizes:
+        row = []
+        for mode in ("legacy", "copy", "stream"):
+            storage = FakeStorage(args.bandwidth, allow_copy=(mode != "stream"))
+            storage.objects[("chat_images", "photo.jpg")] = b"\xff" * (size * 1024 * 1024)
+            http_client = httpx.Client(transport=StreamingTransport(storage.handler))
+            if mode == "legacy":
+                elapsed, peak = measure(lambda: legacy_copy(http_client, "photo.jpg", "copy.jpg"))
+            else:
+                client = StorageClient(http_client, url=URL, key=KEY)
+                elapsed, peak = measure(lambda: client.copy_object("chat_images", "photo.jpg", "food_images", "copy.jpg"))
+            original = storage.objects[("chat_images", "photo.jpg")]
+            uploaded_size, uploaded_digest = storage.uploads[("food_images", "copy.jpg")]
+            if mode == "legacy":
+                assert uploaded_size >= len(original)  # storage3 的 upload 是 multipart 格式，只檢查大小
+            else:
+                assert uploaded_digest == hashlib.sha256(original).hexdigest()
+            row.append(f"{elapsed * 1000:7.0f}ms {peak:5.1f}MB")
+        print(f"{size:>4}MB | " + " | ".join(row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+模擬多個使用者同時問相似的健身問題，比較 web_search 的搜尋方式:
+    舊做法: 每次都直接呼叫 Tavily
+    新做法: WebSearchService (正規化關鍵字快取 + 相同關鍵字的 single-flight)
+輸出呼叫 Tavily 的次數、總耗時，以及快取命中時單次搜尋的耗時 (不會真的連網，用假的 client 模擬延遲)
+
+執行方式 (在 backend/ 底下):
+    python -m benchmarks.bench_web_search --requests 200 --threads 16 --latency 1.5
+"""
+import argparse, random, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from app.services.search_service import WebSearchService
+
+QUESTIONS = [
+    "肌酸 劑量", "Creatine 劑量？", "增肌 每天 蛋白質 攝取量", "增肌每天蛋白質攝取量", "how much protein to build muscle",
+    "How much protein to build muscle?", "深蹲 膝蓋 內夾", "臥推 肩膀 痛", "乳清 什麼時候 喝", "減脂期 有氧 頻率",
+]
+
+
+class FakeTavilyClient:
+    """模擬 Tavily: 每次搜尋固定花 latency 秒"""
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def search(self, query: str, **kwargs):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        return {
+            "answer": f"關於 {query} 的整理",
+            "results": [{"title": query, "url": "https://example.com", "content": "..."}],
+        }
+
+
+def run(kind: str, queries, args):
+    client = FakeTavilyClient(args.latency)
+    service = WebSearchService(client=client)
+
+    def legacy(query):
+        return client.search(query=query, search_depth="advanced", max_results=3, include_answer=True)
+
+    search = legacy if kind == "legacy" else service.search
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(search, queries))
+    wall = time.perf_counter() - start
+
+    # 重複搜尋 (快取命中) 的單次耗時
+    repeat = None
+    if kind != "legacy":
+        n = 10000
+        start = time.perf_counter()
+        for i in range(n):
+            service.search(queries[i % len(queries)])
+        repeat = (time.perf_counter() - start) / n
+    return client.calls, wall, repeat, service.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=1.5, help="假 Tavily 每次搜尋的耗時 (秒)")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    queries = [rng.choice(QUESTIONS) for _ in range(args.requests)]
+    print(f"{args.requests} 次搜尋 ({len(set(queries))} 種寫法)，{args.threads} 個執行緒，Tavily 延遲 {args.latency}s")
+    print(f"{'':<8} | {'Tavily 呼叫':>10} | {'總耗時 (s)':>9} | {'重複搜尋 (µs)':>12}")
+    for kind in ("legacy", "cached"):
+        calls, wall, repeat, stats = run(kind, queries, args)
+        repeat_text = f"{repeat * 1e6:.1f}" if repeat is not None else "-"
+        print(f"{kind:<8} | {calls:>10} | {wall:>9.2f} | {repeat_text:>12}")
+    print(f"cached 統計: {stats}")
+
+
+if __name__ == "__main__":
+    main()
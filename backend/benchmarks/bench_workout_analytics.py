@@ -0,0 +1,147 @@
+"""
+比較 fetch_workout_analytics 的計算核心:
+    舊做法: 逐筆走訪記錄，建立每個動作的 list，每筆呼叫 format_utc_to_tw_time
+    新做法: compute_workout_analytics (NumPy 逐欄計算)
+    Dashboard: compute_workout_analytics(include_raw=False)，只算統計結果
+同時檢查兩者輸出的 JSON 是否完全相同 (不連資料庫，用隨機產生的記錄)
+
+執行方式 (在 backend/ 底下):
+    python -m benchmarks.bench_workout_analytics --rows 1000 100000 1000000
+"""
+import argparse, json, random, time
+from collections import Counter
+from datetime import datetime, timezone, timedelta
+from app.services.workout_analytics import compute_workout_analytics, format_utc_to_tw_time
+
+BODY_PARTS = ["胸部", "背部", "腿部", "肩膀", "手臂", "核心"]
+EXERCISES = [f"{part}動作{i}" for part in BODY_PARTS for i in range(4)]
+
+
+def legacy_analytics(db_records, days):
+    """重構前 fetch_workout_analytics 的計算邏輯 (原封不動)"""
+    unique_days = set()
+    part_counter = Counter()
+    exercise_data = {}
+    workout_raw_list = []
+
+    for row in db_records:
+        dt = row["created_at"]
+        unique_days.add(dt.split('T')[0])
+        part = row["body_part"]
+        part_counter[part] += 1
+        name = row["exercise_name"]
+        w ,s, r = row["weight"], row["sets"], row["reps"]
+        volume = w * s * r
+
+        workout_raw_list.append({
+            "日期": format_utc_to_tw_time(dt),
+            "動作": name, "部位": part, "數據": f"{w}kg x {s}組 x {r}下"
+        })
+
+        if name not in exercise_data:
+            exercise_data[name] = {"weights": [], "sets": [], "reps": [], "volume": []}
+        exercise_data[name]["weights"].append(w)
+        exercise_data[name]["sets"].append(s)
+        exercise_data[name]["reps"].append(r)
+        exercise_data[name]["volume"].append(volume)
+
+    progress_highlights = []
+    for name, metrics in exercise_data.items():
+        if len(metrics["weights"]) < 2:
+            continue
+        mid = len(metrics["weights"]) // 2
+
+        def get_imp(key):
+            past = sum(metrics[key][:mid]) / mid
+            recent = sum(metrics[key][mid:]) / (len(metrics[key]) - mid)
+            return recent - past
+
+        imp_w = get_imp("weights")
+        imp_s = get_imp("sets")
+        imp_r = get_imp("reps")
+        imp_v = get_imp("volume")
+        if imp_w > 0:
+            progress_highlights.append({"動作": name, "類型": "重量提升", "進步": f"+{imp_w:.1f}kg"})
+        if imp_s > 0:
+            progress_highlights.append({"動作": name, "類型": "組數提升", "進步": f"+{imp_s:.1f}組"})
+        if imp_r > 0.5:
+            progress_highlights.append({"動作": name, "類型": "次數提升", "進步": f"+{imp_r:.1f}下"})
+        if imp_v > 50:
+            progress_highlights.append({"動作": name, "類型": "總量突破", "進步": f"+{imp_v:.1f}kg"})
+
+    return {
+        "workout_raw_data": workout_raw_list,
+        "summary_stats": {
+            "total_days": len(unique_days),
+            "weekly_frequency": f"{len(unique_days) / (days/7):.1f}次",
+            "part_distribution": {k: f"{(v/len(db_records))*100:.1f}%" for k, v in part_counter.items()},
+            "progress_highlights": progress_highlights
+        }
+    }
+
+
+def render(analytics):
+    """與 fetch_workout_analytics 相同的轉換方式"""
+    return {"workout_raw_data": analytics.workout_raw_data, "summary_stats": analytics.summary_stats.model_dump(by_alias=True)}
+
+
+def make_rows(n: int, seed: int = 0):
+    """產生與 Supabase 回傳格式相同的記錄 (由新到舊)，重量混合整數與小數"""
+    rng = random.Random(seed)
+    now = datetime(2026, 10, 17, 12, tzinfo=timezone.utc)
+    step = timedelta(days=365) / max(n, 1)
+    rows = []
+    for i in range(n):
+        created = now - step * i - timedelta(microseconds=rng.randrange(1_000_000))
+        # Postgres 會省略小數秒結尾的 0，例如 .55647
+        stamp = created.isoformat(timespec="microseconds").replace("+00:00", "").rstrip("0").rstrip(".") + "+00:00"
+        name = rng.choice(EXERCISES)
+        weight = rng.choice([rng.randrange(10, 120), rng.randrange(20, 240) / 2, round(rng.uniform(5, 100), 1)])
+        rows.append({
+            "id": i, "created_at": stamp, "exercise_name": name, "body_part": name[:2],
+            "weight": weight, "sets": rng.randrange(1, 6), "reps": rng.randrange(1, 16),
+        })
+    return rows
+
+
+def edge_case_rows():
+    """
+    前後半段平均理論上一樣、但逐筆累加會多出一點浮點誤差的記錄
+    (10.1+10.2+10.3 與 10.3+10.2+10.1 逐筆相加差 1.8e-15，Python 3.12 之後的 sum() 會補償回來)
+    """
+    weights = [10.1, 10.2, 10.3, 10.3, 10.2, 10.1, 0.1, 0.2, 0.3, 0.3, 0.2, 0.1]
+    return [
+        {"id": i, "created_at": f"2026-10-{i + 1:02d}T01:00:00+00:00", "exercise_name": "胸部動作0" if i < 6 else "胸部動作1",
+         "body_part": "胸部", "weight": weight, "sets": 3, "reps": 10}
+        for i, weight in enumerate(weights)
+    ]
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 100_000, 1_000_000])
+    parser.add_argument("--days", type=int, default=365)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} | {'逐筆 (s)':>10} | {'NumPy (s)':>10} | {'加速':>6} | {'Dashboard (s)':>13} | 輸出相同")
+    for n in args.rows:
+        rows = make_rows(n)
+        legacy, legacy_s = timed(legacy_analytics, rows, args.days)
+        columnar, columnar_s = timed(compute_workout_analytics, rows, args.days)
+        _, dashboard_s = timed(compute_workout_analytics, rows, args.days, False)
+        same = json.dumps(legacy, ensure_ascii=False) == json.dumps(render(columnar), ensure_ascii=False)
+        print(f"{n:>10} | {legacy_s:>10.3f} | {columnar_s:>10.3f} | {legacy_s / columnar_s:>5.1f}x | {dashboard_s:>13.3f} | {same}")
+
+    rows = edge_case_rows()
+    same = json.dumps(legacy_analytics(rows, args.days), ensure_ascii=False) == json.dumps(render(compute_workout_analytics(rows, args.days)), ensure_ascii=False)
+    print(f"浮點誤差邊界案例 輸出相同: {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import os, json, hashlib, inspect, contextvars, dataclasses
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import httpx
+
+"""
+agent_evaluator 的錄製 / 重播 (cassette)
+record: 照常連線執行評測，同時把以下內容存成本機的 JSON 檔
+    - 每筆案例的模型回應 (OpenAI 的串流回應原文，依呼叫順序)
+    - 每筆案例的工具呼叫 (工具名稱、參數、回傳結果)
+    - 共用的歷史對話 (資料庫讀取)、dataset 內容、Judge 的評分、Agent 使用的日期
+replay: 完全不連網，模型回應從 cassette 餵回 Runner.run_streamed，工具直接回傳錄下來的結果 (不會真的執行)，
+        改了 evaluator 或 SLO 的邏輯可以幾秒內離線重跑，而且每次結果都一樣
+檔案結構 (cassette 目錄):
+    meta.json       日期、dataset 名稱
+    dataset.json    dataset 的案例 (inputs / outputs)
+    history.json    共用的歷史對話
+    judge.json      Judge 評分 (以 prompt 的 hash 當 key)
+    runs/<key>.json 每筆案例的模型回應與工具呼叫 (以 inputs 的 hash 當 key)
+注意：cassette 內有真實的對話內容，不要 commit 進版控
+"""
+
+CASSETTE_MODES = ("off", "record", "replay")
+EVAL_CASSETTE_MODE = os.getenv("EVAL_CASSETTE_MODE", "off")
+EVAL_CASSETTE_DIR = os.getenv("EVAL_CASSETTE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "eval_cassettes"))
+
+
+class CassetteMiss(Exception):
+    """重播時找不到對應的錄製內容 (案例、工具參數或 prompt 與錄製時不同，需要重新錄製)"""
+
+
+def _hash(value: Any) -> str:
+    text = value if isinstance(value, str) else json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _normalize_args(args: str) -> str:
+    """工具參數是 LLM 產生的 JSON 字串，排序 key 後再比對，空白或順序不同都算同一組參數"""
+    try:
+        return json.dumps(json.loads(args or "{}"), sort_keys=True, ensure_ascii=False)
+    except ValueError:
+        return args
+
+
+@dataclasses.dataclass
+class Tape:
+    """一筆案例的錄製內容"""
+    key: str
+    inputs: dict
+    model_calls: List[dict] = dataclasses.field(default_factory=list)
+    tool_calls: List[dict] = dataclasses.field(default_factory=list)
+    _model_index: int = 0
+    _tool_queues: Dict[tuple, deque] = dataclasses.field(default_factory=lambda: defaultdict(deque))
+
+    def next_model_call(self) -> dict:
+        if self._model_index >= len(self.model_calls):
+            raise CassetteMiss(f"案例 {self.key} 的模型回應已經用完 (錄製時只有 {len(self.model_calls)} 次呼叫)")
+        call = self.model_calls[self._model_index]
+        self._model_index += 1
+        return call
+
+    def next_tool_output(self, name: str, args: str) -> str:
+        # 同一組參數可能呼叫多次，依錄製順序回傳
+        queue = self._tool_queues.get((name, _normalize_args(args)))
+        if not queue:
+            raise CassetteMiss(f"案例 {self.key} 沒有錄到工具呼叫 {name}({args})")
+        return queue.popleft()
+
+    def to_dict(self) -> dict:
+        return {"key": self.key, "inputs": self.inputs, "model_calls": self.model_calls, "tool_calls": self.tool_calls}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Tape":
+        tape = cls(data["key"], data["inputs"], data.get("model_calls", []), data.get("tool_calls", []))
+        for call in tape.tool_calls:
+            tape._tool_queues[(call["name"], _normalize_args(call["args"]))].append(call["output"])
+        return tape
+
+
+# 目前正在執行的案例 (Runner.run_streamed 會開背景 task，建立時會複製 context，所以要在呼叫前設定)
+_current_tape: contextvars.ContextVar[Optional[Tape]] = contextvars.ContextVar("eval_cassette_tape", default=None)
+
+
+class CassetteTransport(httpx.AsyncBaseTransport):
+    """
+    給 AsyncOpenAI 用的 httpx transport
+    record: 照常送出請求，讀完整個回應 (串流的 SSE 也一樣) 存進目前案例的 Tape，再把同樣的內容交給 SDK
+    replay: 不連網，依呼叫順序回傳錄下來的回應
+    """
+    def __init__(self, cassette: "Cassette"):
+        self.cassette = cassette
+        self._live = httpx.AsyncHTTPTransport() if cassette.mode == "record" else None
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        tape = _current_tape.get()
+        if self.cassette.mode == "replay":
+            if tape is None:
+                raise CassetteMiss(f"重播模式下不能在案例之外呼叫模型: {request.url}")
+            call = tape.next_model_call()
+            return httpx.Response(call["status"], headers={"content-type": call["content_type"]},
+                                  content=call["body"].encode("utf-8"), request=request)
+
+        response = await self._live.handle_async_request(request)
+        body = await response.aread()  # 已經解開 gzip
+        await response.aclose()
+        # 失敗的回應 (429 / 5xx) SDK 會自己重試，只錄成功的那次，重播時才不會多出重試
+        if tape is not None and response.status_code < 400:
+            tape.model_calls.append({
+                "url": str(request.url),
+                "status": response.status_code,
+                "content_type": response.headers.get("content-type", "application/json"),
+                "body": body.decode("utf-8"),
+            })
+        headers = [(k, v) for k, v in response.headers.multi_items()
+                   if k.lower() not in ("content-encoding", "content-length", "transfer-encoding")]
+        return httpx.Response(response.status_code, headers=headers, content=body, request=request)
+
+    async def aclose(self):
+        if self._live is not None:
+            await self._live.aclose()
+
+
+class Cassette:
+    def __init__(self, directory: str = EVAL_CASSETTE_DIR, mode: str = EVAL_CASSETTE_MODE):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"不支援的 cassette 模式: {mode}，可用 {', '.join(CASSETTE_MODES)}")
+        self.directory = directory
+        self.mode = mode
+        self.meta: dict = {}
+        self.judge_grades: Dict[str, dict] = {}
+        if mode == "replay":
+            if not os.path.isdir(directory):
+                raise FileNotFoundError(f"找不到 cassette 目錄 {directory}，請先用 record 模式錄製")
+            self.meta = self._read("meta.json", {})
+            self.judge_grades = self._read("judge.json", {})
+        elif mode == "record":
+            os.makedirs(os.path.join(directory, "runs"), exist_ok=True)
+
+    @property
+    def active(self) -> bool:
+        return self.mode != "off"
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _read(self, name: str, default: Any = None) -> Any:
+        path = self._path(name)
+        if not os.path.exists(path):
+            if default is not None:
+                return default
+            raise CassetteMiss(f"cassette 缺少 {name}，請重新錄製")
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write(self, name: str, data: Any):
+        with open(self._path(name), "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2, default=str)
+
+    # --- 評測的固定資料 ---
+    def save_meta(self, **meta):
+        self.meta.update(meta)
+        self._write("meta.json", self.meta)
+
+    def save_dataset(self, examples: list):
+        self._write("dataset.json", [
+            {"id": str(example.id), "inputs": example.inputs, "outputs": example.outputs} for example in examples
+        ])
+
+    def load_dataset(self) -> List[dict]:
+        return self._read("dataset.json")
+
+    def save_history(self, history: list):
+        self._write("history.json", history)
+
+    def load_history(self) -> list:
+        return self._read("history.json")
+
+    # --- 每筆案例 ---
+    @contextmanager
+    def use_tape(self, inputs: dict):
+        """在這個區塊內的模型與工具呼叫都會錄到 (或取自) 這筆案例的 Tape"""
+        key = _hash(inputs)
+        if self.mode == "replay":
+            tape = Tape.from_dict(self._read(os.path.join("runs", f"{key}.json")))
+        else:
+            tape = Tape(key, inputs)
+        token = _current_tape.set(tape)
+        try:
+            yield tape
+        finally:
+            _current_tape.reset(token)
+            if self.mode == "record":
+                self._write(os.path.join("runs", f"{key}.json"), tape.to_dict())
+
+    def http_client(self) -> httpx.AsyncClient:
+        """AsyncOpenAI(http_client=...) 用的 client，模型呼叫都會經過 cassette"""
+        return httpx.AsyncClient(transport=CassetteTransport(self), timeout=httpx.Timeout(600.0, connect=5.0))
+
+    def wrap_tools(self, tools: list) -> list:
+        """
+        包裝 Agent 的 FunctionTool (名稱、schema 不變，只換掉 on_invoke_tool)
+        record: 照常執行並記錄參數與結果；replay: 不執行，直接回傳錄下來的結果
+        """
+        return [dataclasses.replace(tool, on_invoke_tool=self._invoke(tool)) for tool in tools]
+
+    def _invoke(self, tool) -> Callable[[Any, str], Awaitable[Any]]:
+        original = tool.on_invoke_tool
+
+        async def on_invoke_tool(ctx, args: str):
+            tape = _current_tape.get()
+            if self.mode == "replay":
+                if tape is None:
+                    raise CassetteMiss(f"重播模式下不能在案例之外呼叫工具 {tool.name}")
+                return tape.next_tool_output(tool.name, args)
+            output = original(ctx, args)
+            if inspect.isawaitable(output):
+                output = await output
+            if tape is not None:
+                tape.tool_calls.append({"name": tool.name, "args": args, "output": str(output)})
+            return output
+        return on_invoke_tool
+
+    # --- Judge ---
+    async def judge(self, prompt: str, call: Callable[[], Awaitable[dict]]) -> dict:
+        """record: 呼叫 Judge 並記錄評分；replay: 用同樣的 prompt 取回評分"""
+        key = _hash(prompt)
+        if self.mode == "replay":
+            grade = self.judge_grades.get(key)
+            if grade is None:
+                raise CassetteMiss("沒有錄到這個回覆的 Judge 評分")
+            return grade
+        grade = await call()
+        if self.mode == "record":
+            self.judge_grades[key] = dict(grade)
+        return grade
+
+    def save(self):
+        """評測結束時寫入 Judge 評分 (案例的 Tape 在每筆結束時就寫好了)"""
+        if self.mode == "record":
+            self._write("judge.json", self.judge_grades)
@@ -57,7 +57,7 @@ def generate_more_examples(eval_examples: List[Dict[str, Any]], n: int = 10) ->
         - 產生新的動作記錄（如：引體向上、硬舉、波比跳、肩推）。
         - 產生多輪對話案例，conversation_history 需與 user_query 有連貫脈絡。
         - 產生更口語、甚至帶有情緒的對話內容。
-    6. **工具清單**（expected_tools 只能填以下工具名稱）：record_workout_exercise、analyze_workout_progress、record_food_intake_with_vision、web_search、schedule_appointment。
+    6. **工具清單**（expected_tools 只能填以下工具名稱）：record_workout_exercise、record_workout_exercises、analyze_workout_progress、record_food_intake_with_vision、web_search、schedule_appointment。
     7. **格式要求**：只回傳純 JSON 陣列格式，不要包含 Markdown 的 ```json 標籤，也不要任何解釋文字。
 
     請開始生成："""
@@ -1,11 +1,24 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware # 導入 Session 中間件
 from app.router import api
 from app.router import google_auth
+from app.data.database import get_supabase, close_supabase
+from app.services.message_writer import chat_message_writer
+from app.services.ai_service import close_image_http
 import os
 
-app = FastAPI(title="GentlGains API endpoints")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 啟動時建立共用的 Supabase 連線池，關閉時先把還在佇列的對話訊息寫完，再釋放所有連線
+    get_supabase()
+    yield
+    await chat_message_writer.close()
+    await close_image_http()
+    close_supabase()
+
+app = FastAPI(title="GentlGains API endpoints", lifespan=lifespan)
 
 app.add_middleware(
     SessionMiddleware, 
@@ -19,6 +32,7 @@ app.add_middleware(
     allow_credentials=False,  
     allow_methods=["*"],  # 允許所有方法 (GET, POST, PUT, DELETE)
     allow_headers=["*"],  # 允許所有標頭
+    expose_headers=["X-Next-Cursor"],  # 讓前端讀得到歷史對話的下一頁 cursor
 )
 
 
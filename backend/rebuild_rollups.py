@@ -0,0 +1,34 @@
+import argparse
+from datetime import datetime
+from app.data.repositories import RollupRepository
+
+"""
+重建每日彙總表 (飲食營養總和、每日各部位/動作的訓練量)
+平常資料庫的 trigger 會在每次寫入時自動更新彙總表，只有以下情況需要手動執行:
+    - 第一次部署彙總表，要回填既有的歷史記錄
+    - 直接在資料庫修改過原始記錄，想校正彙總結果
+重建期間會擋住飲食與訓練記錄的寫入 (等重建完成才會寫入)，資料量大時請在離峰時間執行
+
+執行方式 (在 backend/ 底下):
+    python rebuild_rollups.py                      # 全部重建
+    python rebuild_rollups.py --from 2026-10-01    # 只重建 10/1 (含) 之後
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="重建每日彙總表")
+    parser.add_argument("--from", dest="from_day", default=None, help="只重建這天 (含) 之後的資料，格式 YYYY-MM-DD")
+    args = parser.parse_args()
+
+    if args.from_day:
+        datetime.strptime(args.from_day, "%Y-%m-%d")  # 格式錯誤時直接報錯
+
+    result = RollupRepository().rebuild(args.from_day)
+    if result is None:
+        print("❌ 重建失敗，請確認已執行 supabase/migrations 內的 daily_rollups migration")
+        return
+    print(f"✅ 重建完成: 飲食彙總 {result['nutrition_days']} 天，訓練彙總 {result['training_rows']} 筆")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+-- 每個 session 較早對話的滾動摘要 (AgentService 在訊息移出 token 預算後於背景更新)
+create table if not exists public.chat_summaries (
+    session_id   text primary key,
+    summary      text not null default '',
+    folded_until timestamptz,            -- 摘要涵蓋到的最後一則 chat_messages.created_at
+    updated_at   timestamptz not null default now()
+);
@@ -0,0 +1,52 @@
+-- 儀表板用的彙總函式，由 WorkOutRepository / FoodRepository 透過 RPC 呼叫
+-- 在資料庫內 GROUP BY，只回傳彙總後的幾十筆資料，不再把整個月的記錄傳到後端計算
+-- 日期一律以台北時間 (Asia/Taipei) 切分
+
+-- 預設起點：台北時間本月 1 號 00:00
+create or replace function public.dashboard_month_start()
+returns timestamptz
+language sql stable
+as $$
+    select date_trunc('month', now() at time zone 'Asia/Taipei') at time zone 'Asia/Taipei';
+$$;
+
+-- 每天的訓練次數 (熱力圖)
+create or replace function public.dashboard_workout_heatmap(start_at timestamptz default public.dashboard_month_start())
+returns table (date text, count bigint)
+language sql stable
+as $$
+    select to_char((w.created_at at time zone 'Asia/Taipei')::date, 'YYYY-MM-DD') as date,
+           count(*) as count
+    from public.workout_logs w
+    where w.created_at >= start_at
+    group by 1
+    order by 1;
+$$;
+
+-- 各部位的訓練次數 (部位分佈)
+create or replace function public.dashboard_body_part_stats(start_at timestamptz default public.dashboard_month_start())
+returns table (body_part text, count bigint)
+language sql stable
+as $$
+    select w.body_part, count(*) as count
+    from public.workout_logs w
+    where w.created_at >= start_at
+    group by w.body_part;
+$$;
+
+-- 營養素總和 (今日攝取)，沒有記錄時回傳 0
+create or replace function public.dashboard_nutrition_totals(start_at timestamptz)
+returns table (calories bigint, protein bigint, fat bigint, carbs bigint)
+language sql stable
+as $$
+    select coalesce(sum(f.calories), 0)::bigint as calories,
+           coalesce(sum(f.protein), 0)::bigint  as protein,
+           coalesce(sum(f.fat), 0)::bigint      as fat,
+           coalesce(sum(f.carbs), 0)::bigint    as carbs
+    from public.food_logs f
+    where f.created_at >= start_at;
+$$;
+
+-- 讓 Supabase 的 index 支援上面的範圍查詢
+create index if not exists workout_logs_created_at_idx on public.workout_logs (created_at);
+create index if not exists food_logs_created_at_idx on public.food_logs (created_at);
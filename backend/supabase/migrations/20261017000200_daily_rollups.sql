@@ -0,0 +1,174 @@
+-- 每日彙總表 (以台北時間的日期切分)
+-- food_logs / workout_logs 每次寫入 (save_food_logs、save_workout_logs 或批次寫入) 都會由 trigger 即時更新，
+-- 儀表板的讀取只需要掃「天數」筆資料，而不是所有原始記錄
+
+create table if not exists public.daily_nutrition_rollup (
+    day        date primary key,
+    calories   bigint not null default 0,
+    protein    bigint not null default 0,
+    fat        bigint not null default 0,
+    carbs      bigint not null default 0,
+    meal_count integer not null default 0
+);
+
+create table if not exists public.daily_training_rollup (
+    day           date not null,
+    body_part     text not null,
+    exercise_name text not null,
+    log_count     integer not null default 0,   -- 當天這個動作記錄了幾筆 (熱力圖、部位分佈用)
+    total_sets    bigint not null default 0,
+    total_reps    bigint not null default 0,
+    total_volume  numeric not null default 0,   -- sum(weight * sets * reps)
+    max_weight    numeric not null default 0,
+    primary key (day, body_part, exercise_name)
+);
+
+-- 原始記錄的 created_at 轉成台北時間的日期
+create or replace function public.taipei_day(ts timestamptz)
+returns date
+language sql immutable
+as $$
+    select (ts at time zone 'Asia/Taipei')::date;
+$$;
+
+-- 把一筆 food_logs 的變動套用到彙總表 (sign = 1 新增，-1 刪除)
+create or replace function public.apply_food_rollup(r public.food_logs, sign integer)
+returns void
+language sql
+as $$
+    insert into public.daily_nutrition_rollup as d (day, calories, protein, fat, carbs, meal_count)
+    values (public.taipei_day(r.created_at), sign * r.calories, sign * r.protein, sign * r.fat, sign * r.carbs, sign)
+    on conflict (day) do update set
+        calories   = d.calories + excluded.calories,
+        protein    = d.protein + excluded.protein,
+        fat        = d.fat + excluded.fat,
+        carbs      = d.carbs + excluded.carbs,
+        meal_count = d.meal_count + excluded.meal_count;
+$$;
+
+create or replace function public.apply_workout_rollup(r public.workout_logs, sign integer)
+returns void
+language sql
+as $$
+    insert into public.daily_training_rollup as d (day, body_part, exercise_name, log_count, total_sets, total_reps, total_volume, max_weight)
+    values (public.taipei_day(r.created_at), r.body_part, r.exercise_name, sign, sign * r.sets, sign * r.reps,
+            sign * r.weight * r.sets * r.reps, case when sign > 0 then r.weight else 0 end)
+    on conflict (day, body_part, exercise_name) do update set
+        log_count    = d.log_count + excluded.log_count,
+        total_sets   = d.total_sets + excluded.total_sets,
+        total_reps   = d.total_reps + excluded.total_reps,
+        total_volume = d.total_volume + excluded.total_volume,
+        max_weight   = greatest(d.max_weight, excluded.max_weight);  -- 刪除時不回推最大重量，需要精確值時執行 rebuild
+$$;
+
+create or replace function public.food_logs_rollup_trigger()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') then
+        perform public.apply_food_rollup(old, -1);
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') then
+        perform public.apply_food_rollup(new, 1);
+    end if;
+    return null;
+end;
+$$;
+
+create or replace function public.workout_logs_rollup_trigger()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') then
+        perform public.apply_workout_rollup(old, -1);
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') then
+        perform public.apply_workout_rollup(new, 1);
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists food_logs_rollup on public.food_logs;
+create trigger food_logs_rollup
+    after insert or update or delete on public.food_logs
+    for each row execute function public.food_logs_rollup_trigger();
+
+drop trigger if exists workout_logs_rollup on public.workout_logs;
+create trigger workout_logs_rollup
+    after insert or update or delete on public.workout_logs
+    for each row execute function public.workout_logs_rollup_trigger();
+
+-- 重建彙總表 (第一次部署時回填歷史資料，或資料有手動修改時使用)
+-- from_day 有給的話只重建該日期 (含) 之後的資料
+-- 注意：重建期間會鎖住 food_logs / workout_logs，所有新增、修改、刪除都要等重建的交易結束 (讀取不受影響)
+--       否則重建途中 trigger 對同一天的 upsert 會撞到 unique 或被 delete / insert 重複計算、漏算
+create or replace function public.rebuild_daily_rollups(from_day date default null)
+returns table (nutrition_days bigint, training_rows bigint)
+language plpgsql
+as $$
+begin
+    -- share row exclusive 與寫入用的 row exclusive 互斥 (也與另一個重建互斥)，但不擋 select
+    lock table public.workout_logs, public.food_logs in share row exclusive mode;
+
+    delete from public.daily_nutrition_rollup where from_day is null or day >= from_day;
+    delete from public.daily_training_rollup where from_day is null or day >= from_day;
+
+    insert into public.daily_nutrition_rollup (day, calories, protein, fat, carbs, meal_count)
+    select public.taipei_day(f.created_at), sum(f.calories), sum(f.protein), sum(f.fat), sum(f.carbs), count(*)
+    from public.food_logs f
+    where from_day is null or public.taipei_day(f.created_at) >= from_day
+    group by 1;
+
+    insert into public.daily_training_rollup (day, body_part, exercise_name, log_count, total_sets, total_reps, total_volume, max_weight)
+    select public.taipei_day(w.created_at), w.body_part, w.exercise_name, count(*), sum(w.sets), sum(w.reps),
+           sum(w.weight * w.sets * w.reps), max(w.weight)
+    from public.workout_logs w
+    where from_day is null or public.taipei_day(w.created_at) >= from_day
+    group by 1, 2, 3;
+
+    return query
+        select (select count(*) from public.daily_nutrition_rollup),
+               (select count(*) from public.daily_training_rollup);
+end;
+$$;
+
+-- 儀表板的彙總函式改為讀取彙總表 (參數與回傳格式不變，後端不需要修改)
+create or replace function public.dashboard_workout_heatmap(start_at timestamptz default public.dashboard_month_start())
+returns table (date text, count bigint)
+language sql stable
+as $$
+    select to_char(r.day, 'YYYY-MM-DD') as date, sum(r.log_count)::bigint as count
+    from public.daily_training_rollup r
+    where r.day >= public.taipei_day(start_at)
+    group by r.day
+    having sum(r.log_count) > 0
+    order by r.day;
+$$;
+
+create or replace function public.dashboard_body_part_stats(start_at timestamptz default public.dashboard_month_start())
+returns table (body_part text, count bigint)
+language sql stable
+as $$
+    select r.body_part, sum(r.log_count)::bigint as count
+    from public.daily_training_rollup r
+    where r.day >= public.taipei_day(start_at)
+    group by r.body_part;
+$$;
+
+create or replace function public.dashboard_nutrition_totals(start_at timestamptz)
+returns table (calories bigint, protein bigint, fat bigint, carbs bigint)
+language sql stable
+as $$
+    select coalesce(sum(r.calories), 0)::bigint as calories,
+           coalesce(sum(r.protein), 0)::bigint  as protein,
+           coalesce(sum(r.fat), 0)::bigint      as fat,
+           coalesce(sum(r.carbs), 0)::bigint    as carbs
+    from public.daily_nutrition_rollup r
+    where r.day >= public.taipei_day(start_at);
+$$;
+
+-- 執行一次回填，讓既有資料也出現在彙總表
+select * from public.rebuild_daily_rollups();
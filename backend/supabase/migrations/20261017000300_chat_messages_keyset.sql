@@ -0,0 +1,4 @@
+-- 對話記錄的 keyset 分頁 (GET /chat/history) 依 (session_id, created_at, id) 排序與比較，
+-- 這個 index 讓每一頁都只需要掃描該頁的資料，不會因為翻到越舊的訊息而越慢
+create index if not exists chat_messages_session_keyset_idx
+    on public.chat_messages (session_id, created_at, id);
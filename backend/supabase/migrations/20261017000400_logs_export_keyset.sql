@@ -0,0 +1,7 @@
+-- 大量匯出 (GET /export/{kind}) 依 (created_at, id) 由舊到新 keyset 分頁，
+-- 這兩個 index 讓每一頁都只需要掃描該頁的資料，匯出到後面也不會越來越慢
+create index if not exists workout_logs_keyset_idx
+    on public.workout_logs (created_at, id);
+
+create index if not exists food_logs_keyset_idx
+    on public.food_logs (created_at, id);
@@ -0,0 +1,266 @@
+"""
+儀表板 RPC (supabase/migrations 的 dashboard_* 函式) 對本機 Postgres 的測試
+- 建立一個臨時資料庫，建好 Supabase 上的原始資料表後依序套用 migrations
+- 在台北時間「本月 1 號」與「今天」的午夜前後塞入記錄 (UTC 與台北的日期不同)
+- 透過 Repository 原本的呼叫方式 (supabase.rpc) 取得結果，與原本在 Python 逐筆彙總的結果比對
+- 20261017000100 (直接掃原始記錄) 與 20261017000200 (改讀每日彙總表，含回填與 trigger) 兩個版本都會檢查
+
+需要 psycopg 以及一個 Postgres:
+- TEST_DATABASE_URL=postgresql://postgres@localhost:5432/postgres (可以 CREATE DATABASE 的帳號)
+- 或是 PATH (或 POSTGRES_BIN) 裡有 initdb / pg_ctl，會自動建立一個臨時的 cluster (不能用 root 執行)
+都沒有的話略過
+
+執行方式 (在 backend/ 底下):
+    TEST_DATABASE_URL=... python -m pytest -q tests/test_dashboard_rpcs.py
+"""
+import os, glob, random, shutil, socket, subprocess, tempfile, uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+import pytest
+
+psycopg = pytest.importorskip("psycopg")
+from psycopg.rows import dict_row
+
+from app.data.repositories import WorkOutRepository, FoodRepository, BODY_PARTS, TW_TZ, start_of_month_utc
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "supabase", "migrations")
+DASHBOARD_MIGRATION = "20261017000100_dashboard_aggregates.sql"
+
+# Supabase 上原本就有的資料表 (不在 migrations 內)，只建立測試與 migrations 用到的欄位
+BASE_SCHEMA = """
+create table public.workout_logs (
+    id            bigserial primary key,
+    created_at    timestamptz not null default now(),
+    exercise_name text not null,
+    body_part     text not null,
+    weight        numeric not null,
+    sets          integer not null,
+    reps          integer not null
+);
+create table public.food_logs (
+    id            bigserial primary key,
+    created_at    timestamptz not null default now(),
+    food_name     text,
+    meal_type     text,
+    image_url     text,
+    calories      integer not null,
+    protein       integer not null,
+    fat           integer not null,
+    carbs         integer not null,
+    score         integer,
+    coach_comment text
+);
+create table public.chat_messages (
+    id         bigserial primary key,
+    session_id text not null,
+    role       text not null,
+    content    text,
+    image_url  text,
+    created_at timestamptz not null default now()
+);
+"""
+
+
+# --- 臨時的 Postgres ---
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="module")
+def server_url():
+    url = os.getenv("TEST_DATABASE_URL")
+    if url:
+        yield url
+        return
+
+    bin_dir = os.getenv("POSTGRES_BIN") or os.path.dirname(shutil.which("initdb") or "")
+    if not bin_dir or not os.path.exists(os.path.join(bin_dir, "pg_ctl")):
+        pytest.skip("沒有 TEST_DATABASE_URL，也找不到 initdb / pg_ctl")
+    if hasattr(os, "geteuid") and os.geteuid() == 0:
+        pytest.skip("Postgres 不能用 root 啟動，請改用 TEST_DATABASE_URL")
+
+    data_dir = tempfile.mkdtemp(prefix="gentle-gains-pg-")
+    port = _free_port()
+    pg_ctl = os.path.join(bin_dir, "pg_ctl")
+    subprocess.run([os.path.join(bin_dir, "initdb"), "-D", data_dir, "-U", "postgres", "-A", "trust"],
+                   check=True, capture_output=True)
+    subprocess.run([pg_ctl, "-D", data_dir, "-w", "-l", os.path.join(data_dir, "log"),
+                    "-o", f"-p {port} -k {data_dir} -c listen_addresses=localhost", "start"],
+                   check=True, capture_output=True)
+    try:
+        yield f"postgresql://postgres@localhost:{port}/postgres"
+    finally:
+        subprocess.run([pg_ctl, "-D", data_dir, "-m", "immediate", "stop"], capture_output=True)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+@pytest.fixture
+def conn(server_url):
+    """每個測試一個全新的資料庫，結束後刪除"""
+    name = f"gentle_gains_test_{uuid.uuid4().hex[:12]}"
+    with psycopg.connect(server_url, autocommit=True) as admin:
+        admin.execute(f'create database "{name}" encoding \'UTF8\' template template0')  # 跟 Supabase 一樣用 UTF8
+    connection = psycopg.connect(server_url.rsplit("/", 1)[0] + f"/{name}", autocommit=True, row_factory=dict_row)
+    try:
+        connection.execute(BASE_SCHEMA)
+        yield connection
+    finally:
+        connection.close()
+        with psycopg.connect(server_url, autocommit=True) as admin:
+            admin.execute(f'drop database "{name}" with (force)')
+
+
+def apply_migrations(conn, until: str | None = None, after: str | None = None):
+    """依檔名順序套用 migrations，until / after 可以只套用其中一段 (兩者都包含 / 不包含該檔案本身)"""
+    for path in sorted(glob.glob(os.path.join(MIGRATIONS_DIR, "*.sql"))):
+        name = os.path.basename(path)
+        if after and name <= after:
+            continue
+        with open(path, encoding="utf-8") as f:
+            conn.execute(f.read())
+        if until and name >= until:
+            break
+
+
+# --- 讓 Repository 直接呼叫本機的資料庫函式 ---
+class _RpcCall:
+    def __init__(self, conn, name: str, params: dict):
+        self.conn, self.name, self.params = conn, name, params
+
+    def execute(self):
+        args = ", ".join(f"{key} => %({key})s" for key in self.params)
+        rows = self.conn.execute(f"select * from public.{self.name}({args})", self.params).fetchall()
+        return type("Response", (), {"data": rows})  # 跟 PostgREST 一樣是 list[dict]
+
+
+class PostgresRpcClient:
+    """只實作 Repository 儀表板查詢用到的 supabase.rpc(name, params).execute()"""
+    def __init__(self, conn):
+        self.conn = conn
+
+    def rpc(self, name: str, params: dict):
+        return _RpcCall(self.conn, name, params)
+
+
+# --- 測試資料 ---
+def _start_of_today_utc() -> datetime:
+    now_tw = datetime.now(TW_TZ)
+    return datetime(now_tw.year, now_tw.month, now_tw.day, tzinfo=TW_TZ).astimezone(timezone.utc)
+
+
+def boundary_times() -> list:
+    """台北時間本月 1 號、今天、明天午夜前後的時間點 (UTC 的日期都是前一天)"""
+    second = timedelta(seconds=1)
+    month_start, today_start = start_of_month_utc(), _start_of_today_utc()
+    times = []
+    for midnight in (month_start, month_start + timedelta(days=1), today_start, today_start + timedelta(days=1)):
+        times += [midnight - second, midnight, midnight + second, midnight + timedelta(hours=7, minutes=59, seconds=59),
+                  midnight + timedelta(hours=8)]
+    return times
+
+
+def seed(conn, rng: random.Random, n: int = 60):
+    """在邊界時間與本月前後的隨機時間塞入記錄，回傳 (workouts, foods)"""
+    month_start = start_of_month_utc()
+    times = boundary_times() + [month_start + timedelta(seconds=rng.randrange(-10 * 86400, 40 * 86400)) for _ in range(n)]
+    workouts, foods = [], []
+    for created_at in times:
+        workout = {"created_at": created_at, "exercise_name": rng.choice(["臥推", "深蹲", "硬舉", "肩推"]),
+                   "body_part": rng.choice(BODY_PARTS[:-1]),  # 故意不放「核心」，確認沒練到的部位也會列出來
+                   "weight": rng.choice([20, 42.5, 60, 100.25]), "sets": rng.randrange(1, 6), "reps": rng.randrange(1, 13)}
+        food = {"created_at": created_at, "food_name": "便當", "meal_type": "lunch", "calories": rng.randrange(100, 900),
+                "protein": rng.randrange(0, 60), "fat": rng.randrange(0, 40), "carbs": rng.randrange(0, 120)}
+        conn.execute("insert into public.workout_logs (created_at, exercise_name, body_part, weight, sets, reps) "
+                     "values (%(created_at)s, %(exercise_name)s, %(body_part)s, %(weight)s, %(sets)s, %(reps)s)", workout)
+        conn.execute("insert into public.food_logs (created_at, food_name, meal_type, calories, protein, fat, carbs) "
+                     "values (%(created_at)s, %(food_name)s, %(meal_type)s, %(calories)s, %(protein)s, %(fat)s, %(carbs)s)", food)
+        workouts.append(workout)
+        foods.append(food)
+    return workouts, foods
+
+
+# --- 原本在 Python 逐筆彙總的做法 (RPC 之前的版本) ---
+def legacy_heatmap(workouts: list) -> dict:
+    """
+    原本的 build_heatmap，只有日期改用台北時間
+    (原本取 UTC 字串的日期部分，台北 00:00~07:59 的訓練會算到前一天，這是 RPC 刻意修正的地方)
+    """
+    since = start_of_month_utc()
+    return dict(Counter(row["created_at"].astimezone(TW_TZ).date().isoformat() for row in workouts if row["created_at"] >= since))
+
+
+def legacy_body_part_stats(workouts: list) -> list:
+    since = start_of_month_utc()
+    stats = Counter(row["body_part"] for row in workouts if row["created_at"] >= since)
+    return [{"body_part": part, "count": stats.get(part, 0)} for part in BODY_PARTS]
+
+
+def legacy_today_summary(foods: list) -> dict:
+    since = _start_of_today_utc()
+    summary = {"calories": 0, "protein": 0, "fat": 0, "carbs": 0}
+    for row in foods:
+        if row["created_at"] >= since:
+            for key in summary:
+                summary[key] += row[key]
+    return summary
+
+
+def assert_dashboard_matches(conn, workouts: list, foods: list):
+    client = PostgresRpcClient(conn)
+    workout_repo, food_repo = WorkOutRepository(client), FoodRepository(client)
+
+    heatmap = workout_repo.get_workout_heatmap_month()
+    assert {row["date"]: row["count"] for row in heatmap} == legacy_heatmap(workouts)
+    assert [row["date"] for row in heatmap] == sorted(row["date"] for row in heatmap)
+    assert workout_repo.get_body_part_stats_month() == legacy_body_part_stats(workouts)
+    assert food_repo.get_today_summary() == legacy_today_summary(foods)
+
+
+def test_dashboard_rpcs_on_raw_logs(conn):
+    """20261017000100：直接在原始記錄上 GROUP BY"""
+    apply_migrations(conn, until=DASHBOARD_MIGRATION)
+    workouts, foods = seed(conn, random.Random(1))
+    assert_dashboard_matches(conn, workouts, foods)
+
+
+def test_dashboard_rpcs_on_daily_rollups(conn):
+    """20261017000200 之後：改讀每日彙總表，migration 前的記錄靠回填，之後的靠 trigger，兩者都要算對"""
+    apply_migrations(conn, until=DASHBOARD_MIGRATION)
+    workouts, foods = seed(conn, random.Random(2))
+    apply_migrations(conn, after=DASHBOARD_MIGRATION)
+    more_workouts, more_foods = seed(conn, random.Random(3))
+    assert_dashboard_matches(conn, workouts + more_workouts, foods + more_foods)
+
+
+def test_month_start_is_taipei_midnight(conn):
+    """預設參數 dashboard_month_start() 與後端的 start_of_month_utc() 相同，並以台北時間切日期"""
+    apply_migrations(conn)
+    row = conn.execute("select public.dashboard_month_start() as start_at").fetchone()
+    assert row["start_at"] == start_of_month_utc()
+
+    # UTC 是前一天 16:00，台北已經是 1 號 00:00
+    conn.execute("insert into public.workout_logs (created_at, exercise_name, body_part, weight, sets, reps) "
+                 "values (%s, '臥推', '胸部', 60, 3, 10), (%s, '臥推', '胸部', 60, 3, 10)",
+                 (start_of_month_utc(), start_of_month_utc() - timedelta(seconds=1)))
+    rows = conn.execute("select * from public.dashboard_workout_heatmap()").fetchall()
+    assert rows == [{"date": start_of_month_utc().astimezone(TW_TZ).date().isoformat(), "count": 1}]
+
+
+def test_rebuild_rollups_blocks_writers(conn, server_url):
+    """rebuild_daily_rollups 的交易結束前，其他連線不能寫入原始記錄 (trigger 不會跟 delete / insert 交錯)"""
+    apply_migrations(conn)
+    seed(conn, random.Random(4), n=10)
+    db_url = server_url.rsplit("/", 1)[0] + "/" + conn.info.dbname
+    with psycopg.connect(db_url) as rebuilder, psycopg.connect(db_url, autocommit=True) as writer:
+        rebuilder.execute("select * from public.rebuild_daily_rollups()")  # 交易還沒 commit，鎖還在
+        writer.execute("set lock_timeout = '200ms'")
+        # 用一個彙總表沒有的日期，確認擋住的是資料表的鎖，而不是彙總表同一天的 unique
+        insert_old_day = ("insert into public.food_logs (created_at, calories, protein, fat, carbs) "
+                          "values ('2000-01-01T12:00:00+08:00', 100, 1, 1, 1)")
+        with pytest.raises(psycopg.errors.LockNotAvailable):
+            writer.execute(insert_old_day)
+        assert writer.execute("select count(*) from public.food_logs").fetchone()[0] > 0  # 讀取不受影響
+        rebuilder.commit()
+        writer.execute(insert_old_day)
@@ -0,0 +1,72 @@
+"""
+工具逾時 (app/services/tool_executor.py) 的測試
+逾時只是不再等待，thread 內的工具會繼續執行，重點是 LLM 拿到的訊息要跟實際有沒有寫入一致:
+- 「稍後再試」(可以重試) 之後，工具不可以再寫入，否則重試會多出一筆記錄
+- 寫入已經開始才逾時，要回傳「結果未知」(TOOL_UNKNOWN_PREFIX)
+"""
+import asyncio, time
+
+from app.services.tool_executor import offload_tool, mark_write_started, TOOL_ABANDONED_MESSAGE, TOOL_UNKNOWN_PREFIX
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_timeout_before_write_skips_the_write():
+    """準備階段 (例如 GoogleManager / build()) 就逾時：回傳可以重試的失敗訊息，之後 thread 也不會寫入"""
+    writes, marks = [], []
+
+    @offload_tool(timeout=0.2)
+    def slow_tool() -> str:
+        time.sleep(0.4)
+        started = mark_write_started()
+        marks.append(started)
+        if not started:
+            return TOOL_ABANDONED_MESSAGE
+        writes.append("row")
+        return "ok"
+
+    result = _run(slow_tool())
+    assert result.startswith("[工具調用失敗]") and not result.startswith(TOOL_UNKNOWN_PREFIX)
+    time.sleep(0.4)  # 等 thread 跑完
+    assert marks == [False]
+    assert writes == []
+
+
+def test_timeout_after_write_started_reports_unknown():
+    """寫入開始後才逾時：資料可能已經寫入，回傳結果未知，不要讓 LLM 重試"""
+    writes = []
+
+    @offload_tool(timeout=0.2)
+    def slow_write() -> str:
+        assert mark_write_started()
+        time.sleep(0.4)
+        writes.append("row")
+        return "ok"
+
+    result = _run(slow_write())
+    assert result.startswith(TOOL_UNKNOWN_PREFIX)
+    time.sleep(0.4)
+    assert writes == ["row"]
+
+
+def test_async_tool_timeout_before_write():
+    """async 工具逾時會被取消，一樣回傳可以重試的失敗訊息"""
+    writes = []
+
+    @offload_tool(timeout=0.2)
+    async def slow_async_tool() -> str:
+        await asyncio.sleep(0.4)
+        if mark_write_started():
+            writes.append("row")
+        return "ok"
+
+    result = _run(slow_async_tool())
+    assert result.startswith("[工具調用失敗]")
+    assert writes == []
+
+
+def test_mark_write_started_outside_tool():
+    """不是透過 offload_tool 呼叫 (例如 API 直接呼叫) 時照常寫入"""
+    assert mark_write_started() is True
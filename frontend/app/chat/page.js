@@ -227,6 +227,7 @@ export default function ChatPage() {
 
             const reader = response.body.getReader();  // 取得串流
             const decoder = new TextDecoder("utf-8");  // 將接收到的串流二進位位元組解碼成文字
+            let buffer = "";  // 還沒收完整的 frame (後端會合併文字，一個 frame 可能被切成兩次收到)
 
             // 只要持續有資料傳入，就會一直執行
             while (true) {
@@ -235,9 +236,10 @@ export default function ChatPage() {
                 const { done, value } = await reader.read();  // 每次讀取的串流資料
                 if (done) break;
 
-                const chunk = decoder.decode(value, { stream: true });
-                // 後端傳的資料用 SSE 格式，是以兩個換行符號 \n\n 分隔
-                const lines = chunk.split("\n\n");
+                buffer += decoder.decode(value, { stream: true });
+                // 後端傳的資料用 SSE 格式，是以兩個換行符號 \n\n 分隔，最後一段可能還沒收完，留到下一次再解析
+                const lines = buffer.split("\n\n");
+                buffer = lines.pop();
                 console.log(lines);
 
                 // 解析每一個資料包